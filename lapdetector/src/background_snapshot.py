@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+#
+# Background snapshots: the learned background saved to disk, so a restart (ie. a power cycle between heats) starts
+# from the background it had instead of learning it from scratch while detection is blind or noisy.
+#
+# OpenCV's subtractors don't export their mixture models, so what's saved is the background image (the model's
+# most likely value of every pixel) plus what it was learned for: the model area (frame size, scaling and rows),
+# the subtractor and its settings, and when. On start, a snapshot only counts when all of that matches and the live
+# scene still looks like it, by a cheap test on both downscaled (the shapes of the scene, through a normalized
+# correlation, and its brightness). Then the new model is seeded with it in a single update, and the live frames
+# only have to refine it for a few frames.
+#
+# File: a .npz with the background image ("background") and the rest as JSON ("meta"), written under a temporary
+# name first so a crash mid-write never leaves a broken snapshot behind.
+#
+
+SIMILARITY_WIDTH = 64   # Both images are compared at this width: the scene, not its noise
+
+
+def save_snapshot(path, background_image, model_key, subtractor, frame_time=None):
+    meta = {
+        "model_key": list(model_key),
+        "subtractor": subtractor,
+        "shape": list(background_image.shape),
+        "time": time.time() if frame_time is None else frame_time,
+    }
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, background=background_image, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8))
+    os.replace(path + ".tmp", path)
+
+
+def load_snapshot(path):
+    """(background image, meta) of a snapshot, None when there's none or it can't be read."""
+    try:
+        with np.load(path) as data:
+            return data["background"], json.loads(data["meta"].tobytes())
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def matches(meta, background_image, model_key, subtractor):
+    """The snapshot was learned for the same model area, with the same subtractor and settings."""
+    return (tuple(meta["model_key"]) == tuple(model_key) and meta["subtractor"] == subtractor and
+            tuple(background_image.shape) == tuple(meta["shape"]))
+
+
+def scene_similarity(background_image, frame):
+    """
+    (correlation, brightness shift) of a background and a live frame of the same size: the normalized correlation
+    of both downscaled (1 for the same scene, whatever the exposure), and the difference of their mean gray levels.
+    """
+    height = max(1, round(background_image.shape[0] * SIMILARITY_WIDTH / background_image.shape[1]))
+    a = cv2.resize(background_image, (SIMILARITY_WIDTH, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+    b = cv2.resize(frame, (SIMILARITY_WIDTH, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+    correlation = float(cv2.matchTemplate(a, b, cv2.TM_CCOEFF_NORMED)[0, 0])
+    return correlation, abs(float(a.mean()) - float(b.mean()))
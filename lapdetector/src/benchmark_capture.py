@@ -0,0 +1,292 @@
+#
+# Headless benchmark of capture_frames(): runs the detector over a synthetic scene (or a recorded clip)
+# as fast as possible and reports FPS and detection latency, so performance regressions can be caught
+# on a regular Linux box before deploying to the track.
+#
+#   python benchmark_capture.py                      # synthetic scene, 30 seconds of scene time
+#   python benchmark_capture.py --seconds 60 --json results.json
+#   python benchmark_capture.py --video clip.mp4     # Scored against clip.mp4.crossings.json when there is one
+#   python benchmark_capture.py --multi-object --lanes --interval 0.4    # Cars in both lanes, close together
+#   python benchmark_capture.py --tracker KALMAN --background KNN --set MIN_COUNTOUR_AREA=0.01
+#   python benchmark_capture.py --multiprocess       # Post-processing in its own processes, through the shared-memory ring
+#
+# Recorded clips are annotated with a JSON file listing their ground truth crossings, the first frame with the car's
+# leading edge over the meta line (or its time into the clip, at the detector's FRAME_FPS):
+#
+#   {"crossings": [{"frame": 412, "direction": 1}, {"time": 21.35, "direction": 2}]}
+#
+# Directions as in the detector: 1 for left to right, 2 for right to left.
+#
+import argparse
+import ast
+import json
+import math
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+
+os.environ.setdefault("LAPDETECTOR_SOURCE", "synthetic:fast")   # Never touch the camera when benchmarking
+
+import rpi_lap_cam_detector as detector
+from frame_sources import SyntheticFrameSource, VideoFrameSource
+from stage_metrics import format_stage_summary
+
+
+def drain_crossings(crossings, stop_event):
+    # Stands in for processMetaCrossing: records when each crossing came out of post-processing
+    while not stop_event.is_set():
+        try:
+            item = detector.meta_crossing_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        for crossing in item[6]:    # Several cars may cross in the same frame
+            crossings.append({"direction": crossing["direction"], "frame_time": item[1], "crossing_time": crossing["crossing_time"],
+                              "uncertainty": crossing["uncertainty"], "before_track_start": crossing.get("before_track_start", False),
+                              "received_at": time.time()})
+        if item[5] is not None:
+            item[5].release()   # Frame pool slot
+
+
+def watch_stream(subscriber, stop_event):
+    # Stands in for a browser: keeps pulling the latest frame of the stream
+    while not stop_event.is_set():
+        subscriber.get(timeout=0.1)
+    subscriber.close()
+
+
+class CrossingsOnly:
+    # Crossings from the post-processing processes, without their images: the detector encodes them right there,
+    # so pickling them back would only add latency that isn't there
+    def __init__(self, crossings_queue):
+        self.crossings_queue = crossings_queue
+
+    def put(self, item, block=True, timeout=None):
+        self.crossings_queue.put((item[0], item[1], None, None, None, None, item[6]), block, timeout)
+
+    def get(self, block=True, timeout=None):
+        return self.crossings_queue.get(block, timeout)
+
+
+def start_post_processing_processes():
+    # As in the detector's multi-process mode, but the capture loop stays in this process and crossings come back to it
+    ctx = mp.get_context("fork")
+    detector.post_processing_queue = detector.build_shared_frame_queue(ctx)
+    detector.meta_crossing_queue = CrossingsOnly(ctx.Queue(maxsize=detector.META_CROSSING_QUEUE_SIZE))
+    detector.streaming_frame_queue = ctx.Queue(maxsize=4)
+    processes = [ctx.Process(target=detector.framePostProcessingWorker, name=f"post-processing-{i}", daemon=True)
+                 for i in range(detector.POST_PROCESSING_PROCESSES)]
+    for process in processes:
+        process.start()
+    threading.Thread(target=detector.forwardStreamFrames, daemon=True).start()
+    return processes
+
+
+def load_annotations(path, fps):
+    """Ground truth crossings of a recorded clip, in the same form as SyntheticFrameSource.ground_truth."""
+    with open(path) as f:
+        annotations = json.load(f)
+    ground_truth = []
+    for crossing in annotations["crossings"]:
+        if "frame" in crossing:
+            frame_index = int(crossing["frame"])
+        else:
+            frame_index = math.ceil(round(crossing["time"] * fps, 6))
+        ground_truth.append({"frame_index": frame_index, "cross_time": crossing.get("time", frame_index / fps),
+                             "direction": crossing["direction"], "emitted_at": None})
+    return sorted(ground_truth, key=lambda truth: truth["frame_index"])
+
+
+def match_crossings(source, ground_truth, crossings, window_s):
+    # Each ground truth crossing is matched with the first detection in the same direction whose frame is
+    # at most window_s (scene time) after it. Frame timestamps are nominal ones: start_time + index / fps.
+    # Crossings beyond the last frame delivered are left out.
+    for c in crossings:
+        c["frame_index"] = int(round((c["frame_time"] - source.start_time) * source.fps))
+    window_frames = int(window_s * source.fps)
+
+    results = []
+    pending = list(crossings)
+    for truth in ground_truth:
+        if truth["frame_index"] > source.frame_index:
+            continue
+        match = None
+        for c in pending:
+            if c["direction"] == truth["direction"] and 0 <= c["frame_index"] - truth["frame_index"] <= window_frames:
+                match = c
+                break
+        if match is None:
+            results.append({"cross_time": truth["cross_time"], "detected": False})
+            continue
+        pending.remove(match)
+        results.append({
+            "cross_time": truth["cross_time"],
+            "detected": True,
+            "frames_late": match["frame_index"] - truth["frame_index"],
+            "timing_error_ms": 1000 * (match["crossing_time"] - (source.start_time + truth["cross_time"])),
+            "uncertainty_ms": 1000 * match["uncertainty"],
+            "before_track_start": match["before_track_start"],
+            # Only known for the synthetic scene, which records when each crossing frame was delivered
+            "latency_ms": 1000 * (match["received_at"] - truth["emitted_at"]) if truth["emitted_at"] else None,
+        })
+    return results, pending
+
+
+def parse_override(text):
+    # NAME=VALUE, the value as a Python literal (0.01, None, ((0.3, 0.5),)...) or else a plain string (KNN)
+    name, _, value = text.partition("=")
+    if not name.isupper() or not hasattr(detector, name):
+        raise argparse.ArgumentTypeError(f"{name} is not a detector setting")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def stage_costs(snapshot, frames):
+    # Recent percentiles, plus the whole run averages: per call (mean) and spread over every frame (per_frame),
+    # which is what a stage really costs when it only runs in some modes
+    return {stage: dict(histogram["recent"], count=histogram["count"], mean=histogram["sum"] / max(1, histogram["count"]),
+                        per_frame=histogram["sum"] / max(1, frames))
+            for stage, histogram in snapshot["stages"].items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark capture_frames() without a camera")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Synthetic scene duration, in scene seconds")
+    parser.add_argument("--video", help="Replay a video file / image sequence instead of the synthetic scene")
+    parser.add_argument("--meta-strip", action="store_true", help="Enable the meta strip (line-scan) detection mode")
+    parser.add_argument("--viewers", type=int, default=1, help="Simulated viewers of each video stream")
+    parser.add_argument("--annotations", help="Ground truth crossings of the --video clip (default: <video>.crossings.json, when it exists)")
+    parser.add_argument("--tracker", choices=list(detector.AVAILABLE_TRACKERS), help="Tracker type (the detector's default otherwise)")
+    parser.add_argument("--background", choices=["MOG2", "KNN"], help="Background subtractor (the detector's default otherwise)")
+    parser.add_argument("--set", action="append", default=[], type=parse_override, metavar="NAME=VALUE",
+                        help="Override any detector setting, ie. --set MIN_COUNTOUR_AREA=0.01 (repeatable)")
+    parser.add_argument("--multi-object", action="store_true", help="Enable multi-object tracking")
+    parser.add_argument("--multiprocess", action="store_true", help="Post-process in POST_PROCESSING_PROCESSES processes (MULTIPROCESS_MODE)")
+    parser.add_argument("--lanes", action="store_true", help="Use the two lanes of the synthetic track (with --multi-object)")
+    parser.add_argument("--interval", type=float, default=3.0, help="Scene seconds between synthetic crossings (alternating lanes)")
+    parser.add_argument("--match-window", type=float, default=0.5, help="Max scene seconds between a crossing and its detection")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    # Settings first: the frame source is built out of them (size, FPS, meta line, second stream)
+    settings = {
+        "META_STRIP_MODE": args.meta_strip,
+        "MULTI_OBJECT_TRACKING": args.multi_object,
+        "MULTIPROCESS_MODE": args.multiprocess,
+        "BACKGROUND_SNAPSHOT_FILE": None,   # Every run starts cold and leaves nothing behind (unless --set says otherwise)
+    }
+    if args.tracker:
+        settings["TRACKER_TYPE"] = args.tracker
+    if args.background:
+        settings["BACKGROUND_SUBTRACTOR"] = args.background
+    settings.update(args.set)
+    try:
+        detector.configure(settings)    # Also builds again what's derived from them, ie. the detection settings snapshot
+    except ValueError as e:
+        parser.error(str(e))
+    if args.lanes:
+        detector.detection_config = detector.detection_config._replace(lanes=((0.30, 0.54), (0.54, 0.78)))
+
+    width, height, fps = detector.FRAME_WIDTH, detector.FRAME_HEIGHT, detector.FRAME_FPS
+    lores_scaling = detector.FRAME_SCALING if detector.DUAL_STREAM_MODE else None
+    if args.video:
+        source = VideoFrameSource(args.video, width, height, fps, lores_scaling, realtime=False)
+    else:
+        car_passes = SyntheticFrameSource.default_car_passes(width, height, args.seconds, interval=args.interval)
+        source = SyntheticFrameSource(width, height, fps, detector.META_LINE_X_PX, lores_scaling, car_passes,
+                                      duration=args.seconds, realtime=False)
+    ground_truth = None
+    if isinstance(source, SyntheticFrameSource):
+        ground_truth = source.ground_truth
+    else:
+        annotations = args.annotations or args.video + ".crossings.json"
+        if args.annotations or os.path.exists(annotations):
+            ground_truth = load_annotations(annotations, fps)
+    detector.frame_source = source
+
+    stop_event = threading.Event()
+    crossings = []
+    viewers = [hub.subscribe() for hub in detector.stream_hubs.values() for _ in range(args.viewers)]   # Before forking
+    post_processes = []
+    if detector.MULTIPROCESS_MODE:
+        post_processes = start_post_processing_processes()
+    else:
+        threading.Thread(target=detector.framePostProcessingWorker, daemon=True).start()
+    threading.Thread(target=drain_crossings, args=(crossings, stop_event), daemon=True).start()
+    for subscriber in viewers:
+        threading.Thread(target=watch_stream, args=(subscriber, stop_event), daemon=True).start()
+
+    start = time.time()
+    detector.capture_frames()
+    elapsed = time.time() - start
+    time.sleep(0.5)     # Let post-processing flush the last crossings
+    stop_event.set()
+    for process in post_processes:
+        process.terminate()
+    if post_processes:
+        detector.post_processing_queue.close(unlink=True)
+
+    frames = source.frame_index + 1
+    summary = {
+        "source": args.video or "synthetic",
+        "resolution": [width, height],
+        "frame_scaling": detector.FRAME_SCALING,
+        "meta_strip_mode": detector.META_STRIP_MODE,
+        "tracker": detector.TRACKER_TYPE,
+        "background_subtractor": detector.BACKGROUND_SUBTRACTOR,
+        "overrides": dict(args.set),
+        "multi_object_tracking": detector.MULTI_OBJECT_TRACKING,
+        "multiprocess_mode": detector.MULTIPROCESS_MODE,
+        "lanes": detector.detection_config.lanes,
+        "viewers_per_stream": args.viewers,
+        "stream_frames_delivered": sum(s.delivered for s in viewers),
+        "frames": frames,
+        "elapsed_s": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "crossings_detected": len(crossings),
+        "stages": stage_costs(detector.stage_metrics.snapshot(), frames),
+    }
+
+    if ground_truth is not None:
+        matches, false_crossings = match_crossings(source, ground_truth, crossings, args.match_window)
+        latencies = sorted(m["latency_ms"] for m in matches if m["detected"] and m["latency_ms"] is not None)
+        timing_errors = sorted(abs(m["timing_error_ms"]) for m in matches if m["detected"])
+        summary.update({
+            "crossings_expected": len(matches),
+            "crossings_missed": sum(1 for m in matches if not m["detected"]),
+            "crossings_false": len(false_crossings),
+            "latency_ms_avg": sum(latencies) / len(latencies) if latencies else None,
+            "latency_ms_max": latencies[-1] if latencies else None,
+            "timing_error_ms_avg": sum(timing_errors) / len(timing_errors) if timing_errors else None,
+            "timing_error_ms_max": timing_errors[-1] if timing_errors else None,
+            # Crossings whose error is within their own uncertainty (plus a frame: annotated clips only know the crossing frame): the claim holds
+            "timing_within_uncertainty": sum(1 for m in matches if m["detected"] and
+                                             abs(m["timing_error_ms"]) <= m["uncertainty_ms"] + 1000 / detector.FRAME_FPS),
+            "timing_before_track_start": sum(1 for m in matches if m["detected"] and m["before_track_start"]),
+            "crossings": matches,
+        })
+
+    print(f"\n{frames} frames in {elapsed:.2f}s: {summary['fps']:.1f} FPS")
+    print("Stages p50/p95/p99/max:\n  " + "\n  ".join(format_stage_summary({"main": detector.stage_metrics.snapshot()})))
+    if "crossings_expected" in summary:
+        print(f"Crossings expected/missed/false: {summary['crossings_expected']}/{summary['crossings_missed']}/{summary['crossings_false']}")
+        if summary["latency_ms_avg"] is not None:
+            print(f"Detection latency avg/max: {summary['latency_ms_avg']:.1f}/{summary['latency_ms_max']:.1f} ms")
+        if summary["timing_error_ms_avg"] is not None:
+            print(f"Crossing time error avg/max: {summary['timing_error_ms_avg']:.1f}/{summary['timing_error_ms_max']:.1f} ms, "
+                  f"{summary['timing_within_uncertainty']}/{len(timing_errors)} within their uncertainty, "
+                  f"{summary['timing_before_track_start']} before track start")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
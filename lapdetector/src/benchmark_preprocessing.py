@@ -0,0 +1,86 @@
+#
+# Micro-benchmark of the frame preprocessing alone: the original full frame path (blur, resize, gray, crop) against
+# the ROI-first one (crop, gray, area downscale into reused buffers), over the same sample frames. What's cropped
+# is the background model area (the band plus BACKGROUND_MODEL_MARGIN, or the whole frame when it's None).
+#
+#   python benchmark_preprocessing.py                    # synthetic frames, detector config
+#   python benchmark_preprocessing.py --video clip.mp4 --frames 300
+#
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import rpi_lap_cam_detector as detector
+from frame_sources import SyntheticFrameSource, VideoFrameSource
+from preprocessing import BandPreprocessor, legacy_preprocess
+
+
+def time_path(name, frames, preprocess, repeat):
+    times = []
+    for _ in range(repeat):
+        for frame in frames:
+            start = time.perf_counter()
+            preprocess(frame)
+            times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {"path": name, "ms_avg": float(times.mean()), "ms_p50": float(np.median(times)),
+            "ms_p95": float(np.percentile(times, 95)), "ms_max": float(times.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the frame preprocessing paths")
+    parser.add_argument("--video", help="Take the sample frames from a video file / image sequence instead of the synthetic scene")
+    parser.add_argument("--frames", type=int, default=120, help="Sample frames")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the sample frames")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    width, height, fps = detector.FRAME_WIDTH, detector.FRAME_HEIGHT, detector.FRAME_FPS
+    if args.video:
+        source = VideoFrameSource(args.video, width, height, fps, realtime=False)
+    else:
+        source = SyntheticFrameSource(width, height, fps, detector.META_LINE_X_PX, realtime=False)
+    source.start()
+    frames = []
+    while len(frames) < args.frames:
+        frame = source.capture_array("main")
+        if frame is None:
+            break
+        frames.append(frame.copy())
+    source.stop()
+
+    preprocessor = BandPreprocessor()
+    geometry = preprocessor.update_geometry(frames[0].shape, detector.FRAME_SCALING, detector.detection_config,
+                                            detector.BACKGROUND_MODEL_MARGIN)
+    legacy = time_path("legacy", frames, lambda frame: legacy_preprocess(frame, geometry), args.repeat)
+    roi_first = time_path("roi_first", frames, preprocessor.process, args.repeat)
+
+    # Both paths should see (almost) the same image
+    difference = np.mean([np.abs(legacy_preprocess(frame, geometry).astype(np.int16) - preprocessor.process(frame)).mean()
+                          for frame in frames])
+
+    results = {
+        "resolution": [width, height],
+        "frame_scaling": detector.FRAME_SCALING,
+        "model_rows": [geometry.model_y1, geometry.model_y2],
+        "frames": len(frames),
+        "paths": [legacy, roi_first],
+        "speedup": legacy["ms_avg"] / roi_first["ms_avg"],
+        "mean_abs_difference": float(difference),
+    }
+    for path in results["paths"]:
+        print(f"{path['path']:>10}: {path['ms_avg']:.2f} ms avg, p50/p95/max {path['ms_p50']:.2f}/{path['ms_p95']:.2f}/{path['ms_max']:.2f} ms")
+    print(f"Speedup: {results['speedup']:.1f}x, mean abs difference between outputs: {difference:.2f} gray levels")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
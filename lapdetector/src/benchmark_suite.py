@@ -0,0 +1,183 @@
+#
+# Offline accuracy and cost benchmark of the detector settings: runs the whole detection state machine (through
+# benchmark_capture.py, headless and as fast as possible) over annotated clips, once per combination of the
+# settings given, and appends one JSON line per run to a results file: ms/frame per stage, missed and false
+# crossings, crossing time error. Every line carries the commit and the host, so runs from different days (or
+# branches, or boards) can go to the same file and be compared later with --report.
+#
+# Each run is a fresh process: the detector keeps its state in module globals (background model, trackers,
+# metrics), so nothing leaks from one combination to the next.
+#
+#   python benchmark_suite.py                                  # Synthetic scene, MOG2/KNN x MOSSE/KALMAN
+#   python benchmark_suite.py --clips synthetic clip.mp4 --tracker MOSSE CSRT KALMAN
+#   python benchmark_suite.py --grid MIN_COUNTOUR_AREA 0.01 0.02 --grid TRACKING_RESILIENCE_LIMIT 0.05 0.2
+#   python benchmark_suite.py --multi-object --lanes --interval 0.4 --label "dense traffic"
+#   python benchmark_suite.py --report                         # Table of everything in the results file
+#
+# Recorded clips are scored against their annotations (see benchmark_capture.py): clip.mp4.crossings.json.
+#
+import argparse
+import ast
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setting_value(text):
+    # As benchmark_capture.py reads it: a Python literal, or else a plain string
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def combinations(args):
+    """Every combination of the settings given, as {setting: value} dicts."""
+    axes = [("BACKGROUND_SUBTRACTOR", args.background), ("TRACKER_TYPE", args.tracker)]
+    axes += [(grid[0], [setting_value(value) for value in grid[1:]]) for grid in args.grid]
+    names = [name for name, _ in axes]
+    return [dict(zip(names, values)) for values in itertools.product(*(values for _, values in axes))]
+
+
+def run_benchmark(clip, config, args):
+    """One benchmark_capture.py run. Returns (summary, None) or (None, error)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "result.json")
+        command = [sys.executable, os.path.join(HERE, "benchmark_capture.py"), "--json", output,
+                   "--match-window", str(args.match_window)]
+        if clip == "synthetic":
+            command += ["--seconds", str(args.seconds), "--interval", str(args.interval)]
+        else:
+            command += ["--video", clip]
+        if args.multi_object:
+            command.append("--multi-object")
+        if args.lanes:
+            command.append("--lanes")
+        command += ["--background", config["BACKGROUND_SUBTRACTOR"], "--tracker", config["TRACKER_TYPE"]]
+        for name, value in config.items():
+            if name not in ("BACKGROUND_SUBTRACTOR", "TRACKER_TYPE"):
+                command += ["--set", f"{name}={value!r}"]
+
+        env = dict(os.environ, LAPDETECTOR_SPOOL_DIR=os.path.join(tmp, "spool"))     # Never spool into the real one
+        try:
+            completed = subprocess.run(command, cwd=HERE, env=env, capture_output=True, text=True, timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            return None, f"timed out after {args.timeout} s"
+        if completed.returncode != 0 or not os.path.exists(output):
+            lines = (completed.stderr or completed.stdout).strip().splitlines()
+            return None, lines[-1] if lines else f"exit code {completed.returncode}"
+        with open(output) as f:
+            return json.load(f), None
+
+
+def describe(config):
+    return " ".join(str(value) if name in ("BACKGROUND_SUBTRACTOR", "TRACKER_TYPE") else f"{name}={value}"
+                    for name, value in config.items())
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{1000 * seconds:.2f}"
+
+
+def print_table(records):
+    header = (f"{'commit':<14} {'clip':<16} {'config':<48} {'fps':>7} {'ms/frame':>9} {'tracking':>9} "
+              f"{'missed':>8} {'false':>6} {'error avg/max ms':>17}")
+    print(header)
+    print("-" * len(header))
+    for record in records:
+        clip = os.path.basename(record["clip"])[:16]
+        prefix = f"{(record.get('commit') or '-')[:14]:<14} {clip:<16} {describe(record['config'])[:48]:<48}"
+        result = record.get("result")
+        if result is None:
+            print(f"{prefix} FAILED: {record.get('error')}")
+            continue
+        stages = result["stages"]
+        processing = stages.get("processing", {}).get("per_frame")
+        # Whatever follows the car: the tracker, the per-track association, or both in the mixed runs
+        tracking = sum(stages.get(stage, {}).get("per_frame", 0) for stage in ("tracker", "tracker_init", "tracks"))
+        if "crossings_expected" in result:
+            missed = f"{result['crossings_missed']}/{result['crossings_expected']}"
+            false = str(result["crossings_false"])
+            error = ("-" if result["timing_error_ms_avg"] is None else
+                     f"{result['timing_error_ms_avg']:.1f}/{result['timing_error_ms_max']:.1f}")
+        else:
+            missed, false, error = "-", "-", "no ground truth"
+        print(f"{prefix} {result['fps']:>7.1f} {format_ms(processing):>9} {format_ms(tracking):>9} "
+              f"{missed:>8} {false:>6} {error:>17}")
+
+
+def read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detector settings over annotated clips")
+    parser.add_argument("--clips", nargs="+", default=["synthetic"],
+                        help="Video files / image sequences, or 'synthetic' for the synthetic scene")
+    parser.add_argument("--background", nargs="+", default=["MOG2", "KNN"], help="Background subtractors")
+    parser.add_argument("--tracker", nargs="+", default=["MOSSE", "KALMAN"], help="Trackers")
+    parser.add_argument("--grid", nargs="+", action="append", default=[], metavar=("SETTING", "VALUE"),
+                        help="Any other detector setting and its values, ie. --grid MIN_COUNTOUR_AREA 0.01 0.02 (repeatable)")
+    parser.add_argument("--multi-object", action="store_true", help="Enable multi-object tracking in every run")
+    parser.add_argument("--lanes", action="store_true", help="Use the two lanes of the synthetic track (with --multi-object)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Synthetic scene duration, in scene seconds")
+    parser.add_argument("--interval", type=float, default=3.0, help="Scene seconds between synthetic crossings")
+    parser.add_argument("--match-window", type=float, default=0.5, help="Max scene seconds between a crossing and its detection")
+    parser.add_argument("--timeout", type=float, default=900, help="Max seconds per run")
+    parser.add_argument("--label", help="Free text stored with every run (ie. what changed)")
+    parser.add_argument("--out", default="benchmark_results.jsonl", help="Results file, appended to")
+    parser.add_argument("--report", action="store_true", help="Only print the table of the results file")
+    args = parser.parse_args()
+
+    if args.report:
+        print_table(read_results(args.out))
+        return 0
+
+    for grid in args.grid:
+        if len(grid) < 2:
+            parser.error(f"--grid {grid[0]} needs at least one value")
+
+    suite = {
+        "suite_started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_revision(),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "label": args.label,
+    }
+    runs = [(clip, config) for clip in args.clips for config in combinations(args)]
+    records = []
+    for n, (clip, config) in enumerate(runs, 1):
+        print(f"[{n}/{len(runs)}] {os.path.basename(clip)}: {describe(config)}", flush=True)
+        start = time.time()
+        result, error = run_benchmark(clip, config, args)
+        record = dict(suite, clip=clip, config=config, multi_object_tracking=args.multi_object, lanes=args.lanes,
+                      run_s=round(time.time() - start, 2), result=result, error=error)
+        records.append(record)
+        with open(args.out, "a") as f:     # As soon as each run ends: an interrupted suite keeps what it ran
+            f.write(json.dumps(record) + "\n")
+
+    print()
+    print_table(records)
+    print(f"\n{len(records)} runs appended to {args.out}")
+    return 0 if all(record["result"] is not None for record in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
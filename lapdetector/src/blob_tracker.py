@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+
+#
+# Tracker following the foreground blob instead of correlating image patches, with the same init/update interface
+# as the OpenCV ones (so it can be picked in /set_tracker like any other).
+#
+# The background doesn't learn while tracking, so the background image at init is valid for the whole track. Every
+# update, a constant-velocity Kalman filter predicts where the car should be, the frame is compared against the
+# background only in a window around that prediction, and the blob found there corrects the filter. A few hundred
+# pixels of absdiff, threshold and contours, instead of an image correlation: next to nothing per frame.
+#
+# The box is the blob's, not a template's: it doesn't keep room for the front of a car the perspective already
+# hid (see the parallax problem), so it's where the car actually is when it gets to the meta line.
+#
+
+class KalmanBlobTracker:
+    def __init__(self, background_image, threshold=25, search_margin=0.5, max_missed_frames=3):
+        self.background = background_image          # Same size as the frames given to init/update (gray)
+        self.threshold = threshold                  # Gray levels from the background to be foreground
+        self.search_margin = search_margin          # Search window around the prediction, in box sizes
+        self.max_missed_frames = max_missed_frames  # Frames coasting on the prediction before giving up
+        self.kalman = None
+        self.size = None
+        self.missed_frames = 0
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+    def init(self, frame, bbox):
+        x, y, w, h = bbox
+        # State: center x, center y, velocity x, velocity y (pixels per update). Measurement: center x, center y
+        self.kalman = cv2.KalmanFilter(4, 2)
+        self.kalman.transitionMatrix = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=np.float32)
+        self.kalman.measurementMatrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0]], dtype=np.float32)
+        self.kalman.processNoiseCov = np.diag([1, 1, 4, 4]).astype(np.float32)
+        self.kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * 2
+        self.kalman.errorCovPost = np.diag([4, 4, 400, 400]).astype(np.float32)     # Speed unknown at first
+        self.kalman.statePost = np.array([[x + w / 2], [y + h / 2], [0], [0]], dtype=np.float32)
+        self.size = (float(w), float(h))
+        self.missed_frames = 0
+        return True
+
+    def update(self, frame):
+        """Returns (success, (x, y, w, h)), like the OpenCV trackers."""
+        cx, cy, vx, vy = self.kalman.predict().ravel()
+        w, h = self.size
+        predicted = (int(cx - w / 2), int(cy - h / 2), int(w), int(h))
+
+        # Search window: the predicted box, grown by the margin and by how far the car moves per frame
+        frame_h, frame_w = frame.shape[:2]
+        grow_x = self.search_margin * w + abs(vx)
+        grow_y = self.search_margin * h + abs(vy)
+        x1, x2 = max(0, int(cx - w / 2 - grow_x)), min(frame_w, int(cx + w / 2 + grow_x) + 1)
+        y1, y2 = max(0, int(cy - h / 2 - grow_y)), min(frame_h, int(cy + h / 2 + grow_y) + 1)
+        if x2 <= x1 or y2 <= y1:
+            return False, predicted     # Predicted out of the frame
+
+        diff = cv2.absdiff(frame[y1:y2, x1:x2], self.background[y1:y2, x1:x2])
+        _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self._kernel)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+        boxes = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 0.05 * w * h]
+        if not boxes:
+            self.missed_frames += 1
+            return self.missed_frames <= self.max_missed_frames, predicted
+
+        # The car may come in pieces: everything overlapping the prediction is the car. Or else, the closest piece
+        boxes = np.array(boxes)
+        overlapping = ((boxes[:, 0] < predicted[0] + predicted[2]) & (boxes[:, 0] + boxes[:, 2] > predicted[0]) &
+                       (boxes[:, 1] < predicted[1] + predicted[3]) & (boxes[:, 1] + boxes[:, 3] > predicted[1]))
+        if overlapping.any():
+            boxes = boxes[overlapping]
+        else:
+            centers = boxes[:, :2] + boxes[:, 2:] / 2
+            boxes = boxes[[np.argmin(np.hypot(centers[:, 0] - cx, centers[:, 1] - cy))]]
+        bx1, by1 = boxes[:, 0].min(), boxes[:, 1].min()
+        bx2, by2 = (boxes[:, 0] + boxes[:, 2]).max(), (boxes[:, 1] + boxes[:, 3]).max()
+
+        self.kalman.correct(np.array([[(bx1 + bx2) / 2], [(by1 + by2) / 2]], dtype=np.float32))
+        self.size = (0.5 * w + 0.5 * (bx2 - bx1), 0.5 * h + 0.5 * (by2 - by1))
+        self.missed_frames = 0
+        return True, (int(bx1), int(by1), int(bx2 - bx1), int(by2 - by1))
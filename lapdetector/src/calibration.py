@@ -0,0 +1,144 @@
+import json
+import math
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+#
+# Ground-plane calibration: where on the track (in meters) every pixel of the processing resolution is, so that
+# speeds come out in km/h.
+#
+# The mapping is either the camera model (height above the track, downward tilt and field of view, the values the
+# speed estimation always used) or a homography from image pixels to track meters, given as is or fitted from four
+# or more marks on the track whose positions were measured. Either way, it's evaluated once for every pixel of the
+# processing resolution into a lookup table, and again only when that resolution changes: a position per frame is
+# then two array reads, instead of trigonometry over Python lists.
+#
+# Speeds come from a least-squares fit of position over time on the last positions of a car (a small ring), rather
+# than from its first and last positions only: a box jittering by a pixel or two no longer swings the speed, and a
+# car slowing down shows it.
+#
+# Calibration file (JSON), one of:
+#   {"camera": {"height_m": 3.5, "tilt_deg": 30, "fov_h_deg": 66, "fov_v_deg": 41}}
+#   {"image_size": [1280, 720], "homography": [[...], [...], [...]]}
+#   {"image_size": [1280, 720], "image_points": [[x, y], ...], "world_points": [[X, Y], ...]}
+# image_size is the resolution the image points / homography refer to; any processing resolution works from it.
+#
+
+# Pi cam 3, 3.5 m above the track. tilt_deg: angle between the camera axis and the vertical (0 for straight down)
+DEFAULT_CAMERA = {"height_m": 3.5, "tilt_deg": 30, "fov_h_deg": 66, "fov_v_deg": 41}
+
+
+class GroundCalibration:
+    def __init__(self, camera=None, homography=None, image_size=None):
+        """camera: camera model parameters (see DEFAULT_CAMERA). Or homography: 3x3, from image_size pixels to meters."""
+        if homography is not None and image_size is None:
+            raise ValueError("A homography needs the image size its pixels refer to")
+        self.camera = dict(DEFAULT_CAMERA, **(camera or {})) if homography is None else None
+        self.homography = None if homography is None else np.asarray(homography, dtype=np.float64).reshape(3, 3)
+        self.image_size = image_size
+        self.table_size = None
+        self.world_x = None     # Track meters of the center of every pixel, NaN where the pixel doesn't see the track
+        self.world_y = None
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            settings = json.load(f)
+        if "homography" in settings:
+            return cls(homography=settings["homography"], image_size=settings.get("image_size"))
+        if "image_points" in settings:
+            image_points = np.asarray(settings["image_points"], dtype=np.float32)
+            world_points = np.asarray(settings["world_points"], dtype=np.float32)
+            if len(image_points) < 4 or len(image_points) != len(world_points):
+                raise ValueError(f"{path}: at least four image points, with their world points, are needed")
+            homography, _ = cv2.findHomography(image_points, world_points)
+            if homography is None:
+                raise ValueError(f"{path}: no homography fits those points (are three of them aligned?)")
+            return cls(homography=homography, image_size=settings.get("image_size"))
+        return cls(camera=settings.get("camera"))
+
+    def lookup_table(self, width, height):
+        """World X and Y of every pixel of a width x height image, computed again only when the size changes."""
+        if (width, height) == self.table_size:
+            return self.world_x, self.world_y
+
+        u, v = np.meshgrid(np.arange(width, dtype=np.float64) + 0.5, np.arange(height, dtype=np.float64) + 0.5)
+        if self.homography is not None:
+            points = np.stack((u * (self.image_size[0] / width), v * (self.image_size[1] / height), np.ones_like(u)))
+            world = np.tensordot(self.homography, points, axes=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                world_x, world_y = world[0] / world[2], world[1] / world[2]
+        else:
+            # Ray through every pixel (x right, y down, z along the camera axis), rotated by the tilt, up to where
+            # it meets the track
+            tan_h = math.tan(math.radians(self.camera["fov_h_deg"]) / 2)
+            tan_v = math.tan(math.radians(self.camera["fov_v_deg"]) / 2)
+            tilt = math.radians(self.camera["tilt_deg"])
+            ray_x = (u - width / 2) / (width / 2) * tan_h
+            ray_y = (v - height / 2) / (height / 2) * tan_v
+            down = ray_y * math.sin(tilt) + math.cos(tilt)
+            forward = math.sin(tilt) - ray_y * math.cos(tilt)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                distance = np.where(down > 0, self.camera["height_m"] / down, np.nan)     # Above the horizon: no track
+            world_x, world_y = distance * ray_x, distance * forward
+
+        self.world_x = world_x.astype(np.float32)
+        self.world_y = world_y.astype(np.float32)
+        self.table_size = (width, height)
+        return self.world_x, self.world_y
+
+    def world_point(self, x, y, width, height):
+        """Track meters (X, Y) of pixel (x, y) of a width x height image, clamped to the image."""
+        world_x, world_y = self.lookup_table(width, height)
+        col = min(max(int(x), 0), width - 1)
+        row = min(max(int(y), 0), height - 1)
+        return float(world_x[row, col]), float(world_y[row, col])
+
+
+class SpeedEstimator:
+    def __init__(self, window=12):
+        self.samples = deque(maxlen=window)     # Time, X, Y of the last {window} positions
+        self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.origin = None      # Times are kept relative to the first position, so sums of squares keep their precision
+        self.sum_t = self.sum_x = self.sum_y = self.sum_tt = self.sum_tx = self.sum_ty = 0.0
+
+    def _accumulate(self, t, x, y, sign):
+        self.sum_t += sign * t
+        self.sum_x += sign * x
+        self.sum_y += sign * y
+        self.sum_tt += sign * t * t
+        self.sum_tx += sign * t * x
+        self.sum_ty += sign * t * y
+
+    def add(self, timestamp, x, y):
+        if math.isnan(x) or math.isnan(y):
+            return      # Not on the track (above the horizon, out of the calibrated area)
+        if self.origin is None:
+            self.origin = timestamp
+        if len(self.samples) == self.samples.maxlen:
+            self._accumulate(*self.samples[0], -1)     # Leaving the ring
+        t = timestamp - self.origin
+        self.samples.append((t, x, y))
+        self._accumulate(t, x, y, 1)
+
+    def speed(self):
+        """
+        Meters per second, from a least-squares fit of the positions against time (running sums: no pass over the
+        ring). Signed as the X axis of the track (positive from left to right with the camera model). 0 until there
+        are two positions.
+        """
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        variance = n * self.sum_tt - self.sum_t * self.sum_t
+        if variance <= 1e-12:
+            return 0.0
+        speed_x = (n * self.sum_tx - self.sum_t * self.sum_x) / variance
+        speed_y = (n * self.sum_ty - self.sum_t * self.sum_y) / variance
+        return math.copysign(math.hypot(speed_x, speed_y), speed_x)
@@ -0,0 +1,82 @@
+import os
+
+import cv2
+import numpy as np
+
+
+#
+# Crossing images: what's cropped out of the frames, in which format, and the encoding itself, which runs in a
+# pool of worker processes.
+#
+# Encoding three full 720p JPEGs in a row, right when a lap happens, used to take a core (and the GIL) from the
+# capture loop for tens of ms. Now every image is its own task in the pool, so they're encoded at the same time,
+# in other processes. The images can be cropped to where the action is (the cars that crossed and the meta line,
+# plus a margin), which is a fraction of the pixels to encode and to upload, and a small thumbnail comes first.
+#
+# Everything here is a plain function of arrays and settings, so the pool workers don't need the detector state.
+#
+
+IMAGE_FORMATS = {
+    # Format: (extension, cv2 quality flag, MIME type)
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+    "png": (".png", None, "image/png"),     # Lossless: quality doesn't apply
+}
+PNG_COMPRESSION = 3     # Fast, and still most of the size gain of the highest level
+
+
+def image_name(name, image_format):
+    return name + IMAGE_FORMATS[image_format][0]
+
+
+def mime_type(file_name):
+    for extension, _, mime in IMAGE_FORMATS.values():
+        if file_name.endswith(extension):
+            return mime
+    return "application/octet-stream"
+
+
+def crop_region(frame_shape, bboxes, line_x, margin):
+    """
+    Region (x1, y1, x2, y2) of a frame covering the bboxes (full resolution (x, y, w, h)) and the meta line, grown by
+    margin (a fraction of its size) at every side. The whole frame when there's no bbox.
+    """
+    height, width = frame_shape[:2]
+    if not bboxes:
+        return 0, 0, width, height
+    boxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    x1 = min(int(boxes[:, 0].min()), line_x)
+    x2 = max(int((boxes[:, 0] + boxes[:, 2]).max()), line_x + 1)
+    y1, y2 = int(boxes[:, 1].min()), int((boxes[:, 1] + boxes[:, 3]).max())
+    grow_x, grow_y = int(margin * (x2 - x1)), int(margin * (y2 - y1))
+    return max(0, x1 - grow_x), max(0, y1 - grow_y), min(width, x2 + grow_x), min(height, y2 + grow_y)
+
+
+def encode_image(image, image_format="jpg", quality=90, max_width=None):
+    """Encoded bytes of an image, downscaled first to max_width (keeping its aspect) when it's wider."""
+    if max_width is not None and image.shape[1] > max_width:
+        height = max(1, round(image.shape[0] * max_width / image.shape[1]))
+        image = cv2.resize(image, (max_width, height), interpolation=cv2.INTER_AREA)
+    extension, quality_flag, _ = IMAGE_FORMATS[image_format]
+    if quality_flag is None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    else:
+        params = [quality_flag, int(quality)]
+    ok, data = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode a {image.shape} image as {image_format}")
+    return data.tobytes()
+
+
+def save_image(path, image, image_format="jpg", quality=90):
+    """Encodes an image into a file (never seen half-written under its name)."""
+    data = encode_image(image, image_format, quality)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return len(data)
+
+
+def warm_up():
+    # First task of every pool worker, so they're all forked right away (see the detector)
+    return True
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import struct
+
+
+#
+# Crossing events as data: everything the detector knows about a crossing, in a versioned schema, rather than the
+# second-resolution time string and direction the server used to get (and had to make the most of).
+#
+# An event is a plain dict: sub-millisecond timestamps (epoch seconds), the frame and crossing sequence numbers,
+# direction, lane, bbox (full resolution pixels), tracked speed and the confirmation score (edge pixels at the meta
+# line). Images are referenced by name and content hash, not carried: the event alone is a few hundred bytes as
+# JSON and about a hundred in binary, so it can go out right away, and images can follow in their own requests
+# (and an image shared by several events, ie. two cars crossing in the same frame, be sent once).
+#
+# Binary layout (little endian), version 1:
+#   header:  "LD", version (u8), flags (u8), crossing sequence (u32), frame sequence (u32),
+#            crossing time (f64), frame time (f64), uncertainty ms (f32), speed km/h (f32),
+#            direction (u8), lane (i8, -1 for none), bbox x, y, w, h (u16 each), edge pixels (u16),
+#            event id (16 bytes, the UUID)
+#   images:  count (u8), then per image: name length (u8), name (UTF-8), content hash (8 bytes)
+#   strings: burst, full_size, time: length (u8) and UTF-8 each, 0 for none (longer than 255 bytes: truncated)
+# Flags: 1 has a bbox, 2 has a speed, 4 has an uncertainty, 8 crossed before track start (the car was already over
+# the line when first tracked: the crossing time is when it was first seen, and the uncertainty how far back it may be).
+#
+
+SCHEMA_VERSION = 1
+BINARY_MAGIC = b"LD"
+BINARY_CONTENT_TYPE = "application/x-lapdetector-event"
+_HEADER = struct.Struct("<2sBBIIddffBb4HH16s")
+_STRINGS = ("burst", "full_size", "time")
+_HAS_BBOX, _HAS_SPEED, _HAS_UNCERTAINTY, _BEFORE_TRACK_START = 1, 2, 4, 8
+
+
+def crossing_event(crossing, time_text=None):
+    """The event of a crossing, as the capture loop describes it (see frame_crossings), without id nor images yet."""
+    event = {
+        "version": SCHEMA_VERSION,
+        "sequence": crossing.get("sequence", 0),
+        "frame": crossing.get("frame_sequence", 0),
+        "crossing_time": round(crossing["crossing_time"], 6),
+        "frame_time": round(crossing["frame_time"], 6),
+        "uncertainty_ms": round(1000 * crossing["uncertainty"], 2) if crossing.get("uncertainty") is not None else None,
+        "before_track_start": bool(crossing.get("before_track_start")),
+        "direction": crossing["direction"],
+        "lane": crossing.get("lane"),
+        "bbox": list(crossing["bbox"]) if crossing.get("bbox") is not None else None,
+        "speed_kmh": round(crossing["speed_kmh"], 2) if crossing.get("speed_kmh") is not None else None,
+        "edge_pixels": crossing.get("edge_pixels", 0),
+    }
+    if time_text is not None:
+        event["time"] = time_text
+    for name in ("burst", "full_size"):
+        if crossing.get(name):
+            event[name] = crossing[name]
+    return event
+
+
+def image_id(data):
+    """Content hash of an image: the same image always gets the same id."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def with_images(event, event_id, images):
+    """The event with its id and references to its images ([(name, bytes)])."""
+    return {**event, "event_id": event_id, "images": [[name, image_id(data)] for name, data in images]}
+
+
+def form_fields(event):
+    """
+    Multipart form fields (strings) of an event, as the original server takes them: time and crossing_status, and
+    everything else alongside. Events spooled before the schema existed are sent as they are.
+    """
+    if "version" not in event:
+        return event
+    fields = {
+        "time": event.get("time", ""),
+        "crossing_status": event["direction"],
+        "crossing_time": f"{event['crossing_time']:.6f}",
+        "frame_time": f"{event['frame_time']:.6f}",
+        "schema_version": event["version"],
+        "sequence": event["sequence"],
+        "frame": event["frame"],
+        "edge_pixels": event["edge_pixels"],
+    }
+    if event.get("uncertainty_ms") is not None:
+        fields["crossing_time_uncertainty_ms"] = f"{event['uncertainty_ms']:.2f}"
+    if event.get("before_track_start"):
+        fields["before_track_start"] = 1
+    if event.get("speed_kmh") is not None:
+        fields["speed_kmh"] = f"{event['speed_kmh']:.2f}"
+    if event.get("bbox") is not None:
+        fields["bbox"] = ",".join(str(v) for v in event["bbox"])
+    for name in ("lane", "burst", "full_size", "event_id"):
+        if event.get(name) is not None:
+            fields[name] = event[name]
+    return fields
+
+
+def to_json(event):
+    return json.dumps(event, separators=(",", ":")).encode()
+
+
+def to_binary(event):
+    flags = ((_HAS_BBOX if event.get("bbox") is not None else 0) |
+             (_HAS_SPEED if event.get("speed_kmh") is not None else 0) |
+             (_HAS_UNCERTAINTY if event.get("uncertainty_ms") is not None else 0) |
+             (_BEFORE_TRACK_START if event.get("before_track_start") else 0))
+    bbox = [min(max(int(v), 0), 0xFFFF) for v in event.get("bbox") or (0, 0, 0, 0)]
+    parts = [_HEADER.pack(
+        BINARY_MAGIC, event["version"], flags, event["sequence"] & 0xFFFFFFFF, event["frame"] & 0xFFFFFFFF,
+        event["crossing_time"], event["frame_time"], event.get("uncertainty_ms") or 0.0, event.get("speed_kmh") or 0.0,
+        event["direction"], -1 if event.get("lane") is None else event["lane"], *bbox,
+        min(event.get("edge_pixels", 0), 0xFFFF), bytes.fromhex(event["event_id"]))]
+    images = event.get("images", [])
+    if len(images) > 0xFF:
+        raise ValueError(f"{len(images)} images, a binary crossing event takes up to 255")
+    parts.append(struct.pack("<B", len(images)))
+    for name, hash_hex in images:
+        parts.append(_short_string(name) + bytes.fromhex(hash_hex))
+    for name in _STRINGS:
+        parts.append(_short_string(event.get(name) or ""))
+    return b"".join(parts)
+
+
+def _short_string(text):
+    # Length (u8) and UTF-8, cut at 255 bytes without splitting a character
+    encoded = text.encode()[:0xFF].decode(errors="ignore").encode()
+    return struct.pack("<B", len(encoded)) + encoded
+
+
+def _read(data, offset, length):
+    # The bytes at offset, and the offset after them
+    if offset + length > len(data):
+        raise ValueError("Truncated crossing event")
+    return data[offset:offset + length], offset + length
+
+
+def _read_string(data, offset):
+    (length,), offset = _read(data, offset, 1)
+    encoded, offset = _read(data, offset, length)
+    try:
+        return encoded.decode(), offset
+    except UnicodeDecodeError:
+        raise ValueError("Crossing event string is not UTF-8") from None
+
+
+def from_binary(data):
+    """The event dict of a binary record (as to_binary got it). Raises ValueError on anything else."""
+    if len(data) < _HEADER.size or data[:2] != BINARY_MAGIC:
+        raise ValueError("Not a binary crossing event")
+    (_, version, flags, sequence, frame, crossing_time, frame_time, uncertainty_ms, speed_kmh, direction, lane,
+     x, y, w, h, edge_pixels, event_id) = _HEADER.unpack_from(data)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"Unknown crossing event version {version}")
+    event = {
+        "version": version,
+        "event_id": event_id.hex(),
+        "sequence": sequence,
+        "frame": frame,
+        "crossing_time": crossing_time,
+        "frame_time": frame_time,
+        "uncertainty_ms": round(uncertainty_ms, 2) if flags & _HAS_UNCERTAINTY else None,
+        "before_track_start": bool(flags & _BEFORE_TRACK_START),
+        "direction": direction,
+        "lane": None if lane < 0 else lane,
+        "bbox": [x, y, w, h] if flags & _HAS_BBOX else None,
+        "speed_kmh": round(speed_kmh, 2) if flags & _HAS_SPEED else None,
+        "edge_pixels": edge_pixels,
+    }
+    (count,), offset = _read(data, _HEADER.size, 1)
+    event["images"] = []
+    for _ in range(count):
+        name, offset = _read_string(data, offset)
+        image_hash, offset = _read(data, offset, 8)
+        event["images"].append([name, image_hash.hex()])
+    for name in _STRINGS:
+        text, offset = _read_string(data, offset)
+        if text:
+            event[name] = text
+    if offset != len(data):
+        raise ValueError(f"{len(data) - offset} unexpected bytes after the crossing event")
+    return event
+
+
+def pack_batch(records):
+    """Several binary events in one body: each one after its length (u16)."""
+    if any(len(record) > 0xFFFF for record in records):
+        raise ValueError("A binary crossing event over 64 KB can't be batched")
+    return b"".join(struct.pack("<H", len(record)) + record for record in records)
+
+
+def unpack_batch(data):
+    records, offset = [], 0
+    while offset < len(data):
+        length, offset = _read(data, offset, 2)
+        record, offset = _read(data, offset, struct.unpack("<H", length)[0])
+        records.append(record)
+    return records
@@ -0,0 +1,161 @@
+#
+# Stand-in for the events server, to try the publisher without the real backend: accepts crossing events
+# (one per request on /lap/<id>, or several on any path ending in /batch), as multipart forms, JSON or binary
+# (see event_schema), and their images PUT on their own; spots duplicates by event_id and prints the
+# crossing-to-server latency and the size of every event. It can also be made slow or flaky on purpose.
+#
+#   python event_server_stub.py --port 8080
+#   python event_server_stub.py --port 8080 --delay 0.05 --fail-rate 0.3
+#   LAPDETECTOR_SERVER_URL=http://localhost:8080 python rpi_lap_cam_detector.py
+#
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from event_schema import BINARY_CONTENT_TYPE, from_binary, unpack_batch
+
+
+class EventStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep-alive, like the real server
+
+    def log_message(self, format, *args):
+        pass
+
+    def receive(self):
+        """The request body, or None when this request is to fail."""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if random.random() < self.server.fail_rate:
+            self.reply(503, "Failing on purpose")
+            return None
+        return body
+
+    def do_POST(self):
+        received_at = time.time()
+        body = self.receive()
+        if body is None:
+            return
+
+        content_type = self.headers.get("Content-Type", "")
+        batch = self.path.endswith("/batch")
+        if content_type.startswith(BINARY_CONTENT_TYPE):
+            try:
+                records = unpack_batch(body) if batch else [body]
+                events = [(from_binary(record), len(record)) for record in records]
+            except ValueError as e:
+                self.reply(400, str(e))
+                return
+        elif content_type.startswith("application/json"):
+            events = json.loads(body)
+            events = [(event, len(json.dumps(event, separators=(",", ":")))) for event in (events if batch else [events])]
+        else:
+            fields, images = parse_multipart(content_type, body)
+            events = json.loads(fields.get("events", "[]")) if batch else [fields]
+            events = [({**event, "images": [[name, None] for name in images.get(event.get("event_id"), []) or images.get("image", [])]},
+                       None) for event in events]
+        for event, size in events:
+            self.server.record(event, [name for name, _ in event.get("images", [])], received_at, size)
+        self.reply(200, f"{len(events)} event(s) taken")
+
+    def do_PUT(self):
+        # An image of an event posted as JSON or binary
+        body = self.receive()
+        if body is None:
+            return
+        self.server.record_image(self.path.rsplit("/", 1)[-1], self.headers.get("X-Event-Id"),
+                                 self.headers.get("X-Image-Name"), len(body))
+        self.reply(200, "Image taken")
+
+    def reply(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_multipart(content_type, body):
+    """Returns ({field: value}, {form name: [file names]})."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    fields, images = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        file_name = part.get_filename()
+        if file_name is None:
+            fields[name] = part.get_content()
+        else:
+            images.setdefault(name, []).append(file_name)
+    return fields, images
+
+
+class EventStubServer(ThreadingHTTPServer):
+    def __init__(self, address, delay, fail_rate):
+        super().__init__(address, EventStubHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.duplicates = 0
+        self.latencies = []
+        self.images = {}    # Image id: size
+
+    def record(self, event, image_names, received_at, size=None):
+        event_id = event.get("event_id")
+        with self.lock:
+            duplicate = event_id in self.seen
+            self.seen.add(event_id)
+            self.duplicates += duplicate
+            latency = None
+            if "crossing_time" in event:
+                latency = 1000 * (received_at - float(event["crossing_time"]))
+                self.latencies.append(latency)
+        direction = event.get("direction", event.get("crossing_status"))
+        details = "".join(f", {name} {event[name]}" for name in ("speed_kmh", "lane", "bbox") if event.get(name) is not None)
+        print(f"{'DUPLICATE ' if duplicate else ''}{event.get('time')} direction {direction}{details} "
+              f"[{event_id}] {', '.join(image_names)}" + (f", {latency:.0f} ms after the crossing" if latency is not None else "") +
+              (f", {size} bytes" if size is not None else ""))
+
+    def record_image(self, image_id, event_id, name, size):
+        with self.lock:
+            duplicate = image_id in self.images
+            self.images[image_id] = size
+        print(f"  {'DUPLICATE ' if duplicate else ''}image {name} [{image_id}] of [{event_id}], {size} bytes")
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        text = f"{len(self.seen)} events, {self.duplicates} duplicates"
+        if self.images:
+            text += f", {len(self.images)} images ({sum(self.images.values()) // 1024} KB)"
+        if latencies:
+            text += (f", crossing-to-server latency p50/max: {latencies[len(latencies) // 2]:.0f}/{latencies[-1]:.0f} ms")
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the events server")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering every request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    server = EventStubServer(("0.0.0.0", args.port), args.delay, args.fail_rate)
+    print(f"Events server stub listening on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"\n{server.summary()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+#
+# Durable spool of crossing events waiting to be published.
+#
+# Events are written to disk as soon as their images are encoded, and only deleted once the server took them, so
+# neither a server outage nor a restart loses a lap, and memory stays flat however long the outage is. The index
+# lives in SQLite (WAL mode, so the processes encoding crossings and the publisher can share it), and the images
+# in plain files next to it: the database stays tiny and blobs are written and deleted without touching it.
+#
+# Delivery is at-least-once: an event may be posted again if the process dies right after the server took it,
+# so every event carries an idempotency key (event_id) for the server to spot duplicates. Events whose images
+# follow them as separate uploads are marked posted once the server took their record: if an image upload fails,
+# only the images are retried, not the event.
+#
+# When the spool grows over its disk cap, it's compacted by dropping the images of the oldest events. Their
+# metadata (ie. the lap times) is tiny and always kept.
+#
+
+class SpooledEvent:
+    def __init__(self, row_id, event_id, created, crossing_time, fields, images, attempts, posted=False):
+        self.row_id = row_id
+        self.event_id = event_id                # Idempotency key
+        self.created = created
+        self.crossing_time = crossing_time      # Frame time of the crossing, to join late attachments (photo finish)
+        self.fields = fields                    # The event (see event_schema), form fields for the ones spooled before it
+        self.images = images                    # [(file name, bytes)]
+        self.attempts = attempts
+        self.posted = posted                    # The server took the event itself, only its images are left
+
+
+class EventSpool:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.blob_directory = os.path.join(directory, "blobs")
+        self.max_bytes = max_bytes
+        os.makedirs(self.blob_directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self.compacted_events = 0   # Events whose images were dropped to stay under the disk cap (this process)
+
+        with self._lock:
+            self._db().execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id TEXT UNIQUE NOT NULL,
+                    created REAL NOT NULL,
+                    crossing_time REAL,
+                    fields TEXT NOT NULL,
+                    images TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL DEFAULT 0,
+                    posted INTEGER NOT NULL DEFAULT 0
+                )""")
+            columns = [row[1] for row in self._db().execute("PRAGMA table_info(events)")]
+            if "posted" not in columns:     # Spooled by an older version
+                self._db().execute("ALTER TABLE events ADD COLUMN posted INTEGER NOT NULL DEFAULT 0")
+        self._remove_orphan_blobs()
+
+    def _db(self):
+        # SQLite connections don't survive a fork: every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(os.path.join(self.directory, "events.db"), timeout=30,
+                                               isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def _blob_path(self, file_name):
+        return os.path.join(self.blob_directory, file_name)
+
+    def _write_blob(self, file_name, data):
+        path = self._blob_path(file_name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)     # Never a half-written image under the final name
+
+    def _remove_blobs(self, images):
+        for _, file_name in images:
+            try:
+                os.remove(self._blob_path(file_name))
+            except FileNotFoundError:
+                pass
+
+    def _remove_orphan_blobs(self):
+        # Blobs written right before a crash, whose event never made it to the index
+        with self._lock:
+            referenced = set()
+            for (images,) in self._db().execute("SELECT images FROM events"):
+                referenced.update(file_name for _, file_name in json.loads(images))
+        for file_name in os.listdir(self.blob_directory):
+            if file_name not in referenced:
+                os.remove(self._blob_path(file_name))
+
+    def append(self, fields, images, crossing_time=None):
+        """Spools an event. images: [(file name, bytes)]. Returns its event_id."""
+        event_id = uuid.uuid4().hex
+        stored = []
+        for name, data in images:
+            file_name = f"{event_id}-{name}"
+            self._write_blob(file_name, data)
+            stored.append((name, file_name))
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO events (event_id, created, crossing_time, fields, images, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (event_id, time.time(), crossing_time, json.dumps(fields), json.dumps(stored), sum(len(data) for _, data in images)))
+        self.compact()
+        return event_id
+
+    def attach(self, event_id, name, data):
+        """Adds an image to an event already in the spool (ie. the photo finish, which comes later)."""
+        file_name = f"{event_id}-{name}"
+        self._write_blob(file_name, data)
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT images FROM events WHERE event_id = ?", (event_id,)).fetchone()
+            if row is None:
+                os.remove(self._blob_path(file_name))   # Published meanwhile
+                return
+            images = json.loads(row[0]) + [(name, file_name)]
+            db.execute("UPDATE events SET images = ?, size = size + ? WHERE event_id = ?", (json.dumps(images), len(data), event_id))
+        self.compact()
+
+    def claim_due(self, limit=1, lease=60.0, now=None, in_order=False):
+        """
+        Oldest events whose retry time has come (up to limit), with their images loaded. They're leased for
+        lease seconds, so concurrent publishers skip them; if they're not acknowledged (nor rescheduled) by
+        then, ie. the publisher died, they're due again.
+        in_order: only from the oldest event on, and up to the first one that isn't due. An event leased or
+        waiting for its retry holds back every later one, so events leave the spool strictly in order.
+        """
+        now = now or time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if in_order:
+                    rows = []
+                    for row in db.execute("SELECT id, event_id, created, crossing_time, fields, images, attempts, posted, next_attempt "
+                                          "FROM events ORDER BY id LIMIT ?", (limit,)).fetchall():
+                        if row[-1] > now:
+                            break
+                        rows.append(row[:-1])
+                else:
+                    rows = db.execute(
+                        "SELECT id, event_id, created, crossing_time, fields, images, attempts, posted FROM events "
+                        "WHERE next_attempt <= ? ORDER BY id LIMIT ?", (now, limit)).fetchall()
+                db.executemany("UPDATE events SET next_attempt = ? WHERE id = ?", [(now + lease, row[0]) for row in rows])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [self._load(*row) for row in rows]
+
+    def _load(self, row_id, event_id, created, crossing_time, fields, images, attempts, posted):
+        loaded = []
+        for name, file_name in json.loads(images):
+            try:
+                with open(self._blob_path(file_name), "rb") as f:
+                    loaded.append((name, f.read()))
+            except FileNotFoundError:
+                pass    # Compacted meanwhile
+        return SpooledEvent(row_id, event_id, created, crossing_time, json.loads(fields), loaded, attempts, bool(posted))
+
+    def ack(self, event_id):
+        """The server took the event: forget it."""
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT images FROM events WHERE event_id = ?", (event_id,)).fetchone()
+            db.execute("DELETE FROM events WHERE event_id = ?", (event_id,))
+        if row is not None:
+            self._remove_blobs(json.loads(row[0]))
+
+    def mark_posted(self, event_id):
+        """The server took the event but not all its images yet: from now on, only these are retried."""
+        with self._lock:
+            self._db().execute("UPDATE events SET posted = 1 WHERE event_id = ?", (event_id,))
+
+    def retry_later(self, event_id, delay):
+        with self._lock:
+            self._db().execute("UPDATE events SET attempts = attempts + 1, next_attempt = ? WHERE event_id = ?",
+                               (time.time() + delay, event_id))
+
+    def compact(self):
+        """Drops the images of the oldest events until the spool fits in its disk cap."""
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM events").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            dropped = []
+            events = 0
+            for event_id, images, size in db.execute("SELECT event_id, images, size FROM events WHERE size > 0 ORDER BY id").fetchall():
+                db.execute("UPDATE events SET images = '[]', size = 0 WHERE event_id = ?", (event_id,))
+                dropped.extend(json.loads(images))
+                events += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            self.compacted_events += events
+        self._remove_blobs(dropped)
+        print(f"Event spool over {self.max_bytes // (1024 * 1024)} MB: images of the {events} oldest events dropped")
+
+    def pending(self):
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def size_bytes(self):
+        with self._lock:
+            return self._db().execute("SELECT COALESCE(SUM(size), 0) FROM events").fetchone()[0]
+
+    def status(self):
+        with self._lock:
+            count, size, oldest = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(created) FROM events").fetchone()
+        text = f"{count} pending, {size / (1024 * 1024):.1f}/{self.max_bytes // (1024 * 1024)} MB"
+        if oldest is not None:
+            text += f", oldest {time.time() - oldest:.0f}s ago"
+        return text
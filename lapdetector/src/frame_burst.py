@@ -0,0 +1,93 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+#
+# Frame-by-frame review of a crossing: the full frames from N before it to M after it, where the events only carry
+# the crossing frame and the one before.
+#
+# Frames go into a preallocated ring (optionally downscaled into it, to fit more frames in the same memory), written
+# in place: one copy (or one area resize) per frame, and no allocation. Once a crossing is confirmed, the ring keeps
+# filling until the frames after it are in, and then the slots of the whole window are frozen, not copied, and
+# handed over to be encoded elsewhere. Frozen slots are skipped by the writer until the encoder releases them, so a
+# slow encoder costs ring room (frames missing from the next burst, counted), never capture time.
+#
+
+class FrameBurst:
+    def __init__(self, frame_shape, capacity, scaling=1.0):
+        height, width = frame_shape[:2]
+        self.scaling = scaling
+        self.size = (int(width * scaling), int(height * scaling))
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, self.size[1], self.size[0], 3), dtype=np.uint8)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.sequence = np.full(capacity, -1, dtype=np.int64)  # Frame number in every slot, -1 while empty
+        self.frozen = np.zeros(capacity, dtype=bool)            # Slots of a burst being encoded
+        self.lock = threading.Lock()                            # Slots are released from the encoder thread
+        self.count = 0              # Frames appended
+        self.next_slot = 0
+        self.skipped = 0            # Frames that found every slot frozen
+        self.pending = None         # (crossing_time, crossing_status, first frame, last frame) while waiting for the frames after a crossing
+
+    @property
+    def armed(self):
+        return self.pending is not None
+
+    @staticmethod
+    def frame_bytes(frame_shape, scaling=1.0):
+        return int(frame_shape[1] * scaling) * int(frame_shape[0] * scaling) * 3
+
+    def append(self, frame, frame_time):
+        with self.lock:
+            for offset in range(self.capacity):
+                index = (self.next_slot + offset) % self.capacity
+                if not self.frozen[index]:
+                    break
+            else:
+                self.skipped += 1
+                self.count += 1     # Still a frame: bursts show the gap instead of stretching over it
+                return
+        if self.scaling == 1.0:
+            np.copyto(self.frames[index], frame)
+        else:
+            cv2.resize(frame, self.size, dst=self.frames[index], interpolation=cv2.INTER_AREA)
+        self.times[index] = frame_time
+        self.sequence[index] = self.count
+        self.count += 1
+        self.next_slot = (index + 1) % self.capacity
+
+    def arm(self, crossing_time, crossing_status, frames_before, frames_after):
+        """To be called after appending the crossing frame."""
+        if self.pending is not None:
+            return False    # Still waiting for the frames after the previous crossing
+        crossing_frame = self.count - 1
+        self.pending = (crossing_time, crossing_status, crossing_frame - frames_before, crossing_frame + frames_after)
+        return True
+
+    def collect(self):
+        """
+        Once the frames after the pending crossing are in: freezes the slots of its window and returns
+        (crossing_time, crossing_status, slots, times), slots oldest first. None otherwise. The slots stay
+        frozen until release(slots).
+        """
+        if self.pending is None or self.count <= self.pending[3]:
+            return None
+        crossing_time, crossing_status, first, last = self.pending
+        self.pending = None
+        with self.lock:
+            slots = np.flatnonzero((self.sequence >= first) & (self.sequence <= last) & ~self.frozen)
+            slots = slots[np.argsort(self.sequence[slots])]
+            if len(slots) == 0:
+                return None
+            self.frozen[slots] = True
+        return crossing_time, crossing_status, slots, self.times[slots].copy()
+
+    def release(self, slots):
+        with self.lock:
+            self.frozen[slots] = False
+
+    def status(self):
+        return (f"{self.capacity} slots of {self.size[0]}x{self.size[1]} ({self.frames.nbytes // (1024 * 1024)} MB), "
+                f"{int(self.frozen.sum())} frozen, {self.skipped} frames skipped")
@@ -0,0 +1,92 @@
+import collections
+import threading
+
+import numpy as np
+
+
+#
+# Fixed pool of preallocated frame slots, so handing frames over from the capture loop to the other threads
+# doesn't allocate (nor free) megabytes of memory on every frame.
+#
+# A producer acquires a free slot, writes into its buffers in place and passes the slot along. Every holder
+# releases it when done; extra holders (ie. a crossing handed over to another thread) retain it first. The
+# slot goes back to the pool when its reference count reaches zero. The generation counter increases on every
+# acquisition, so a stale reference to a recycled slot can be spotted.
+#
+
+class FrameSlot:
+    def __init__(self, pool, index, fields):
+        self.pool = pool
+        self.index = index
+        self.buffers = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in fields.items()}
+        self.refcount = 0
+        self.generation = 0
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def view(self, name, shape):
+        # Contiguous view of a smaller array at the start of a buffer (ie. frames processed at a lower resolution)
+        buffer = self.buffers[name]
+        count = int(np.prod(shape))
+        if count > buffer.size:
+            raise ValueError(f"{shape} doesn't fit in the {name} buffer {buffer.shape}")
+        return buffer.reshape(-1)[:count].reshape(shape)
+
+    def borrow(self, name, shape=None):
+        # Read-only view, for consumers that must not modify what others may be reading
+        view = self.buffers[name] if shape is None else self.view(name, shape)
+        view = view.view()
+        view.flags.writeable = False
+        return view
+
+    def retain(self):
+        with self.pool._condition:
+            if self.refcount <= 0:
+                raise RuntimeError(f"Retaining slot {self.index} that is back in the pool")
+            self.refcount += 1
+
+    def release(self):
+        self.pool._release(self)
+
+
+class FramePool:
+    def __init__(self, fields, slots):
+        """fields: {name: (shape, dtype)} buffers held by every slot."""
+        self.slots = [FrameSlot(self, i, fields) for i in range(slots)]
+        self._free = collections.deque(self.slots)
+        self._condition = threading.Condition()
+
+        # Counters
+        self.acquired = 0
+        self.exhausted = 0          # Acquisitions that found no free slot (the frame was dropped, or the producer waited)
+        self.high_water = 0         # Max slots in use at the same time
+
+    def acquire(self, block=False, timeout=None):
+        with self._condition:
+            if not self._free:
+                self.exhausted += 1
+                if not block or not self._condition.wait_for(lambda: self._free, timeout=timeout):
+                    return None
+            slot = self._free.popleft()
+            slot.refcount = 1
+            slot.generation += 1
+            self.acquired += 1
+            self.high_water = max(self.high_water, len(self.slots) - len(self._free))
+            return slot
+
+    def _release(self, slot):
+        with self._condition:
+            if slot.refcount <= 0:
+                raise RuntimeError(f"Slot {slot.index} released more times than acquired")
+            slot.refcount -= 1
+            if slot.refcount == 0:
+                self._free.append(slot)
+                self._condition.notify()
+
+    def in_use(self):
+        with self._condition:
+            return len(self.slots) - len(self._free)
+
+    def status(self):
+        return f"{self.in_use()}/{len(self.slots)} slots in use (max {self.high_water}), {self.exhausted} exhausted"
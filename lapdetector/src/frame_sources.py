@@ -0,0 +1,442 @@
+import collections
+import glob
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+#
+# Frame sources feed the detector with frames. The Pi camera is just one of them: video files,
+# image sequences and a synthetic scene allow running (and benchmarking) the whole pipeline on
+# any regular Linux box, no Pi needed.
+#
+# All of them mimic the small subset of the Picamera2 API used by the detector:
+#   capture_array("main" | "lores"), set_controls({...}), start(), stop() and sensor_modes.
+# capture_array() returns None when the source is exhausted (end of the video, synthetic duration...).
+#
+# last_timestamp is the capture time of the last "main" frame, in epoch seconds: the sensor timestamp for the
+# camera, the nominal frame time (start + index / fps) for replays and synthetic scenes. It's the time base of
+# the detector, free of the variable latency between the exposure and the moment the frame reaches Python.
+#
+# With zero_copy, frames are read-only views of the source's own buffers, valid until the frame after the next one
+# is captured (the detector keeps the previous frame around, and copies whatever it hands over before that). For the
+# camera, that's its DMA buffers, mapped in place instead of copied on every frame; the camera then has
+# buffer_count - HELD_FRAMES buffers left to fill, and when they run out it drops frames: gaps in the timestamps,
+# counted in dropped_frames. Other sources still make a new array per frame, but read-only all the same, so
+# anything writing into acquired frames shows up off the Pi too.
+#
+
+HELD_FRAMES = 2     # Zero-copy frames held at the same time: the current one and the previous one
+
+
+class FrameSource:
+    sensor_modes = ()
+    is_camera = False
+
+    def __init__(self, width, height, fps, lores_scaling=None, zero_copy=False, buffer_count=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.lores_scaling = lores_scaling
+        self.zero_copy = zero_copy
+        self.buffer_count = buffer_count    # Camera buffers, None for the default
+        self.dropped_frames = 0             # Frames missing between two in a row (see above)
+        self.frame_index = -1           # Index of the last frame returned by capture_array("main")
+        self.last_timestamp = None      # Capture time of that frame (see above)
+        self.start_time = None          # Capture time of the first frame
+        self._last_frame = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_controls(self, controls):
+        pass    # Camera controls (AeEnable, AwbEnable, AfMode...) are meaningless out of a camera
+
+    def capture_array(self, name="main"):
+        if name == "lores":
+            return self._lores_from_last_frame()
+        frame = self._next_frame()
+        if frame is not None:
+            self.frame_index += 1
+            self._last_frame = frame
+            if self.start_time is None:
+                self.start_time = time.time()
+            self._count_dropped_frames(self._timestamp())
+            if self.zero_copy:
+                frame.flags.writeable = False
+        return frame
+
+    def status(self):
+        mode = f"zero-copy, {self.buffer_count or 'default'} buffers" if self.zero_copy else "copy"
+        return f"{mode}, {self.dropped_frames} frames dropped"
+
+    def _count_dropped_frames(self, timestamp):
+        # More than 1.5 frame intervals since the previous frame: the frames in between never made it
+        if self.last_timestamp is not None:
+            self.dropped_frames += max(0, round((timestamp - self.last_timestamp) * self.fps) - 1)
+        self.last_timestamp = timestamp
+
+    def _next_frame(self):
+        raise NotImplementedError
+
+    def _timestamp(self):
+        # Nominal frame time: replays and synthetic scenes run on their own clock, however fast they're consumed
+        return self.start_time + self.frame_index / self.fps
+
+    def _lores_from_last_frame(self):
+        # Picamera2 gives a YUV420 lores stream whose first rows are the Y plane. A scaled grayscale
+        # version of the last main frame is close enough for the detector, which only slices the Y plane.
+        if self._last_frame is None or not self.lores_scaling:
+            return None
+        gray = cv2.cvtColor(self._last_frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray,
+                          (int(self.width * self.lores_scaling), int(self.height * self.lores_scaling)),
+                          interpolation=cv2.INTER_AREA)
+
+
+#
+# PI CAMERA
+#
+class Picamera2FrameSource(FrameSource):
+    is_camera = True
+
+    def __init__(self, width, height, fps, lores_scaling=None, zero_copy=False, buffer_count=None):
+        super().__init__(width, height, fps, lores_scaling, zero_copy, buffer_count)
+        from picamera2 import MappedArray, Picamera2     # Only available on the Pi
+
+        if zero_copy and (buffer_count or 0) < HELD_FRAMES + 2:
+            raise ValueError(f"Zero-copy holds {HELD_FRAMES} camera buffers: it needs {HELD_FRAMES + 2} at least, better more")
+        self.picam2 = Picamera2()
+        self._mapped_array = MappedArray
+        self._held = collections.deque()    # (request, mappings) of the zero-copy frames, oldest first
+        self._lores = None
+        self._sensor_clock = None
+        self._sensor_modes = None
+        streams = {
+            "main": {
+                "format": 'RGB888',
+                "size": (width, height)
+            }
+        }
+        if lores_scaling:
+            streams["lores"] = {
+                "format": 'YUV420',
+                "size": (int(width * lores_scaling), int(height * lores_scaling))
+            }
+        options = {"buffer_count": buffer_count} if buffer_count else {}
+        config = self.picam2.create_preview_configuration(
+            **streams,
+            controls={"FrameRate": fps},
+            **options,
+#            queue=False,       # Risky...
+        )
+        self.picam2.configure(config)
+        self._config = config
+
+    @property
+    def sensor_modes(self):
+        # Listing them configures the camera in every mode (most of its start time), so only when asked for, and
+        # while it's stopped
+        if self._sensor_modes is None:
+            self._sensor_modes = self.picam2.sensor_modes
+            self.picam2.configure(self._config)     # Back to ours
+        return self._sensor_modes
+
+    def start(self):
+        self.picam2.start()
+
+    def stop(self):
+        while self._held:
+            self._release_oldest()
+        self.picam2.stop()
+
+    def set_controls(self, controls):
+        self.picam2.set_controls(controls)
+
+    def capture_array(self, name="main"):
+        if name != "main":
+            return self._lores     # From the same request as the last main frame (see below)
+
+        # A request gives the frame(s) and their metadata all at once, so the sensor timestamp belongs to this very frame
+        request = self.picam2.capture_request()
+        try:
+            if self.zero_copy:
+                # Views of the buffers themselves, mapped read-only: the request stays ours until released below
+                mappings = [self._mapped_array(request, name, write=False) for name in
+                            (("main", "lores") if self.lores_scaling else ("main",))]
+                arrays = [mapping.__enter__().array for mapping in mappings]
+                frame = arrays[0]
+                self._lores = arrays[1] if self.lores_scaling else None
+                self._held.append((request, mappings))
+            else:
+                frame = request.make_array("main")
+                self._lores = request.make_array("lores") if self.lores_scaling else None
+            sensor_timestamp = request.get_metadata().get("SensorTimestamp")
+        finally:
+            if not self.zero_copy:
+                request.release()
+        # Back to the camera as soon as the detector is done with them, so it never runs out of buffers
+        while len(self._held) > HELD_FRAMES:
+            self._release_oldest()
+        self.frame_index += 1
+        self._count_dropped_frames(self._sensor_to_epoch(sensor_timestamp) if sensor_timestamp else time.time())
+        if self.start_time is None:
+            self.start_time = self.last_timestamp
+        return frame
+
+    def _release_oldest(self):
+        request, mappings = self._held.popleft()
+        for mapping in mappings:
+            mapping.__exit__(None, None, None)
+        request.release()
+
+    def _sensor_to_epoch(self, sensor_timestamp_ns):
+        # Sensor timestamps are nanoseconds on a kernel clock (boot time or monotonic, depending on the libcamera
+        # version): find out which one the first time, as the frame was exposed a few milliseconds ago at most
+        sensor_time = sensor_timestamp_ns / 1e9
+        if self._sensor_clock is None:
+            for clock in (time.CLOCK_BOOTTIME, time.CLOCK_MONOTONIC):
+                if 0 <= time.clock_gettime(clock) - sensor_time < 1.0:
+                    self._sensor_clock = clock
+                    break
+            else:
+                return time.time()
+        return sensor_time + time.time() - time.clock_gettime(self._sensor_clock)
+
+
+#
+# VIDEO FILES AND IMAGE SEQUENCES
+#
+class VideoFrameSource(FrameSource):
+    """
+    Replays a video file, a printf-style image sequence ("frames/%05d.jpg") or a directory of images.
+    Frames are resized to the configured resolution when needed. With realtime=True frames are paced
+    to the configured FPS, as a camera would do; otherwise they are delivered as fast as possible.
+    """
+
+    IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, path, width, height, fps, lores_scaling=None, loop=False, realtime=False):
+        super().__init__(width, height, fps, lores_scaling)
+        self.path = path
+        self.loop = loop
+        self.realtime = realtime
+        self._next_frame_time = None
+        self._capture = None
+        self._image_files = None
+        self._image_position = 0
+
+        if os.path.isdir(path):
+            self._image_files = sorted(f for f in glob.glob(os.path.join(path, "*"))
+                                       if f.lower().endswith(self.IMAGE_EXTENSIONS))
+            if not self._image_files:
+                raise ValueError(f"No images found in {path}")
+        else:
+            self._capture = cv2.VideoCapture(path)
+            if not self._capture.isOpened():
+                raise ValueError(f"Unable to open video source {path}")
+
+    def stop(self):
+        if self._capture is not None:
+            self._capture.release()
+
+    def _read(self):
+        if self._image_files is not None:
+            if self._image_position >= len(self._image_files):
+                if not self.loop:
+                    return None
+                self._image_position = 0
+            frame = cv2.imread(self._image_files[self._image_position], cv2.IMREAD_COLOR)
+            self._image_position += 1
+            return frame
+
+        ok, frame = self._capture.read()
+        if not ok and self.loop:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._capture.read()
+        return frame if ok else None
+
+    def _next_frame(self):
+        if self.realtime:
+            now = time.time()
+            if self._next_frame_time and now < self._next_frame_time:
+                time.sleep(self._next_frame_time - now)
+            self._next_frame_time = max(now, self._next_frame_time or now) + 1.0 / self.fps
+
+        frame = self._read()
+        if frame is None:
+            return None
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        return frame
+
+
+#
+# SYNTHETIC SCENE
+#
+class CarPass:
+    """A car crossing the meta line. Its leading edge is exactly on the line at cross_time (scene seconds)."""
+
+    def __init__(self, cross_time, direction, speed_px_s, y_center, length_px, height_px, color):
+        self.cross_time = cross_time
+        self.direction = direction          # 1 for left to right, 2 for right to left
+        self.speed_px_s = speed_px_s
+        self.y_center = y_center
+        self.length_px = length_px
+        self.height_px = height_px
+        self.color = color
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Renders a static track with cars crossing the meta line at known times, so detections can be compared
+    against the ground truth. Scene time is frame_index / fps, regardless of how fast frames are consumed.
+
+    ground_truth holds one entry per car pass, filled with the wall time at which the first frame with the
+    car's leading edge over the line was delivered (emitted_at), so detection latency can be measured. Crossing
+    times in the detector's time base (last_timestamp) are start_time + cross_time.
+    """
+
+    def __init__(self, width, height, fps, meta_line_x, lores_scaling=None, car_passes=None,
+                 duration=None, realtime=True, noise=4, seed=42):
+        super().__init__(width, height, fps, lores_scaling)
+        self.meta_line_x = meta_line_x
+        self.duration = duration
+        self.realtime = realtime
+        self._next_frame_time = None
+        self.car_passes = sorted(car_passes if car_passes is not None else self.default_car_passes(width, height, duration),
+                                 key=lambda p: p.cross_time)
+        self.ground_truth = [{
+            "cross_time": p.cross_time,
+            "direction": p.direction,
+            "frame_index": math.ceil(round(p.cross_time * fps, 6)),    # Rounded first: 9.600000000000001 s is frame 576
+            "emitted_at": None
+        } for p in self.car_passes]
+        self._truth_cursor = 0              # Next ground truth entry waiting for its frame
+        self._pass_cursor = 0               # First car pass that may still be visible
+
+        # Pre-rendered noisy backgrounds, cycled to get some sensor-like noise for free
+        rng = np.random.default_rng(seed)
+        base = self._render_track(width, height, rng)
+        self._backgrounds = []
+        for _ in range(4):
+            noisy = base.astype(np.int16) + rng.integers(-noise, noise + 1, base.shape, dtype=np.int16)
+            self._backgrounds.append(np.clip(noisy, 0, 255).astype(np.uint8))
+
+    @staticmethod
+    def default_car_passes(width, height, duration=None, first_crossing=4.0, interval=3.0):
+        # Alternating lanes and directions, at typical slot car speeds for a 720p frame. Cars cover 4.5% of the frame,
+        # well above the detector's minimum contour area (2% by default): benchmarks should measure the algorithms,
+        # not how a car right at that threshold happens to be thresholded
+        passes = []
+        count = int((duration - first_crossing) // interval) + 1 if duration else 1000
+        for i in range(max(0, count)):
+            lane = i % 2
+            passes.append(CarPass(
+                cross_time=first_crossing + i * interval,
+                direction=1 if lane == 0 else 2,
+                speed_px_s=width * (0.6 + 0.2 * (i % 3)),
+                y_center=int(height * (0.42 if lane == 0 else 0.66)),
+                length_px=int(width * 0.25),
+                height_px=int(height * 0.18),
+                color=(20, 220, 250) if lane == 0 else (235, 235, 235)
+            ))
+        return passes
+
+    @staticmethod
+    def _render_track(width, height, rng):
+        frame = np.full((height, width, 3), (70, 110, 60), dtype=np.uint8)    # Grass
+        cv2.rectangle(frame, (0, int(height * 0.30)), (width, int(height * 0.78)), (60, 60, 60), -1)
+        cv2.line(frame, (0, int(height * 0.54)), (width, int(height * 0.54)), (200, 200, 200), 2)
+        for x in range(0, width, 40):       # Some texture on the kerbs
+            color = (30, 30, 220) if (x // 40) % 2 else (230, 230, 230)
+            cv2.rectangle(frame, (x, int(height * 0.28)), (x + 40, int(height * 0.30)), color, -1)
+            cv2.rectangle(frame, (x, int(height * 0.78)), (x + 40, int(height * 0.80)), color, -1)
+        return frame
+
+    def crossing_times(self):
+        return [p.cross_time for p in self.car_passes]
+
+    def _draw_car(self, frame, car_pass, scene_time):
+        elapsed = scene_time - car_pass.cross_time
+        if car_pass.direction == 1:
+            front = self.meta_line_x + car_pass.speed_px_s * elapsed
+            x1, x2 = front - car_pass.length_px, front
+        else:
+            front = self.meta_line_x - car_pass.speed_px_s * elapsed
+            x1, x2 = front, front + car_pass.length_px
+        if x2 < 0 or x1 >= self.width:
+            return
+        y1 = car_pass.y_center - car_pass.height_px // 2
+        y2 = y1 + car_pass.height_px
+        x1, x2 = int(round(x1)), int(round(x2))
+        cv2.rectangle(frame, (x1, y1), (x2, y2), car_pass.color, -1)
+        # Cockpit, so the car has inner edges as a real one would
+        cx1 = x1 + car_pass.length_px // 3
+        cv2.rectangle(frame, (cx1, y1 + car_pass.height_px // 4), (cx1 + car_pass.length_px // 4, y2 - car_pass.height_px // 4), (20, 20, 20), -1)
+        # Wheels and a racing stripe: some texture for the trackers to hold on to, as real cars have
+        wheel_w, wheel_h = car_pass.length_px // 6, car_pass.height_px // 6
+        for wx in (x1 + car_pass.length_px // 8, x2 - car_pass.length_px // 8 - wheel_w):
+            cv2.rectangle(frame, (wx, y1), (wx + wheel_w, y1 + wheel_h), (10, 10, 10), -1)
+            cv2.rectangle(frame, (wx, y2 - wheel_h), (wx + wheel_w, y2), (10, 10, 10), -1)
+        stripe_y = car_pass.y_center - car_pass.height_px // 16
+        cv2.rectangle(frame, (x1, stripe_y), (x2, stripe_y + car_pass.height_px // 8), (40, 40, 200), -1)
+
+    def _next_frame(self):
+        index = self.frame_index + 1
+        scene_time = index / self.fps
+        if self.duration is not None and scene_time >= self.duration:
+            return None
+
+        if self.realtime:
+            now = time.time()
+            if self._next_frame_time and now < self._next_frame_time:
+                time.sleep(self._next_frame_time - now)
+            self._next_frame_time = max(now, self._next_frame_time or now) + 1.0 / self.fps
+
+        frame = self._backgrounds[index % len(self._backgrounds)].copy()
+
+        # Passes are sorted by time, so only a handful around the cursor may be visible
+        # (generous margin: a full frame width of travel before and after the crossing)
+        while (self._pass_cursor < len(self.car_passes) and
+               scene_time - self.car_passes[self._pass_cursor].cross_time > 2 * self.width / self.car_passes[self._pass_cursor].speed_px_s):
+            self._pass_cursor += 1
+        for car_pass in self.car_passes[self._pass_cursor:]:
+            if (car_pass.cross_time - scene_time) * car_pass.speed_px_s > 2 * self.width:
+                break   # Not even close yet, nor any of the ones after it (roughly: speeds vary a bit)
+            if abs(scene_time - car_pass.cross_time) * car_pass.speed_px_s < self.width + car_pass.length_px:
+                self._draw_car(frame, car_pass, scene_time)
+
+        now = time.time()
+        while self._truth_cursor < len(self.ground_truth) and self.ground_truth[self._truth_cursor]["frame_index"] <= index:
+            self.ground_truth[self._truth_cursor]["emitted_at"] = now
+            self._truth_cursor += 1
+        return frame
+
+
+def create_frame_source(spec, width, height, fps, meta_line_x, lores_scaling=None, zero_copy=False, buffer_count=None):
+    """
+    Builds a frame source out of a textual spec:
+      "picamera2"            -> the Pi camera
+      "synthetic"            -> synthetic scene, paced to the FPS target
+      "synthetic:fast"       -> synthetic scene, as fast as possible
+      any other value        -> video file, image sequence pattern or image directory (suffix ":loop" to loop it)
+    """
+    if spec == "picamera2":
+        return Picamera2FrameSource(width, height, fps, lores_scaling, zero_copy, buffer_count)
+    if spec.startswith("synthetic"):
+        source = SyntheticFrameSource(width, height, fps, meta_line_x, lores_scaling,
+                                      realtime=not spec.endswith(":fast"))
+    else:
+        loop = spec.endswith(":loop")
+        path = spec[:-len(":loop")] if loop else spec
+        source = VideoFrameSource(path, width, height, fps, lores_scaling, loop=loop, realtime=True)
+    source.zero_copy = zero_copy
+    source.buffer_count = buffer_count
+    return source
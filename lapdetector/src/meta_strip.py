@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+
+
+#
+# Line-scan watch over a narrow strip of columns around the meta line.
+#
+# While nothing is going on, there's no point in blurring, resizing and running MOG2, contours and trackers over
+# the whole ROI band: the only thing that matters is whether something reaches the meta line. This keeps a tiny
+# per-pixel background model (running mean and variance) of the strip, at full resolution, and scores every new
+# strip against it. The detector escalates to the full contour+tracker pipeline only when the strip activates.
+#
+
+class MetaStrip:
+    def __init__(self, learning_rate=0.05, sigma_factor=4.0, min_delta=18.0, activation_ratio=0.03,
+                 min_edge_pixels=3, warmup_frames=20):
+        self.learning_rate = learning_rate          # Background adaptation speed (while idle)
+        self.sigma_factor = sigma_factor            # A pixel changes when it's this many std devs away from its mean...
+        self.min_delta = min_delta                  # ...and at least this many gray levels away
+        self.activation_ratio = activation_ratio    # Fraction of changed pixels that activates the strip
+        self.min_edge_pixels = min_edge_pixels      # Changed pixels must also draw some edges (noise doesn't)
+        self.warmup_frames = warmup_frames          # Frames to learn before the strip can be trusted
+        self.reset()
+
+    def reset(self, geometry=None):
+        self.geometry = geometry
+        self.mean = None
+        self.var = None
+        self.learned_frames = 0
+        self.score = 0.0
+        self.edge_pixels = 0
+        self.active = False
+
+    @property
+    def ready(self):
+        return self.learned_frames >= self.warmup_frames
+
+    def update(self, strip_bgr, geometry, learn=True):
+        """
+        strip_bgr: the strip, straight from the captured frame (a view is fine).
+        geometry: anything identifying the strip position; the model starts over when it changes.
+        learn: whether the background model may adapt to this strip (only when it's not active anyway).
+        Returns whether the strip is active.
+        """
+        if geometry != self.geometry:
+            self.reset(geometry)
+
+        gray = cv2.cvtColor(strip_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        if self.mean is None:
+            self.mean = gray
+            self.var = np.full_like(gray, self.min_delta / self.sigma_factor) ** 2
+            self.learned_frames = 1
+            return False
+
+        delta = gray - self.mean
+        abs_delta = np.abs(delta)
+        changed = (abs_delta > self.sigma_factor * np.sqrt(self.var)) & (abs_delta > self.min_delta)
+        self.score = float(np.count_nonzero(changed)) / changed.size
+        # Edges of whatever changed: strong vertical gradients of the difference image
+        self.edge_pixels = int(np.count_nonzero(np.abs(np.diff(abs_delta, axis=0)) > self.min_delta))
+
+        self.active = self.ready and self.score >= self.activation_ratio and self.edge_pixels >= self.min_edge_pixels
+
+        if learn and not self.active:
+            rate = max(self.learning_rate, 1.0 / (self.learned_frames + 1))    # Learn fast while warming up
+            self.mean += rate * delta
+            self.var += rate * (delta * delta - self.var)
+            np.maximum(self.var, 1.0, out=self.var)
+            self.learned_frames += 1
+
+        return self.active
@@ -0,0 +1,164 @@
+import numpy as np
+
+from calibration import SpeedEstimator
+
+
+#
+# Several cars at once, each with its own track and crossing state machine.
+#
+# A correlation tracker per car (CSRT, KCF...) would make every extra car cost as much as the first one. Instead,
+# the foreground mask and its contours, which the detector computes once per frame anyway, are the measurements:
+# every frame, contours are assigned to the tracks they most likely belong to (IoU against where each track should
+# be by now, then centroid distance for the small fast ones), in one vectorized step. Adding a car adds a row to a
+# tiny matrix, not an image correlation.
+#
+# Lanes are horizontal bands within the detection band. Contours are found per lane, so two cars side by side don't
+# merge into a single blob, and a track never jumps to another lane.
+#
+
+def bbox_arrays(bboxes):
+    return np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU of every box in boxes_a (N, 4) against every box in boxes_b (M, 4), (x, y, w, h) boxes. Returns (N, M)."""
+    ax1, ay1 = boxes_a[:, 0:1], boxes_a[:, 1:2]
+    ax2, ay2 = ax1 + boxes_a[:, 2:3], ay1 + boxes_a[:, 3:4]
+    bx1, by1 = boxes_b[:, 0], boxes_b[:, 1]
+    bx2, by2 = bx1 + boxes_b[:, 2], by1 + boxes_b[:, 3]
+    inter = (np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None) *
+             np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None))
+    union = boxes_a[:, 2:3] * boxes_a[:, 3:4] + boxes_b[:, 2] * boxes_b[:, 3] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def centroid_distance_matrix(boxes_a, boxes_b):
+    """Distance between the centers of every box in boxes_a (N, 4) and every box in boxes_b (M, 4). Returns (N, M)."""
+    centers_a = boxes_a[:, :2] + boxes_a[:, 2:] / 2
+    centers_b = boxes_b[:, :2] + boxes_b[:, 2:] / 2
+    return np.linalg.norm(centers_a[:, None, :] - centers_b[None, :, :], axis=2)
+
+
+def associate(track_boxes, track_lanes, detection_boxes, detection_lanes, min_iou, max_distance):
+    """
+    Greedy assignment of detections to tracks, best IoU first, then closest centroids (within max_distance) for
+    whatever is left. Only within the same lane. Returns (matches [(track, detection)], unmatched detections).
+    """
+    if len(track_boxes) == 0 or len(detection_boxes) == 0:
+        return [], list(range(len(detection_boxes)))
+
+    same_lane = np.asarray(track_lanes)[:, None] == np.asarray(detection_lanes)[None, :]
+    ious = np.where(same_lane, iou_matrix(track_boxes, detection_boxes), 0)
+    distances = np.where(same_lane, centroid_distance_matrix(track_boxes, detection_boxes), np.inf)
+
+    matches = []
+    free_tracks = np.ones(len(track_boxes), dtype=bool)
+    free_detections = np.ones(len(detection_boxes), dtype=bool)
+    # Best IoU first, then shortest distance: a stable argsort over (-IoU, distance)
+    order = np.lexsort((distances.ravel(), -ious.ravel()))
+    for flat in order:
+        t, d = divmod(int(flat), len(detection_boxes))
+        if not (free_tracks[t] and free_detections[d]):
+            continue
+        if ious[t, d] < min_iou and distances[t, d] > max_distance:
+            continue
+        matches.append((t, d))
+        free_tracks[t] = False
+        free_detections[d] = False
+    return matches, [int(d) for d in np.flatnonzero(free_detections)]
+
+
+class Track:
+    def __init__(self, track_id, lane, bbox, now, speed_window=12):
+        self.id = track_id
+        self.lane = lane
+        self.bbox = tuple(int(v) for v in bbox)
+        self.prev_bbox = None
+        self.start_time = now
+        self.start_bbox = self.bbox
+        self.last_seen_time = now
+        self.last_update_time = now
+        self.velocity = (0.0, 0.0)      # Pixels per second, smoothed
+        # Crossing state machine
+        self.direction = 0              # 0 for none, 1 for left to right, 2 for right to left
+        self.speed_kmh = 0.0
+        self.positions = SpeedEstimator(speed_window)   # On the track, fed by whoever knows the calibration
+        self.crossing_status = 0        # 0 until its crossing is confirmed, then the direction it crossed in
+        self.crossing_time = None
+
+    def predict(self, now):
+        """Where the track should be by now, moving at its current velocity."""
+        dt = now - self.last_update_time
+        x, y, w, h = self.bbox
+        return (x + self.velocity[0] * dt, y + self.velocity[1] * dt, w, h)
+
+    def update(self, bbox, now, smoothing=0.5):
+        dt = now - self.last_update_time
+        if dt > 0:
+            vx = ((bbox[0] + bbox[2] / 2) - (self.bbox[0] + self.bbox[2] / 2)) / dt
+            vy = ((bbox[1] + bbox[3] / 2) - (self.bbox[1] + self.bbox[3] / 2)) / dt
+            self.velocity = (smoothing * vx + (1 - smoothing) * self.velocity[0],
+                             smoothing * vy + (1 - smoothing) * self.velocity[1])
+        self.prev_bbox = self.bbox
+        self.bbox = tuple(int(v) for v in bbox)
+        self.last_seen_time = now
+        self.last_update_time = now
+        if self.velocity[0] > 0:
+            self.direction = 1
+        elif self.velocity[0] < 0:
+            self.direction = 2
+
+
+class MultiTracker:
+    def __init__(self, max_tracks=8, min_iou=0.1, max_distance=40, max_missed_time=0.2, timeout=8.0, speed_window=12):
+        self.max_tracks = max_tracks            # New cars beyond this are ignored until a track ends
+        self.min_iou = min_iou                  # Below this IoU, a contour only matches a track by centroid distance...
+        self.max_distance = max_distance        # ...up to this many (scaled) pixels
+        self.max_missed_time = max_missed_time  # Seconds a track survives without any contour
+        self.timeout = timeout                  # Max seconds of a track (ie. a car stopped on the track)
+        self.speed_window = speed_window        # Positions every track fits its speed over
+        self.tracks = []
+        self.next_id = 1
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, detections, now, frame_width, frame_height, max_distance=None, can_start=lambda bbox: True):
+        """
+        detections: [(lane, bbox)] found in this frame. Matched tracks move to their contours, unmatched contours
+        start new tracks (when can_start(bbox)), and tracks that left the frame, got lost or timed out end.
+        max_distance: overrides the one given at init (ie. when it depends on the frame size).
+        Returns the tracks that ended, with the reason: [(track, "left" | "lost" | "timeout")].
+        """
+        track_boxes = bbox_arrays([track.predict(now) for track in self.tracks])
+        detection_boxes = bbox_arrays([bbox for _, bbox in detections])
+        matches, unmatched = associate(track_boxes, [track.lane for track in self.tracks],
+                                       detection_boxes, [lane for lane, _ in detections],
+                                       self.min_iou, self.max_distance if max_distance is None else max_distance)
+        for t, d in matches:
+            self.tracks[t].update(detections[d][1], now)
+
+        # Fragments of a car that is already being tracked don't start tracks of their own
+        if unmatched and self.tracks:
+            overlapping = iou_matrix(bbox_arrays([track.bbox for track in self.tracks]), detection_boxes[unmatched]).max(axis=0) > 0
+            unmatched = [d for d, overlaps in zip(unmatched, overlapping) if not overlaps]
+        for d in unmatched:
+            lane, bbox = detections[d]
+            if len(self.tracks) < self.max_tracks and can_start(bbox):
+                self.tracks.append(Track(self.next_id, lane, bbox, now, self.speed_window))
+                self.next_id += 1
+
+        ended = []
+        for track in self.tracks:
+            x, y, w, h = track.bbox
+            center_x, center_y = x + w / 2, y + h / 2
+            if not (0 <= center_x < frame_width and 0 <= center_y < frame_height):
+                ended.append((track, "left"))
+            elif now - track.last_seen_time > self.max_missed_time:
+                ended.append((track, "lost"))
+            elif now - track.start_time > self.timeout:
+                ended.append((track, "timeout"))
+        if ended:
+            ended_ids = {track.id for track, _ in ended}
+            self.tracks = [track for track in self.tracks if track.id not in ended_ids]
+        return ended
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+#
+# True photo finish: a line-scan image built out of the full resolution meta line column(s) of every frame, one
+# frame after the other. X is time, Y is the position across the track, like the photo finish cameras at the races.
+#
+# Columns go into a preallocated ring, so the capture loop only pays for copying a handful of pixels per frame.
+# Once a crossing is confirmed, the accumulator keeps collecting until the configured time after the crossing, and
+# then the strip around the crossing is handed over (the only copy, once per crossing) to be encoded elsewhere.
+# Crossings close together (ie. a car right behind another) queue up: each one gets its own image, out of the same
+# columns, as the ring holds the window of the first one when the next one is complete.
+#
+
+class PhotoFinish:
+    def __init__(self, max_rows, columns_per_frame, capacity_frames):
+        self.columns_per_frame = columns_per_frame
+        self.capacity = capacity_frames
+        self.buffer = np.zeros((max_rows, capacity_frames * columns_per_frame, 3), dtype=np.uint8)
+        self.times = np.zeros(capacity_frames, dtype=np.float64)
+        self.geometry = None
+        self.count = 0              # Frames appended since the last reset
+        self.pending = []           # [(crossing_time, crossing_status, time_before, time_after)] waiting for the frames after their crossing, oldest first
+        self.finished = []          # Photo finishes cut short by a geometry change, until they're collected
+
+    @property
+    def armed(self):
+        return bool(self.pending)
+
+    def reset(self, geometry=None):
+        self.geometry = geometry
+        self.count = 0
+        self.pending = []
+        self.finished = []
+
+    def append(self, frame, line_x, y1, y2, frame_time):
+        """Returns True when a geometry change cut the pending crossings short (what they got so far is collected next)."""
+        x1 = min(max(0, line_x - self.columns_per_frame // 2), frame.shape[1] - self.columns_per_frame)
+        geometry = (x1, y1, y2)
+        cut_short = False
+        if geometry != self.geometry:
+            # Meta line or band moved: older columns don't belong to the same image, so the pending crossings end here
+            if self.pending:
+                self.finished += [image for image in map(self._image, self.pending) if image is not None]
+                self.pending = []
+                cut_short = True
+            self.geometry = geometry
+            self.count = 0
+
+        index = self.count % self.capacity
+        c = index * self.columns_per_frame
+        self.buffer[:y2 - y1, c:c + self.columns_per_frame] = frame[y1:y2, x1:x1 + self.columns_per_frame]
+        self.times[index] = frame_time
+        self.count += 1
+        return cut_short
+
+    def arm(self, crossing_time, crossing_status, time_before, time_after):
+        """Queues a crossing. Returns False when one in the same frame is already queued (both share its image)."""
+        if any(pending[0] == crossing_time for pending in self.pending):
+            return False
+        self.pending.append((crossing_time, crossing_status, time_before, time_after))
+        return True
+
+    def collect(self, now):
+        """Returns (crossing_time, crossing_status, image, column_times) once the oldest pending crossing is complete, None otherwise."""
+        if self.finished:
+            return self.finished.pop(0)
+        if not self.pending:
+            return None
+        crossing_time, _, _, time_after = self.pending[0]
+        if now < crossing_time + time_after:
+            return None
+        return self._image(self.pending.pop(0))
+
+    def _image(self, pending):
+        crossing_time, crossing_status, time_before, time_after = pending
+
+        # Frames in the ring, oldest first, within the time window around the crossing
+        frames = min(self.count, self.capacity)
+        order = (np.arange(self.count - frames, self.count) % self.capacity)
+        order = order[(self.times[order] >= crossing_time - time_before) & (self.times[order] <= crossing_time + time_after)]
+        if len(order) == 0:
+            return None
+
+        x1, y1, y2 = self.geometry
+        cpf = self.columns_per_frame
+        columns = (order[:, None] * cpf + np.arange(cpf)).ravel()
+        image = self.buffer[:y2 - y1, columns]      # Fancy indexing: the one and only copy
+
+        # Red ticks on top and bottom marking the crossing frame
+        crossing_index = int(np.argmin(np.abs(self.times[order] - crossing_time)))
+        tick = slice(crossing_index * cpf, (crossing_index + 1) * cpf)
+        image[:6, tick] = (0, 0, 255)
+        image[-6:, tick] = (0, 0, 255)
+
+        return crossing_time, crossing_status, image, self.times[order].copy()
@@ -0,0 +1,150 @@
+import collections
+import queue
+import threading
+
+
+#
+# Bounded queues between pipeline stages, with an explicit policy for when the consumer falls behind and the
+# counters to tell it happened. They behave like queue.Queue (put, put_nowait, get, qsize, full, empty), so
+# stages don't care whether they talk to one of these or to a plain queue.
+#
+# Policies, once the queue is full:
+#   DROP_OLDEST: the oldest droppable item is evicted to make room (visualization frames: fresh beats complete).
+#                If there's nothing droppable in the queue, a droppable item is dropped instead, and any other
+#                item waits for room.
+#   DROP_NEWEST: the item being put is dropped.
+#   BLOCK:       put waits for room, like queue.Queue (queue.Full on timeout or put_nowait).
+#   SPILL:       the item goes to an overflow area and is delivered after the queue, in order: meant for small
+#                items that should rather wait than go, like the publisher wake-ups. The overflow area is bounded
+#                too (spill_limit): once it's full, it's DROP_OLDEST over the queue and the overflow together.
+#
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+SPILL = "spill"
+
+
+class PipelineQueue:
+    def __init__(self, name, maxsize, policy, droppable=None, on_drop=None, spill_limit=None):
+        """
+        droppable: predicate telling which items the drop policies may drop (all of them by default).
+        on_drop: called with every dropped item, ie. to give its frame pool slot back.
+        spill_limit: SPILL only, items the overflow area takes before dropping the oldest ones.
+        """
+        if maxsize <= 0:
+            raise ValueError(f"Queue {name} needs a bound")
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL):
+            raise ValueError(f"Unknown queue policy {policy}")
+        if policy == SPILL and not spill_limit:
+            raise ValueError(f"Queue {name} needs a bound for its overflow too")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_limit = spill_limit or 0
+        self.droppable = droppable or (lambda item: True)
+        self.on_drop = on_drop
+        self._items = collections.deque()
+        self._spilled = collections.deque()
+        self._condition = threading.Condition()
+
+        # Counters
+        self.put_count = 0
+        self.dropped = 0
+        self.spilled = 0            # Items that went to the overflow area
+        self.blocked = 0            # Puts that had to wait for room
+        self.high_water = 0
+
+    def put(self, item, block=True, timeout=None):
+        dropped = None
+        with self._condition:
+            if not self._has_room():
+                if self.policy in (DROP_OLDEST, SPILL):
+                    dropped = self._evict_oldest_droppable()
+                if dropped is None and self.policy != BLOCK and self.droppable(item):
+                    dropped = item      # DROP_NEWEST, or DROP_OLDEST / SPILL with nothing else to drop
+                elif dropped is None:
+                    self.blocked += 1
+                    if not block or not self._condition.wait_for(self._has_room, timeout=timeout):
+                        raise queue.Full
+            if dropped is not item:
+                self._append(item)
+                self._accepted()
+            if dropped is not None:
+                self.dropped += 1
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items, timeout=timeout if block else 0):
+                raise queue.Empty
+            item = self._items.popleft()
+            if self._spilled:
+                self._items.append(self._spilled.popleft())     # Overflow moves in as room frees up, in order
+            self._condition.notify_all()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._condition:
+            return len(self._items) + len(self._spilled)
+
+    def full(self):
+        with self._condition:
+            return len(self._items) >= self.maxsize
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def stats(self):
+        with self._condition:
+            return {
+                "depth": len(self._items) + len(self._spilled),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "high_water": self.high_water,
+                "put": self.put_count,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "blocked": self.blocked,
+            }
+
+    def _has_room(self):
+        return len(self._items) < self.maxsize or len(self._spilled) < self.spill_limit
+
+    def _append(self, item):
+        # Overflow first: a drop may have made room in the queue, and the overflow is older than this item
+        if self._spilled and len(self._items) < self.maxsize:
+            self._items.append(self._spilled.popleft())
+        if len(self._items) < self.maxsize:
+            self._items.append(item)
+        else:
+            self._spilled.append(item)
+            self.spilled += 1
+
+    def _accepted(self):
+        self.put_count += 1
+        self.high_water = max(self.high_water, len(self._items) + len(self._spilled))
+        self._condition.notify_all()
+
+    def _evict_oldest_droppable(self):
+        for items in (self._items, self._spilled):
+            for i, queued in enumerate(items):
+                if self.droppable(queued):
+                    del items[i]
+                    return queued
+        return None
+
+
+def format_queue_stats(stats):
+    text = f"{stats['depth']}/{stats['maxsize']} (max {stats['high_water']})"
+    for counter in ("dropped", "spilled", "blocked"):
+        if stats.get(counter):
+            text += f", {stats[counter]} {counter}"
+    return text
@@ -0,0 +1,96 @@
+import time
+from collections import deque
+
+
+#
+# Adaptive quality governor: keeps detection at the camera's pace when the Pi can't do everything it's asked to, by
+# giving up the nice-to-haves first.
+#
+# Every evaluation, it looks at how much of the frame budget (1 / FPS) the capture loop used per frame since the
+# previous one, at the CPU temperature and at the firmware throttling flags. Under pressure (too much of the budget,
+# too hot, or throttled) for a couple of evaluations in a row, it moves one step down a ladder of settings; relaxed
+# (well under the budget, cool and not throttled) for longer, one step back up. In between, it holds. That gap, the
+# longer way back up and a settle time after every change (so the metrics reflect it before judging again) keep it
+# from going back and forth.
+#
+# The ladder is just a list of setting changes. Put the streaming ones first (fewer frames, lower quality, smaller,
+# no debug stack) and what detection works on (FRAME_SCALING) last, and detection keeps priority over visualization.
+#
+
+class QualityGovernor:
+    def __init__(self, baseline, steps, high_load=0.85, low_load=0.6, hot_temp=75.0, cool_temp=68.0,
+                 degrade_after=2, recover_after=6, settle_time=10.0, history=20):
+        self.baseline = dict(baseline)      # Configured value of every setting the steps touch
+        self.steps = steps                  # Setting changes of every step down, on top of the previous steps
+        self.high_load = high_load          # Fraction of the frame budget used per frame above which it's pressure...
+        self.low_load = low_load            # ...and below which it's room to give quality back
+        self.hot_temp = hot_temp            # CPU temperature (C) that is pressure...
+        self.cool_temp = cool_temp          # ...and the one to be under to step back up
+        self.degrade_after = degrade_after  # Evaluations in a row under pressure before a step down
+        self.recover_after = recover_after  # Evaluations in a row relaxed before a step up
+        self.settle_time = settle_time      # Seconds after a change before the next one
+        self.level = 0                      # Steps down taken, 0 for the configured settings
+        self.pressure_count = 0
+        self.relaxed_count = 0
+        self.last_change_time = None
+        self.signals = "no data yet"
+        self.decisions = deque(maxlen=history)
+
+    def settings(self, level=None):
+        """Every setting at a level (the current one by default)."""
+        settings = dict(self.baseline)
+        for step in self.steps[:self.level if level is None else level]:
+            settings.update(step)
+        return settings
+
+    def evaluate(self, now, load, temperature=None, throttled=False):
+        """
+        load: capture loop time per frame over the last interval, as a fraction of the frame budget (None if unknown).
+        temperature: CPU temperature, in C (None if unknown). throttled: the firmware is capping the CPU right now.
+        Returns the settings that change ({name: value}) when the level changed, None otherwise.
+        """
+        reasons = []
+        if load is not None and load > self.high_load:
+            reasons.append(f"load {load:.0%}")
+        if temperature is not None and temperature >= self.hot_temp:
+            reasons.append(f"{temperature:.1f} C")
+        if throttled:
+            reasons.append("throttled")
+        # Stepping back up needs evidence: no frame times (no new metrics) is not relaxed
+        relaxed = (not reasons and load is not None and load < self.low_load and
+                   (temperature is None or temperature < self.cool_temp))
+        self.pressure_count = self.pressure_count + 1 if reasons else 0
+        self.relaxed_count = self.relaxed_count + 1 if relaxed else 0
+        self.signals = ", ".join(filter(None, (
+            f"load {load:.0%}" if load is not None else None,
+            f"{temperature:.1f} C" if temperature is not None else None,
+            "throttled" if throttled else None))) or "no data"
+
+        if self.last_change_time is not None and now - self.last_change_time < self.settle_time:
+            return None
+        if self.pressure_count >= self.degrade_after and self.level < len(self.steps):
+            return self._change(now, self.level + 1, ", ".join(reasons))
+        if self.relaxed_count >= self.recover_after and self.level > 0:
+            return self._change(now, self.level - 1, "relaxed")
+        return None
+
+    def _change(self, now, level, reason):
+        previous = self.settings()
+        direction = "down" if level > self.level else "up"
+        self.level = level
+        self.last_change_time = now
+        self.pressure_count = 0
+        self.relaxed_count = 0
+        changes = {name: value for name, value in self.settings().items() if previous[name] != value}
+        self.decisions.append({"time": now, "direction": direction, "level": level, "reason": reason, "changes": changes})
+        return changes
+
+    def status(self):
+        """One line: level, what it changed from the configured settings, last signals and last decision."""
+        changed = ", ".join(f"{name}={value}" for name, value in self.settings().items() if self.baseline[name] != value)
+        status = f"level {self.level}/{len(self.steps)}{f' ({changed})' if changed else ''}, {self.signals}"
+        if self.decisions:
+            decision = self.decisions[-1]
+            status += (f"; last: {decision['direction']} to {decision['level']} at "
+                       f"{time.strftime('%H:%M:%S', time.localtime(decision['time']))} ({decision['reason']})")
+        return status
@@ -1,15 +1,42 @@
+import time
+import_start = time.perf_counter()     # Startup is timed from here: the imports, then the first processed frame
+import argparse
+import ast
+import atexit
 import queue
-from flask import Flask, Response, render_template_string, request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+from flask import Flask, Response, render_template_string, request, send_from_directory
 import threading
 import cv2
 import numpy as np
-from picamera2 import Picamera2
-import time
-import psutil
-import subprocess
-import requests
+import os
+import sys
 from enum import Enum, auto
 import math
+import json
+import random
+import shutil
+import signal
+from frame_sources import create_frame_source
+from shm_ring import SharedFrameQueue
+from frame_pool import FramePool
+from meta_strip import MetaStrip
+from photo_finish import PhotoFinish
+from frame_burst import FrameBurst
+from crossing_artifacts import crop_region, encode_image, image_name, mime_type, save_image, warm_up
+from stream_hub import StreamHub
+from event_spool import EventSpool
+from pipeline_queue import PipelineQueue, DROP_OLDEST, BLOCK, SPILL, format_queue_stats
+from preprocessing import BandPreprocessor, DetectionConfig, legacy_preprocess
+from stage_metrics import StageMetrics, format_stage_summary, render_prometheus
+from multi_tracking import MultiTracker
+from blob_tracker import KalmanBlobTracker
+from calibration import GroundCalibration, SpeedEstimator
+from quality_governor import QualityGovernor
+from system_sampler import SystemSampler, THROTTLED_NOW_FLAGS, format_system_status
+from background_snapshot import load_snapshot, matches, save_snapshot, scene_similarity
+from event_schema import BINARY_CONTENT_TYPE, crossing_event, form_fields, image_id, pack_batch, to_binary, to_json, with_images
 
 
 
@@ -21,6 +48,10 @@ FRAME_HEIGHT = 720  # Capture height, native being 864 for a pi cam 3
 FRAME_SCALING = 0.4 # Scaling ratio for processing efficiency
 FRAME_FPS = 60      # FPS target
 DUAL_STREAM_MODE = False
+ROI_FIRST_PREPROCESSING = True  # Crop the band, gray and area-downscale it (into reused buffers), instead of blurring, resizing and graying the whole frame
+ZERO_COPY_ACQUISITION = False   # If True, detection reads the camera's own buffers (no copy of every frame), and full frames are only copied when handed over (streaming, crossings)
+CAMERA_BUFFER_COUNT = 6         # With ZERO_COPY_ACQUISITION only: buffers the camera fills in turn (None for Picamera2's default). Zero-copy holds 2: with too few left, the camera drops frames (see the frame pool status)
+FRAME_SOURCE = os.environ.get("LAPDETECTOR_SOURCE", "picamera2")   # "picamera2", "synthetic[:fast]", or a video file / image sequence / image folder (with optional ":loop")
 DETECT_WHILE_TRACKING = False  # If True, will use detection while tracking. Contours will expand, but it will be CPU heavy and needs tweaking here and there!
 
 META_LINE_X_PX = 800                # X position of the detection line, in pixels
@@ -28,16 +59,127 @@ MIN_Y_FACTOR = 0.20                # Minimum Y position of the detection line, i
 MAX_Y_FACTOR = 0.85                # Maximum Y position of the detection line, in percentage
 WIDTH_OFFSET = 0.60         # Offset for the width of the detection line, in percentage, to mitigate detecting only fronts of the cars
 MIN_COUNTOUR_AREA = 0.02    # Minimum area of contour to consider for tracking, in percentage of the frame size
+BACKGROUND_MODEL_MARGIN = 0.1       # Fraction of the frame height modelled at each side of the band: moves within it are free, out of it need a cool down. None: the whole frame (band moves always free, but more CPU)
+
+# === Background snapshots ===
+BACKGROUND_SNAPSHOT_FILE = os.environ.get("LAPDETECTOR_BACKGROUND_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "background.npz"))  # Learned background, saved to start warm after a restart. None to always learn it from scratch
+BACKGROUND_SNAPSHOT_INTERVAL = 60.0             # Seconds between snapshots while detecting (and one more when the capture stops)
+BACKGROUND_SNAPSHOT_MIN_CORRELATION = 0.9       # Live scene against the snapshot (both downscaled): below this, something moved and the background is learned from scratch...
+BACKGROUND_SNAPSHOT_MAX_BRIGHTNESS_SHIFT = 25   # ...and the same beyond this difference of mean gray level (the light changed)
+BACKGROUND_WARM_START_TIME = 0.1                # Cool down after a warm start, instead of COOL_DOWN_TIME: the live frames refine the snapshot
+
+# === Multi-object tracking ===
+MULTI_OBJECT_TRACKING = False       # If True, every car gets its own track and crossing (contours associated from frame to frame), instead of a single tracker on the largest contour
+LANES = None                        # Lanes as (min, max) Y factors, ie. ((0.30, 0.54), (0.54, 0.78)): contours are found per lane, so cars side by side don't merge. None for a single lane, the whole band
+MAX_TRACKS = 8                      # Cars tracked at the same time
+TRACK_MAX_MISSED_TIME = 0.2         # Seconds a track survives without a contour
+TRACK_MAX_DISTANCE = 0.08           # Max centroid jump of a track between frames, in percentage of the frame width (when its boxes don't overlap)
+
+# === Ground plane calibration ===
+CALIBRATION_FILE = os.environ.get("LAPDETECTOR_CALIBRATION", os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.json"))   # Camera model or homography to track meters (see calibration.py). The default camera model when there's no such file
+SPEED_WINDOW = 12                   # Last positions of a car its speed is fitted over
+
+# === Meta strip (line-scan) mode ===
+META_STRIP_MODE = False                     # If True, only a narrow strip around the meta line is watched while idle (no MOG2, contours nor tracking until something gets there)
+META_STRIP_HALF_WIDTH_PX = None             # Strip columns at each side of the meta line, in full resolution pixels (None: derived from the two below)
+META_STRIP_MAX_SPEED_PX_S = 1300            # Fastest expected car, in full resolution pixels per second
+META_STRIP_LEAD_FRAMES = 3                  # Frames a car needs between waking up the strip and reaching the line: detection + tracker init, first update (direction), activation margin
+META_STRIP_ROW_STEP = 2                     # Only one of every {x} rows of the strip is looked at
+META_STRIP_IDLE_TIME = 0.3                  # Seconds without contours before going back to watching the strip only
+META_STRIP_BACKGROUND_EVERY_X_FRAMES = 10   # While idle, the full background model is still fed every {x} frames
+
+# === Photo finish ===
+PHOTO_FINISH = True                 # Line-scan photo finish out of the meta line column(s) of every frame, attached to the crossing events
+PHOTO_FINISH_COLUMNS_PER_FRAME = 1  # Columns taken from each frame (1 for a true line-scan)
+PHOTO_FINISH_BEFORE_TIME = 0.5      # Seconds of line-scan before the crossing
+PHOTO_FINISH_AFTER_TIME = 0.25      # Seconds of line-scan after the crossing
+PHOTO_FINISH_WAIT = True            # EVENTS_PAYLOAD "form" only: events wait for their photo finish (up to PHOTO_FINISH_AFTER_TIME + 1 s). If False, they go out right away, with it only when it's ready by then (rarely)
+
+# === Crossing bursts ===
+BURST_CAPTURE = False               # Frames from BURST_FRAMES_BEFORE before every crossing to BURST_FRAMES_AFTER after it, saved to BURST_DIR for frame-by-frame review
+BURST_FRAMES_BEFORE = 15
+BURST_FRAMES_AFTER = 15
+BURST_SCALING = 1.0                 # Size of the frames kept, relative to the captured ones (0.5 fits four times as many frames in the same memory)
+BURST_MAX_MB = 200                  # Memory cap of the frame ring. Up to two bursts fit, so a burst being encoded doesn't cut the next one short
+BURST_FORMAT = "jpg"                # "jpg" for a JPEG per frame, "mp4" for a clip
+BURST_DIR = os.environ.get("LAPDETECTOR_BURST_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bursts"))
+BURST_KEEP = 100                    # Bursts kept on disk, the oldest ones are deleted
+
+# === Crossing images ===
+CROSSING_IMAGE_FORMAT = "jpg"       # "jpg", "webp" or "png"
+CROSSING_IMAGE_QUALITY = 90         # JPEG / WebP quality (PNG is lossless)
+CROSSING_CROP_MARGIN = 0.5          # Frames cropped to the cars that crossed and the meta line, plus this margin (fraction of the crop size). None for whole frames
+CROSSING_THUMBNAIL_WIDTH = 320      # Pixels. Small image of the crossing, encoded first (None for none)
+CROSSING_FULL_SIZE = "eager"        # "eager": full-size images go with the event. "lazy": only the thumbnail does (the event doesn't wait for the rest), and full-size images are encoded afterwards, to be fetched from /crossing_images/<name>/b-frame.jpg
+CROSSING_FULL_SIZE_KEEP = 100       # Lazy: crossings whose full-size images are kept
+CROSSING_ENCODE_WORKERS = 2         # Processes encoding crossing images, away from the capture loop (threads of the post-processing processes in multi-process mode). 0 to encode them in the crossing thread
 
 # === Streaming quality ===
 STREAM_QUALITY = 35
+STREAM_QUALITY_LEVELS = (15, 25, STREAM_QUALITY)    # Viewers can ask for a lower quality (?quality=25); each level being watched is encoded once per frame
+STREAM_MAX_VIEWER_FPS = None        # Default frame rate cap per viewer (viewers can ask for their own with ?fps=5)
 STREAM_EVERY_X_FRAMES = 3   # It will stream only every {x} frames
-STREAM_SCALING = 0.4
-streaming_frame_queue_main = queue.Queue(maxsize=2)  # smoother than a lock
-streaming_frame_queue_extra = queue.Queue(maxsize=2)  # smoother than a lock
+STREAM_SCALING = 1.0        # Size of the main stream, relative to the captured frames
+STREAM_DEBUG_STACK = True   # Build the extra stream (background, band, threshold and edges) when somebody watches it
+streaming_frame_queue = None        # Multi-process mode only: encoded frames from post-processing to the web server hubs
+
+# === Quality governor ===
+QUALITY_GOVERNOR = True             # Gives up streaming quality (and processing resolution, as a last resort) when frames take too long, the CPU is too hot or it's throttled, and gives it back when things calm down
+GOVERNOR_STEPS = (                  # Every step down, on top of the previous ones: streaming first, detection last. FRAME_SCALING can only go down from the configured one
+    {"STREAM_EVERY_X_FRAMES": 6},
+    {"STREAM_QUALITY": 20, "STREAM_SCALING": 0.5},
+    {"STREAM_DEBUG_STACK": False},
+    {"STREAM_EVERY_X_FRAMES": 12},
+    {"FRAME_SCALING": 0.3},
+)
+GOVERNOR_HIGH_LOAD = 0.85           # Fraction of the frame budget (1 / FRAME_FPS) the capture loop takes per frame above which it steps down...
+GOVERNOR_LOW_LOAD = 0.6             # ...and below which it can step back up
+GOVERNOR_HOT_TEMP = 75.0            # CPU temperature (C) at which it steps down (the Pi 4 throttles at 80)...
+GOVERNOR_COOL_TEMP = 68.0           # ...and below which it can step back up
+GOVERNOR_SETTLE_TIME = 10.0         # Seconds after a change before the next one, for the metrics to reflect it
+
+# === Pipeline queues ===
+POST_PROCESSING_QUEUE_SIZE = 4      # Frames waiting for post-processing (threaded mode, the ring bounds it otherwise). Oldest streaming frames are dropped first, crossing frames wait
+META_CROSSING_QUEUE_SIZE = 4        # Crossings waiting for their images to be encoded. Post-processing waits when full: laps are never dropped
+PENDING_EVENTS_QUEUE_SIZE = 50      # Wake-up calls for the publisher (the events themselves wait in the spool). Beyond this, they spill to an overflow list
+PENDING_EVENTS_SPILL_LIMIT = 1000   # Wake-ups the overflow list takes before dropping the oldest (their events are still found by the spool polling)
+
+# === Event spool ===
+EVENT_SPOOL_DIR = os.environ.get("LAPDETECTOR_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+EVENT_SPOOL_MAX_MB = 500            # Disk cap: beyond this, images of the oldest pending events are dropped (their lap times are always kept)
+EVENT_SPOOL_POLL_INTERVAL = 1.0     # Seconds between spool checks when nothing new comes in (retries, events from before a restart)
+CROSSING_FULL_SIZE_DIR = os.path.join(EVENT_SPOOL_DIR, "full-size")     # Lazy full-size crossing images
+
+# === Events server ===
+EVENTS_SERVER_URL = os.environ.get("LAPDETECTOR_SERVER_URL", "http://192.168.50.166:8080")
+EVENTS_LAP_ID = os.environ.get("LAPDETECTOR_LAP_ID", "42")
+EVENTS_BATCH_PATH = None            # Batch endpoint (ie. "/laps/{lap_id}/batch") taking several events per request, or None to post them one by one to /lap/{lap_id}
+EVENTS_BATCH_SIZE = 8               # Max events per batch request
+EVENTS_PAYLOAD = "form"             # "form": fields and images in one multipart request (what the server has always taken). "json" or "binary": the event alone (a few hundred bytes, see event_schema), images after it
+EVENTS_PATH = "/lap/{lap_id}/events"                # Where "json" and "binary" events are posted (one per request, EVENTS_BATCH_PATH otherwise)
+EVENTS_IMAGE_PATH = "/lap/{lap_id}/images/{image_id}"   # Where their images are PUT, by content hash: an image already sent is not sent again
+UPLOADED_IMAGES_MEMORY = 256        # Image hashes remembered as sent
+EVENTS_IN_ORDER = True              # Events reach the server in crossing order: one request in flight, and an event being retried holds back the later ones
+PUBLISHER_CONCURRENCY = 2           # With EVENTS_IN_ORDER False: requests in flight at the same time, each over its own persistent connection (later events may overtake earlier ones, and retried ones)
+EVENTS_POST_TIMEOUT = 5.0           # Seconds
+EVENT_RETRY_BASE_DELAY = 0.5        # Seconds before the first retry of an event the server didn't take, doubling on every attempt...
+EVENT_RETRY_MAX_DELAY = 60.0        # ...up to this (plus jitter, so retries after an outage don't all come at once)
+
+# === Multi-process mode ===
+MULTIPROCESS_MODE = False           # If True, capture+detection, post-processing and publishing run in their own processes (no GIL contention)
+POST_PROCESSING_PROCESSES = 2       # Processes drawing overlays and encoding JPEGs
+SHARED_RING_SLOTS = 8               # Frames in flight between capture and post-processing, ~6 MB each at 720p
+FRAME_POOL_SLOTS = 6                # Preallocated slots for frames handed over to post-processing, ~6 MB each at 720p
 
 # === Globals ===
 trigger_cooldown = False
+capture_stop = threading.Event()        # Set to stop the capture loop (it saves the background snapshot first)...
+capture_stopped = threading.Event()     # ...and this, once it did
+# Live detection settings (the ones above are just the initial values). Replaced whole, never mutated: the capture
+# loop takes one snapshot per frame
+detection_config = DetectionConfig(META_LINE_X_PX, MIN_Y_FACTOR, MAX_Y_FACTOR, WIDTH_OFFSET, MIN_COUNTOUR_AREA, LANES)
+ground_calibration = GroundCalibration.from_file(CALIBRATION_FILE) if os.path.exists(CALIBRATION_FILE) else GroundCalibration()
+detection_config_lock = threading.Lock()
 new_tracker_type = None
 recalibrate_flag = False
 
@@ -47,28 +189,161 @@ COOL_DOWN_TIME = 1.0                # Seconds
 TRACKING_TIMEOUT = 8.0              # Max time in the same tracker
 TRACKING_RESILIENCE_LIMIT = 0.05    # Max time without tracking success before swtiching to DETECTING mode
 DETECT_SHADOWS = False              # For the background substractor config
+BACKGROUND_SUBTRACTOR = "MOG2"      # "MOG2" or "KNN"
 TRACKER_TYPE = None
 tracker = None
 fps_global_string = "Calculating..."
 MONITORING_INTERVAL = 2.5           # Seconds. Watch out for the CPU usage spike when changing this value.
+SYSTEM_HISTORY_SIZE = 720           # System status samples (one every MONITORING_INTERVAL) kept for /get_status_history: 30 min
+VCGENCMD_EVERY_X_SAMPLES = 12       # The firmware (ARM clock, and throttling flags when sysfs doesn't have them) is only asked every {x} samples
 
 last_status_time = 0
 last_status_result = {}
 
 # Tracker timing & movement
 tracker_start_time = None
-tracker_start_bbox = None
 tracker_last_success_time = None
 last_bbox_in_subframe_coordinates = None
 
-# After motion detection, tracking, etc. frames are queued for processing
-post_processing_queue = queue.Queue(maxsize=0)
+# After motion detection, tracking, etc. frames are queued for processing. When post-processing is late, the
+# oldest streaming frames are dropped (and their frame pool slots given back), but crossing frames are not.
+def is_streaming_item(item):
+    return item[9] == 0     # No meta crossing
+
+def release_item_slot(item):
+    if item[-1] is not None:
+        item[-1].release()
+
+post_processing_queue = PipelineQueue("post_processing", POST_PROCESSING_QUEUE_SIZE, DROP_OLDEST,
+                                      droppable=is_streaming_item, on_drop=release_item_slot)
+
+# Preallocated slots holding the frames queued for post-processing (built by the capture loop)
+frame_pool = None
+frame_pool_status = "Calculating..."
 
 # Meta crossing queue, holding the last frame with a crossing and lots of additional data
-meta_crossing_queue = queue.Queue(maxsize=0)
+meta_crossing_queue = PipelineQueue("meta_crossing", META_CROSSING_QUEUE_SIZE, BLOCK)
+
+# Crossing events are spooled to disk until the server takes them (built at startup, before any fork)
+event_spool = None
+
+def setup_event_spool():
+    global event_spool
+    event_spool = EventSpool(EVENT_SPOOL_DIR, EVENT_SPOOL_MAX_MB * 1024 * 1024)
+    print(f">>> Event spool at {EVENT_SPOOL_DIR}: {event_spool.status()}")
+
+# Queue waking the publisher up when there are new events in the spool
+def build_pending_events_queue():
+    return PipelineQueue("pending_events", PENDING_EVENTS_QUEUE_SIZE, SPILL, spill_limit=PENDING_EVENTS_SPILL_LIMIT)
+
+pending_events_queue = build_pending_events_queue()
+
+# Photo finishes, completed a bit after their crossings, are joined with their events right before publishing them
+photo_finish_queue = PipelineQueue("photo_finish", 10, DROP_OLDEST)
+
+# Bursts waiting to be encoded, their frames still frozen in the capture loop's ring (given back when dropped)
+def release_burst_slots(item):
+    item[0].release(item[3])
+
+burst_queue = PipelineQueue("burst", 2, DROP_OLDEST, on_drop=release_burst_slots)
+
+# Latency histograms of every pipeline stage, and frame/event counters (per process in multi-process mode)
+stage_metrics = StageMetrics()
+metrics_snapshots = {}      # Multi-process mode: process name -> snapshot, as published by every process
+last_metrics_publish_time = 0
+
+def publish_metrics():
+    global last_metrics_publish_time
+    if MULTIPROCESS_MODE and time.time() - last_metrics_publish_time >= MONITORING_INTERVAL:
+        publish_status("metrics_snapshots", {mp.current_process().name: stage_metrics.snapshot()})
+        last_metrics_publish_time = time.time()
+
+def current_metrics_snapshots():
+    return metrics_snapshots if MULTIPROCESS_MODE else {"main": stage_metrics.snapshot()}
+
+# Depth, high-water mark and drop counters of the queues above (in multi-process mode, as reported by their producers)
+queue_stats = {}
+
+def current_queue_stats():
+    return queue_stats if MULTIPROCESS_MODE else local_queue_stats()
+
+def local_queue_stats(*names):
+    queues = {"post_processing": post_processing_queue, "meta_crossing": meta_crossing_queue,
+              "pending_events": pending_events_queue, "photo_finish": photo_finish_queue, "burst": burst_queue}
+    stats = {name: queues[name].stats() for name in names or queues if hasattr(queues[name], "stats")}
+    if MULTIPROCESS_MODE:
+        stats = {f"{name} ({mp.current_process().name})": value for name, value in stats.items()}
+    return stats
+
+# In multi-process mode, config changes go from the web server to every process, and status comes back
+control_queues = []
+status_queue = None
+
+def build_frame_pool():
+    # Every slot holds the stack of internal images (background, subframe, threshold and edges) and a scratch
+    # buffer. Full frames are only needed in threaded mode: the shared-memory ring has its own slots for them.
+    scaled_width = int(FRAME_WIDTH * FRAME_SCALING)
+    scaled_height = int(FRAME_HEIGHT * FRAME_SCALING)
+    fields = {
+        "stack": ((4 * scaled_height + 3, scaled_width), np.uint8),
+        "scratch": ((scaled_height, scaled_width), np.uint8),
+    }
+    if MULTIPROCESS_MODE:
+        return FramePool(fields, 2)
+    fields["prev_frame"] = ((FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8)
+    fields["curr_frame"] = ((FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8)
+    return FramePool(fields, FRAME_POOL_SLOTS)
+
+def stack_views(stack_buffer, subframe_height):
+    # Background, current subframe, background threshold and edges, one on top of the other with 1px lines in between
+    h = subframe_height
+    stack = stack_buffer[:4 * h + 3]
+    stack[h] = 255
+    stack[2 * h + 1] = 255
+    stack[3 * h + 2] = 255
+    return stack, stack[:h], stack[h + 1:2 * h + 1], stack[2 * h + 2:3 * h + 2], stack[3 * h + 3:]
+
+# Quality levels being watched per stream, as reported by the hubs: post-processing only encodes these
+stream_qualities = {"main": set(), "extra": set()}
+
+def on_stream_viewers_change(name, qualities):
+    global stream_qualities
+    stream_qualities = {**stream_qualities, name: qualities}   # Replaced, not mutated: readers in other threads see old or new
+    broadcast_control("stream_qualities", stream_qualities)
+
+# One hub per stream, fanning each encoded frame out to every viewer
+stream_hubs = {name: StreamHub(name, STREAM_QUALITY_LEVELS, on_change=on_stream_viewers_change) for name in ("main", "extra")}
+
+def is_streaming_frame(frame_counter):
+    # No viewers, no streaming frames: post-processing only gets the crossings
+    return frame_counter % STREAM_EVERY_X_FRAMES == 0 and any(stream_qualities.values())
+
+def update_detection_config(**changes):
+    """Applies changes to the detection settings as a new snapshot, everywhere. Raises ValueError if they don't make sense."""
+    global detection_config
+    with detection_config_lock:     # Concurrent requests don't undo each other's changes
+        config = detection_config._replace(**changes)
+        if not 0 <= config.min_y_factor < config.max_y_factor <= 1:
+            raise ValueError("Min Y must be less than Max Y")
+        if not 0 <= config.meta_line_x < FRAME_WIDTH:
+            raise ValueError("Line X out of the frame")
+        detection_config = config
+        broadcast_control("detection_config", config)
+    return config
+
+def broadcast_control(name, value=None):
+    for control_queue in control_queues:
+        try:
+            control_queue.put_nowait((name, value))
+        except queue.Full:
+            print(f"Control queue full, {name} not propagated")
 
-# Queue with the list of pending events to be sent to the server
-pending_events_queue = queue.Queue(maxsize=0)
+def publish_status(name, value):
+    if status_queue is not None:
+        try:
+            status_queue.put_nowait((name, value))
+        except queue.Full:
+            pass
 
 
 # === Flask HTML Template ===
@@ -130,6 +405,13 @@ HTML_PAGE = """
     <p><strong>CPU Frequency:</strong> <span id="cpuFreq">0</span></p>
     <p><strong>Memory Usage:</strong> <span id="memUsage">0</span></p>
     <p><strong>Throttle Status:</strong> <span id="throttlingStatus">Checking...</span></p>
+    <p><strong>Frame Pool:</strong> <span id="framePool">Calculating...</span></p>
+    <p><strong>Event Spool:</strong> <span id="eventSpool">Calculating...</span></p>
+    <p><strong>Stages p50/p95/p99/max:</strong> <span id="stages">Calculating...</span></p>
+    <p><strong>Queues:</strong> <span id="queues">Calculating...</span></p>
+    <p><strong>Viewers:</strong> <span id="viewers">Calculating...</span></p>
+    <p><strong>Quality Governor:</strong> <span id="governor">Calculating...</span></p>
+    <p><strong>Startup:</strong> <span id="startup">Calculating...</span></p>
   </div>
 
 </div>
@@ -160,6 +442,13 @@ function updateSystemInfo() {
             document.getElementById("cpuFreq").innerText = data.cpu_freq;
             document.getElementById("memUsage").innerText = data.mem_usage;
             document.getElementById("throttlingStatus").innerText = data.throttling_status;
+            document.getElementById("framePool").innerText = data.frame_pool;
+            document.getElementById("eventSpool").innerText = data.event_spool;
+            document.getElementById("stages").innerText = data.stages;
+            document.getElementById("queues").innerText = data.queues;
+            document.getElementById("viewers").innerText = data.viewers;
+            document.getElementById("governor").innerText = data.governor;
+            document.getElementById("startup").innerText = data.startup;
         });
 }
 setInterval(updateSystemInfo, 3000);
@@ -167,128 +456,122 @@ setInterval(updateSystemInfo, 3000);
 """
 
 class SystemMode(Enum):
+    IDLE = auto()           # Meta strip mode only: watching the strip around the meta line
     DETECTING = auto()
     TRACKING = auto()
     COOL_DOWN = auto()
 mode_colors = {
+    SystemMode.IDLE: (255, 0, 255),
     SystemMode.COOL_DOWN: (255, 255, 0),
     SystemMode.DETECTING: (0, 255, 255),
     SystemMode.TRACKING: (0, 255, 0),
 }
 
 # === Tracker Setup ===
+class ColorFramesTracker:
+    # KCF fails on gray frames once the box touches the frame border (ie. a car coming in from the edge): an empty
+    # matrix error in update(). It gets the detection frames as BGR instead, and tracks them by their color names
+    # features: no crash, but ~25 ms a frame against ~0.5 ms for MOSSE
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def init(self, frame, bbox):
+        return self.tracker.init(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), bbox)
+
+    def update(self, frame):
+        return self.tracker.update(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+
 def get_available_trackers():
     trackers = {
         'MOSSE': cv2.legacy.TrackerMOSSE_create if hasattr(cv2.legacy, 'TrackerMOSSE_create') else None,
         'CSRT': cv2.legacy.TrackerCSRT_create if hasattr(cv2.legacy, 'TrackerCSRT_create') else None,
-        'KCF': cv2.legacy.TrackerKCF_create if hasattr(cv2.legacy, 'TrackerKCF_create') else None
+        'KCF': (lambda: ColorFramesTracker(cv2.legacy.TrackerKCF_create())) if hasattr(cv2.legacy, 'TrackerKCF_create') else None
     }
-    return {name: create for name, create in trackers.items() if create}
+    trackers = {name: create for name, create in trackers.items() if create}
+    trackers['KALMAN'] = KalmanBlobTracker     # Follows the foreground blob (see blob_tracker.py), always available
+    return trackers
 AVAILABLE_TRACKERS = get_available_trackers()
 TRACKER_TYPE = list(AVAILABLE_TRACKERS.keys())[0]
 
-def init_tracker(frame, bbox):
+def init_tracker(frame, bbox, get_background_image=None):
     create_func = AVAILABLE_TRACKERS[TRACKER_TYPE]
-    t = create_func()
+    # The blob tracker compares frames against the background, the OpenCV ones only look at the frames
+    t = create_func(get_background_image()) if create_func is KalmanBlobTracker else create_func()
     t.init(frame, bbox)
     return t
 
-def get_cpu_temp():
-    try:
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-            return int(f.read()) / 1000
-    except FileNotFoundError:
+# === Background Subtractor Setup ===
+# Use MOG2 for better performance in low light conditions
+# Use KNN for better performance in bright light conditions
+# history: Number of frames to use for background modeling.
+# varThreshold / dist2Threshold: Higher = less sensitive to movement.
+# detectShadows: If True, shadows will be marked gray (127), not white (255).
+def create_background_subtractor():
+    if BACKGROUND_SUBTRACTOR == "KNN":
+        return cv2.createBackgroundSubtractorKNN(history=50, dist2Threshold=200.0, detectShadows=DETECT_SHADOWS)
+    return cv2.createBackgroundSubtractorMOG2(history=150, varThreshold=32, detectShadows=DETECT_SHADOWS)
+
+def meta_strip_half_width():
+    # The strip must wake the tracker up early enough to know the car direction before it gets to the line
+    if META_STRIP_HALF_WIDTH_PX is not None:
+        return META_STRIP_HALF_WIDTH_PX
+    return math.ceil(META_STRIP_MAX_SPEED_PX_S / FRAME_FPS * META_STRIP_LEAD_FRAMES)
+
+
+def frozen_learning_rate(background):
+    # For the applies that must not learn (detection). OpenCV's KNN takes 0 as "learn at the default rate" (the car
+    # melts into its background while it's being detected), so it gets the smallest rate that still freezes it
+    return 1e-6 if isinstance(background, cv2.BackgroundSubtractorKNN) else 0
+
+def background_subtractor_id():
+    # What a background snapshot must have been learned with (see background_snapshot.py)
+    return f"{BACKGROUND_SUBTRACTOR}/shadows={DETECT_SHADOWS}"
+
+def load_background_snapshot(model_key):
+    """(background image, meta) of the snapshot when it was learned for this model area, None otherwise."""
+    if not BACKGROUND_SNAPSHOT_FILE:
         return None
+    snapshot = load_snapshot(BACKGROUND_SNAPSHOT_FILE)
+    if snapshot is None:
+        return None
+    if not matches(snapshot[1], snapshot[0], model_key, background_subtractor_id()):
+        print(">>> Background snapshot is for another model area or subtractor: learning the background from scratch")
+        return None
+    return snapshot
 
-def get_throttling_status():
-    try:
-        out = subprocess.check_output(['vcgencmd', 'get_throttled']).decode()
-        hex_value = int(out.strip().split('=')[1], 16)
-        flags = {
-            0x1: "Under-voltage",
-            0x2: "Freq capped",
-            0x4: "Throttled",
-            0x8: "Temp soft limit",
-            0x10000: "Under-voltage occurred",
-            0x20000: "Freq cap occurred",
-            0x40000: "Throttle occurred",
-            0x80000: "Temp limit occurred"
-        }
-        messages = [msg for bit, msg in flags.items() if hex_value & bit]
-        return "OK" if not messages else "; ".join(messages)
-    except Exception as e:
-        return f"Error: {e}"
-
-def get_cpu_freq():
+def save_background_snapshot(background, model_key, frame_time):
+    if not BACKGROUND_SNAPSHOT_FILE or background is None:
+        return
     try:
-        out = subprocess.check_output(['vcgencmd', 'measure_clock', 'arm']).decode()
-        cpu_freq = int(out.strip().split('=')[1]) / 1000000
-        per_cpu = psutil.cpu_freq(percpu=True)
-        max_freq = per_cpu[0].max if per_cpu else 0
-        return f"{cpu_freq:.0f} / {max_freq} MHz"
-    except Exception as e:
-        return f"Error: {e}"
+        save_snapshot(BACKGROUND_SNAPSHOT_FILE, background.getBackgroundImage(), model_key, background_subtractor_id(), frame_time)
+    except OSError as e:
+        print(f"Error saving the background snapshot: {e}")
+
+def warm_start_background(background, snapshot, frame):
+    """Seeds a new background model with a snapshot when the live frame still looks like it. True if it did."""
+    image, meta = snapshot
+    correlation, brightness_shift = scene_similarity(image, frame)
+    age = f"{(time.time() - meta['time']) / 60:.0f} min old"
+    if correlation < BACKGROUND_SNAPSHOT_MIN_CORRELATION or brightness_shift > BACKGROUND_SNAPSHOT_MAX_BRIGHTNESS_SHIFT:
+        print(f">>> Background snapshot ({age}) doesn't match the scene anymore (correlation {correlation:.2f}, "
+              f"brightness shift {brightness_shift:.0f}): learning the background from scratch")
+        return False
+    # A few updates with the same image: KNN needs several samples per pixel, MOG2 is set after the first one
+    for _ in range(5):
+        background.apply(image)
+    print(f">>> Background warm start from its snapshot ({age}, correlation {correlation:.2f}, brightness shift {brightness_shift:.0f})")
+    return True
 
 def reset_autofocus():
     try:
-        picam2.set_controls({"AfMode": 1})  # Continuous autofocus mode
-        picam2.set_controls({"AfTrigger": 0})  # Cancel any current AF action
+        frame_source.set_controls({"AfMode": 1})  # Continuous autofocus mode
+        frame_source.set_controls({"AfTrigger": 0})  # Cancel any current AF action
         time.sleep(0.1)
-        picam2.set_controls({"AfTrigger": 1})  # Start a new AF cycle
+        frame_source.set_controls({"AfTrigger": 1})  # Start a new AF cycle
         print("Autofocus reset triggered.")
     except Exception as e:
         print(f"Error resetting autofocus: {e}")
 
-import math
-
-def pixel_to_world(
-    x_px, y_px,
-    image_width, image_height,
-    fov_h_deg, fov_v_deg,
-    camera_height_m,
-    elevation_angle_deg
-):
-    # Convert FOV and elevation angle to radians
-    fov_h_rad = math.radians(fov_h_deg)
-    fov_v_rad = math.radians(fov_v_deg)
-    alpha_rad = math.radians(elevation_angle_deg)
-
-    # Normalized pixel coordinates [-1, 1]
-    nx = (x_px - image_width / 2) / (image_width / 2)
-    ny = (y_px - image_height / 2) / (image_height / 2)
-
-    # Map to ray direction in camera space
-    tan_h = math.tan(fov_h_rad / 2)
-    tan_v = math.tan(fov_v_rad / 2)
-    dir_cam = [
-        nx * tan_h,  # X direction
-        ny * tan_v,  # Y direction
-        1.0          # Z direction (forward)
-    ]
-
-    # Rotate around X-axis by elevation angle
-    cos_a = math.cos(alpha_rad)
-    sin_a = math.sin(alpha_rad)
-
-    dir_world = [
-        dir_cam[0],
-        dir_cam[1] * cos_a - dir_cam[2] * sin_a,
-        dir_cam[1] * sin_a + dir_cam[2] * cos_a
-    ]
-
-    # Find t such that Z = 0 (intersect with ground plane)
-    if dir_world[2] == 0:
-        raise ValueError("Ray is parallel to the ground plane.")
-
-    t = -camera_height_m / dir_world[2]
-
-    # Compute world coordinates on the road
-    X = t * dir_world[0]
-    Y = t * dir_world[1]
-
-    return (X, Y)
-
-
 # === Bounding Box Functions ===
 def bbox_contains(box_a, box_b):
     if box_a is None:
@@ -344,33 +627,80 @@ def bbox_center(box):
     x, y, w, h = box
     return (x + w // 2, y + h // 2)
 
+
+# === Speed ===
+def full_frame_bbox(geometry, bbox):
+    """A bbox in band coordinates, in full resolution pixels."""
+    x, y, w, h = bbox
+    return (int(x / geometry.scaling), int((geometry.min_scaled_y + y) / geometry.scaling),
+            int(w / geometry.scaling), int(h / geometry.scaling))
+
+def ground_position(geometry, bbox):
+    """Track meters of where a car (a bbox in band coordinates) touches the track: the bottom center of its bbox."""
+    x, y, w, h = bbox
+    return ground_calibration.world_point(x + w / 2, geometry.min_scaled_y + y + h - 1,
+                                          geometry.scaled_width, geometry.scaled_height)
+
+
+# === Crossing Time ===
+def estimate_crossing_time(edges, bbox, prev_bbox, line_x, direction, prev_frame_time, curr_frame_time, earliest_time):
+    """
+    Sub-frame estimation of when the leading edge of the car crossed the meta line.
+    The leading edge comes from the edges image (pixel accurate, unlike the tracker bbox, see the parallax problem),
+    and the speed from the bbox displacement between the previous and the current frame. Going back from the current
+    frame time at that speed gives the crossing time. Returns (crossing_time, uncertainty, before_track_start),
+    times in seconds. before_track_start: the car was already over the line when it was first tracked (earliest_time),
+    so all that's known is that it crossed before then, and the uncertainty spans the whole way back.
+    """
+    frame_interval = curr_frame_time - prev_frame_time
+    if prev_bbox is None or frame_interval <= 0:
+        return curr_frame_time, max(frame_interval, 0.0), False
+
+    x, y, w, h = (int(v) for v in bbox)
+    edge_columns = np.flatnonzero(edges[max(0, y):y + h, max(0, x):x + w].any(axis=0))
+    speed = ((bbox[0] + bbox[2] / 2) - (prev_bbox[0] + prev_bbox[2] / 2)) / frame_interval     # Pixels per second, signed
+    if len(edge_columns) == 0 or speed == 0:
+        return curr_frame_time, frame_interval / 2, False
+
+    if direction == 1:
+        overshoot = max(0, x + edge_columns[-1] - line_x)   # How far beyond the line the leading edge already is
+    else:
+        overshoot = max(0, line_x - (x + edge_columns[0]))
+        speed = -speed
+    if speed < 0:
+        return curr_frame_time, frame_interval / 2, False   # Bbox going backwards: no trustworthy speed
+
+    crossing_time = curr_frame_time - overshoot / speed
+    earliest_time = earliest_time if earliest_time else prev_frame_time
+    if crossing_time < earliest_time:
+        # Going back that far means extrapolating from frames where the car wasn't tracked yet: no precision to claim
+        return earliest_time, curr_frame_time - crossing_time, True
+    # One pixel of leading edge position, plus 10% of speed error over the time we're going back
+    uncertainty = math.sqrt((1.0 / speed) ** 2 + (0.1 * (curr_frame_time - crossing_time)) ** 2)
+    return crossing_time, min(uncertainty, curr_frame_time - crossing_time + frame_interval / 2), False
+
 # === Camera Setup ===
-picam2 = Picamera2()
-print(picam2.sensor_modes)
-if not DUAL_STREAM_MODE:
-    config = picam2.create_preview_configuration(
-       main={
-            "format": 'RGB888',
-            "size": (FRAME_WIDTH, FRAME_HEIGHT)
-        },
-        controls={"FrameRate": FRAME_FPS},
-#        buffer_count=10,   # Buffer count for preview
-#        queue=False,       # Risky...
-    )
-else:
-    config = picam2.create_preview_configuration(
-       main={
-            "format": 'RGB888',
-            "size": (FRAME_WIDTH, FRAME_HEIGHT)
-        },
-        lores={
-            "format": 'YUV420',
-            "size": (int(FRAME_WIDTH*FRAME_SCALING), int(FRAME_HEIGHT*FRAME_SCALING))
-        },
-        controls={"FrameRate": FRAME_FPS}
-    )
-picam2.configure(config)
-picam2.start()
+# The Pi camera by default; video replays and synthetic scenes allow running the detector anywhere (see frame_sources.py)
+frame_source = None
+def setup_frame_source(start=True):
+    global frame_source
+    frame_source = create_frame_source(FRAME_SOURCE, FRAME_WIDTH, FRAME_HEIGHT, FRAME_FPS, META_LINE_X_PX,
+                                       lores_scaling=FRAME_SCALING if DUAL_STREAM_MODE else None,
+                                       zero_copy=ZERO_COPY_ACQUISITION, buffer_count=CAMERA_BUFFER_COUNT if ZERO_COPY_ACQUISITION else None)
+    if start:
+        frame_source.start()
+
+# How long the detector took to be useful: imports, then the first frame through the capture loop
+import_time = None
+startup_status = "Starting..."
+
+def report_startup():
+    global startup_status
+    first_frame_time = time.perf_counter() - import_start
+    startup_status = (f"imports {1000 * import_time:.0f} ms, " if import_time is not None else "") + \
+                     f"first frame processed {1000 * first_frame_time:.0f} ms after start"
+    print(f">>> Startup: {startup_status}")
+    publish_status("startup_status", startup_status)
 
 
 
@@ -380,17 +710,22 @@ picam2.start()
 def capture_frames():
     global tracker
     global trigger_cooldown, recalibrate_flag
-    global new_tracker_type, TRACKER_TYPE, META_LINE_X_PX, DETECT_SHADOWS
+    global new_tracker_type, TRACKER_TYPE, DETECT_SHADOWS
     global tracker_start_time, last_bbox_in_subframe_coordinates, tracker_last_success_time
-    global fps_global_string
+    global fps_global_string, frame_pool, frame_pool_status
 
     prev_frame = None
     curr_frame = None
     prev_frame_time = time.time()
+    frame_pool = build_frame_pool()
     tracking_direction = 0           # 0 for none, 1 for left to right, 2 for right to left
     tracked_speed_kmh = 0
+    tracker_speed = SpeedEstimator(SPEED_WINDOW)     # Positions of the tracked car, on the track
     meta_crossing_status = 0         # 0 for no, 1 for left to right, 2 for right to left
     last_crossing_time = None
+    frame_sequence = -1              # Frames acquired, as numbered in the events (the first one is 0)
+    crossing_sequence = 0            # Crossings confirmed, as numbered in the events
+    dropped_frames = 0               # Frames dropped by the source, as counted so far
 
     fps_temp_counter = 0
     fps_temp_start = time.time()
@@ -403,67 +738,106 @@ def capture_frames():
 
     motion_history = []
 
-    # Background subtraction
-    # Use MOG2 for better performance in low light conditions
-    # Use KNN for better performance in bright light conditions
-    # Use MOG for better performance in high motion conditions
-    # history: Number of frames to use for background modeling.
-    # varThreshold: Higher = less sensitive to movement.
-    # detectShadows: If True, shadows will be marked gray (127), not white (255).
-    #background = cv2.createBackgroundSubtractorKNN(history=50, dist2Threshold=200.0, detectShadows=DETECT_SHADOWS)
-    background = cv2.createBackgroundSubtractorMOG2(history=150, varThreshold=32, detectShadows=DETECT_SHADOWS)
-
-#    picam2.set_controls({
+    meta_strip = MetaStrip()
+    preprocessor = BandPreprocessor()
+    multi_tracker = MultiTracker(MAX_TRACKS, max_missed_time=TRACK_MAX_MISSED_TIME, timeout=TRACKING_TIMEOUT,
+                                 speed_window=SPEED_WINDOW)
+    photo_finish = PhotoFinish(FRAME_HEIGHT, PHOTO_FINISH_COLUMNS_PER_FRAME,
+                               int(math.ceil((PHOTO_FINISH_BEFORE_TIME + PHOTO_FINISH_AFTER_TIME) * FRAME_FPS)) + 1)
+    frame_burst = None              # Built on the first frame, at its size
+    last_activity_time = None
+    idle_frames_in_a_row = 0
+    background_model_key = None     # What the current background model was built for (see FrameGeometry.model_key)
+    background = None
+    background_learned = False      # The current background model went through its first cool down
+    background_snapshot = None      # Snapshot to warm start a new background model from, until the cool down tests it
+    last_snapshot_time = time.time()
+    detection_band = None
+
+    # Background subtraction (see create_background_subtractor): created in the loop, as soon as the model geometry is known
+
+#    frame_source.set_controls({
 #        "AeEnable": False,         # Auto exposure OFF
 #        "ExposureTime": 1000,      # Set manually, tune for lighting
 #        "AnalogueGain": 1.0,       # Optional: fixed gain
 #        "AwbEnable": False         # Auto white balance OFF (optional)
 #    })
 
-    while True:
+    while not capture_stop.is_set():
 
         #
         # FRAME ACQUISITION
         #
 
-        curr_frame_time = time.time()
+        frame_start = time.perf_counter()
         prev_frame = curr_frame
-        curr_frame = picam2.capture_array("main")
-        curr_scaled_frame_width = int(curr_frame.shape[1] * FRAME_SCALING)
-        curr_scaled_frame_height = int(curr_frame.shape[0] * FRAME_SCALING)
-        scaled_meta_line_x = int(META_LINE_X_PX * FRAME_SCALING)
-        min_scaled_y = int(curr_scaled_frame_height * MIN_Y_FACTOR)
-        max_scaled_y = int(curr_scaled_frame_height * MAX_Y_FACTOR)
-        min_scaled_x = int(scaled_meta_line_x * (1.0 - WIDTH_OFFSET))
-        max_scaled_x = scaled_meta_line_x + int(WIDTH_OFFSET * (curr_scaled_frame_width - scaled_meta_line_x))
-        min_accepted_area = int(curr_scaled_frame_width * curr_scaled_frame_height * MIN_COUNTOUR_AREA)
-
-
-        # Resize and crop for processing
-        if DUAL_STREAM_MODE:
-            current_frame_resized = picam2.capture_array("lores")
-            curr_subframe_gray = current_frame_resized[min_scaled_y:max_scaled_y, :curr_scaled_frame_width]
+        curr_frame = frame_source.capture_array("main")
+        if curr_frame is None:
+            print(">>> Frame source exhausted, stopping capture")
+            break
+        stage_start = processing_start = stage_metrics.lap("acquire", frame_start)
+        stage_metrics.count("frames")
+        frame_sequence += 1
+        if frame_source.dropped_frames > dropped_frames:
+            # The camera had no free buffer for them: the loop (or whatever holds its buffers) is too slow
+            stage_metrics.count("frames_dropped", frame_source.dropped_frames - dropped_frames)
+            dropped_frames = frame_source.dropped_frames
+        curr_frame_time = frame_source.last_timestamp     # Sensor timestamp when available (no pipeline latency in it)
+        frame_crossings = []                              # Crossings confirmed in this frame (several cars may cross at once)
+        # One config snapshot for the whole frame. Geometry only computed again when it changes
+        config = detection_config
+        geometry = preprocessor.update_geometry(curr_frame.shape, FRAME_SCALING, config, BACKGROUND_MODEL_MARGIN)
+        curr_scaled_frame_width = geometry.scaled_width
+        scaled_meta_line_x = geometry.scaled_meta_line_x
+        min_scaled_x = geometry.min_scaled_x
+        max_scaled_x = geometry.max_scaled_x
+        min_accepted_area = geometry.min_accepted_area
+
+
+        # Meta strip: the full resolution columns around the meta line, scored against their own tiny background model
+        strip_active = False
+        if META_STRIP_MODE:
+            strip_half_width = meta_strip_half_width()
+            strip_x1 = max(0, config.meta_line_x - strip_half_width)
+            strip_x2 = min(curr_frame.shape[1], config.meta_line_x + strip_half_width + 1)
+            strip_y1 = int(curr_frame.shape[0] * config.min_y_factor)
+            strip_y2 = int(curr_frame.shape[0] * config.max_y_factor)
+            strip_active = meta_strip.update(curr_frame[strip_y1:strip_y2:META_STRIP_ROW_STEP, strip_x1:strip_x2],
+                                             (strip_x1, strip_x2, strip_y1, strip_y2),
+                                             learn=curr_mode in (SystemMode.COOL_DOWN, SystemMode.IDLE))
+            stage_start = stage_metrics.lap("meta_strip", stage_start)
+
+        # While idle, frames that are not streamed nor feeding the background skip all the heavy processing
+        idle_frame = (curr_mode == SystemMode.IDLE and
+                      not strip_active and
+                      not trigger_cooldown and
+                      not recalibrate_flag and
+                      geometry.model_key == background_model_key and
+                      not is_streaming_frame(fps_temp_counter + 1) and
+                      idle_frames_in_a_row < META_STRIP_BACKGROUND_EVERY_X_FRAMES)
+        idle_frames_in_a_row = idle_frames_in_a_row + 1 if idle_frame else 0
+
+
+        # Resize and crop for processing: the background model gets the model area, everything else the detection band in it
+        if idle_frame:
+            pass
+
+        elif DUAL_STREAM_MODE:
+            current_frame_resized = frame_source.capture_array("lores")
+            curr_model_frame = current_frame_resized[geometry.model_y1:geometry.model_y2, :curr_scaled_frame_width]
+
+        elif ROI_FIRST_PREPROCESSING:
+            curr_model_frame = preprocessor.process(curr_frame)
 
         else:
-            # Blur the image before resizing to clean some noise, as it comes from high frame rate video
-            blurred_image = cv2.GaussianBlur(curr_frame, (5, 5), 0)
-            # Resize frame
-            current_frame_resized = cv2.resize(
-                blurred_image,
-                (
-                    curr_scaled_frame_width,
-                    curr_scaled_frame_height
-                ),
-                interpolation=cv2.INTER_LINEAR  # INTER_AREA gives more quality, but we don't need it
-            )
-
-            # Convert to grayscale
-            curr_subframe_gray = cv2.cvtColor(current_frame_resized, cv2.COLOR_BGR2GRAY)
+            curr_model_frame = legacy_preprocess(curr_frame, geometry)
 
-            # Crop vertically
-            curr_subframe_gray = curr_subframe_gray[min_scaled_y:max_scaled_y, :]
-
-        curr_subframe_height, curr_subframe_width = curr_subframe_gray.shape[:2]
+        if not idle_frame:
+            curr_subframe_gray = geometry.roi(curr_model_frame)
+            curr_subframe_height, curr_subframe_width = curr_subframe_gray.shape[:2]
+            stage_metrics.lap("preprocess", stage_start)
+        else:
+            stage_metrics.count("idle_frames")
 
 
 
@@ -471,20 +845,45 @@ def capture_frames():
         # VARIABLE INITIALIZATION
         #
 
+        # New model area (first frame, new resolution or a band out of the model margin): a new background to learn
+        if geometry.model_key != background_model_key:
+            if background_model_key is not None:
+                print(f">>> Background model area now rows {geometry.model_y1}-{geometry.model_y2}: learning it again")
+            background = create_background_subtractor()
+            background_model_key = geometry.model_key
+            background_learned = False
+            background_snapshot = load_background_snapshot(background_model_key)
+            trigger_cooldown = True
+
+        # Band moved: applied right away with the same background, only what was being tracked in the old one is lost
+        if (geometry.min_scaled_y, geometry.max_scaled_y) != detection_band:
+            if detection_band is not None and not trigger_cooldown:
+                print(f">>> Detection band moved to rows {geometry.min_scaled_y}-{geometry.max_scaled_y}")
+                motion_history.clear()
+                multi_tracker.reset()
+                tracker = None
+                tracker_start_time = None
+                tracking_direction = 0
+                last_bbox_in_subframe_coordinates = None
+                if curr_mode == SystemMode.TRACKING:
+                    curr_mode = SystemMode.DETECTING
+            detection_band = (geometry.min_scaled_y, geometry.max_scaled_y)
+
         if trigger_cooldown:
             motion_history.clear()
             curr_mode = SystemMode.COOL_DOWN
             cooldown_until = curr_frame_time + COOL_DOWN_TIME
+            multi_tracker.reset()
             tracker = None
             tracker_start_time = None
-            tracker_start_bbox = None
             tracking_direction = 0
             tracked_speed_kmh = 0
+            tracker_speed.reset()
             meta_crossing_status = 0
             last_bbox_in_subframe_coordinates = None
             tracker_last_success_time = None
             trigger_cooldown = False
-            picam2.set_controls({"AeEnable": True, "AwbEnable": True})          # Enable auto exposure and white balance only during COOL_DOWN
+            frame_source.set_controls({"AeEnable": True, "AwbEnable": True})          # Enable auto exposure and white balance only during COOL_DOWN
 
         if recalibrate_flag:        ### NOT NEEDED - KEPT AS PLACEHOLDER FOR ANOTHER BUTTON
             background = cv2.createBackgroundSubtractorKNN(history=100, dist2Threshold=400.0, detectShadows=DETECT_SHADOWS)
@@ -501,18 +900,71 @@ def capture_frames():
 
 
 
+        #
+        # PHOTO FINISH (LINE-SCAN)
+        #
+
+        # Only while there's something around the meta line (or to finish a confirmed crossing): a few pixels per frame
+        if PHOTO_FINISH and (photo_finish.armed or strip_active or curr_mode in (SystemMode.DETECTING, SystemMode.TRACKING)):
+            stage_start = time.perf_counter()
+            if photo_finish.append(curr_frame, config.meta_line_x,
+                                   int(curr_frame.shape[0] * config.min_y_factor), int(curr_frame.shape[0] * config.max_y_factor),
+                                   curr_frame_time):
+                print("--> Meta line or band moved: photo finish cut short" if photo_finish.finished else
+                      "--> Meta line or band moved: photo finish abandoned (no columns around the crossing yet)")
+            stage_metrics.lap("photo_finish", stage_start)
+
+        # Same for the burst ring, where it's a whole frame: nothing written while the track is empty
+        if BURST_CAPTURE and frame_burst is None:
+            frame_burst = build_frame_burst(curr_frame.shape)
+        if BURST_CAPTURE and (frame_burst.armed or strip_active or curr_mode in (SystemMode.DETECTING, SystemMode.TRACKING)):
+            stage_start = time.perf_counter()
+            frame_burst.append(curr_frame, curr_frame_time)
+            stage_metrics.lap("burst", stage_start)
+
+
+
         #
         # COOL DOWN
         #
 
         if curr_mode == SystemMode.COOL_DOWN:
             # Feed the background substractor (only in cool down - tracking would polute the background))
-            last_background_thresh = background.apply(curr_subframe_gray)
+            stage_start = time.perf_counter()
+            if background_snapshot is not None:
+                if warm_start_background(background, background_snapshot, curr_model_frame):
+                    cooldown_until = min(cooldown_until, curr_frame_time + BACKGROUND_WARM_START_TIME)
+                background_snapshot = None
+            background.apply(curr_model_frame)
+            stage_metrics.lap("background", stage_start)
             if curr_frame_time >= cooldown_until:
-                picam2.set_controls({"AeEnable": False, "AwbEnable": False})    # Disable auto exposure and white balance
+                frame_source.set_controls({"AeEnable": False, "AwbEnable": False})    # Disable auto exposure and white balance
+                background_learned = True
                 meta_crossing_status = 0
-                curr_mode = SystemMode.DETECTING
-                print(">>> DETECTING mode after COOL_DOWN finished")
+                last_activity_time = curr_frame_time
+                if META_STRIP_MODE and meta_strip.ready:
+                    curr_mode = SystemMode.IDLE
+                    print(">>> IDLE mode after COOL_DOWN finished")
+                else:
+                    curr_mode = SystemMode.DETECTING
+                    print(">>> DETECTING mode after COOL_DOWN finished")
+
+
+
+        #
+        # IDLE (META STRIP MODE)
+        #
+
+        elif curr_mode == SystemMode.IDLE:
+            if strip_active:
+                curr_mode = SystemMode.DETECTING    # Escalates right away: detection runs on this very frame
+                last_activity_time = curr_frame_time
+                print(f">>> IDLE -> DETECTING mode after meta strip activation ({meta_strip.score:.1%} changed, {meta_strip.edge_pixels} edge pixels)")
+            elif not idle_frame:
+                # Keep the full background model fresh with the frames that were processed anyway
+                stage_start = time.perf_counter()
+                background.apply(curr_model_frame, learningRate=0.01)
+                stage_metrics.lap("background", stage_start)
 
 
 
@@ -520,14 +972,16 @@ def capture_frames():
         # TRACKING
         #
 
-        elif curr_mode == SystemMode.TRACKING:
+        elif curr_mode == SystemMode.TRACKING and not MULTI_OBJECT_TRACKING:
             # Check if the tracker has been active for too long
             if tracker_start_time and curr_frame_time - tracker_start_time > TRACKING_TIMEOUT:
                 print(">>> TRACKING -> COOL_DOWN mode after tracker timeout")
                 trigger_cooldown = True
                 continue
 
+            stage_start = time.perf_counter()
             success, new_bbox = tracker.update(curr_subframe_gray)
+            stage_metrics.lap("tracker", stage_start)
             if success:
                 tracker_last_success_time = curr_frame_time
 
@@ -550,19 +1004,8 @@ def capture_frames():
                     
 
                     # EXPERIMENTAL: GET THE SPEED
-                    # Camera parameters
-                    H = 3.5  # camera 2 meters above the ground
-                    alpha = 30  # 30 degrees downward tilt
-                    fov_h = 66  # Pi cam 3
-                    fov_v = 41  # Pi cam 3
-                    img_w = curr_subframe_width
-                    img_h = curr_subframe_height
-
-                    # Get world positions and print the speed
-                    start_center_x, start_center_y = bbox_center(tracker_start_bbox)
-                    start_world_coords = pixel_to_world(start_center_x, start_center_y+min_scaled_y, img_w, img_h, fov_h, fov_v, H, alpha)
-                    curr_world_coords = pixel_to_world(center_x, center_y+min_scaled_y, img_w, img_h, fov_h, fov_v, H, alpha)
-                    tracked_speed_kmh = 3.6 * (curr_world_coords[0] - start_world_coords[0]) / (curr_frame_time - tracker_start_time)
+                    tracker_speed.add(curr_frame_time, *ground_position(geometry, new_bbox))
+                    tracked_speed_kmh = 3.6 * tracker_speed.speed()
                     #print(f"Speed km/h: {tracked_speed_kmh:.1f}")
 
 
@@ -573,7 +1016,8 @@ def capture_frames():
 
                         # Check if the object is actually crossing the line at the pixel level
                         # Build the edges image
-                        diff = cv2.absdiff(background.getBackgroundImage(), curr_subframe_gray)
+                        stage_start = time.perf_counter()
+                        diff = cv2.absdiff(geometry.roi(background.getBackgroundImage()), curr_subframe_gray)
                         diff = cv2.GaussianBlur(diff, (5, 5), 0)
                         edges = cv2.Canny(diff, 80, 180)
 
@@ -586,10 +1030,33 @@ def capture_frames():
 
                         roi = edges[roi_y1:roi_y2, roi_x1:roi_x2]
                         edge_pixels = cv2.countNonZero(roi)
+                        stage_metrics.lap("confirmation", stage_start)
                         if edge_pixels > 2:
                             meta_crossing_status = tracking_direction
                             last_crossing_time = curr_frame_time
-                            print(f"--> CROSSING CONFIRMED WITH {edge_pixels} EDGE PIXELS")
+                            crossing_time, crossing_uncertainty, before_track_start = estimate_crossing_time(
+                                edges, new_bbox, last_bbox_in_subframe_coordinates, scaled_meta_line_x, tracking_direction,
+                                prev_frame_time, curr_frame_time, tracker_start_time)
+                            crossing_sequence += 1
+                            frame_crossings.append({
+                                "sequence": crossing_sequence,
+                                "frame_sequence": frame_sequence,
+                                "frame_time": curr_frame_time,
+                                "crossing_time": crossing_time,
+                                "uncertainty": crossing_uncertainty,
+                                "before_track_start": before_track_start,
+                                "direction": meta_crossing_status,
+                                "lane": None,
+                                "bbox": full_frame_bbox(geometry, new_bbox),
+                                "speed_kmh": abs(tracked_speed_kmh),
+                                "edge_pixels": edge_pixels,     # How sure the confirmation was
+                            })
+                            stage_metrics.count("crossings")
+                            print(f"--> CROSSING CONFIRMED WITH {edge_pixels} EDGE PIXELS, "
+                                  f"{1000 * (curr_frame_time - crossing_time):.1f} ms before the frame (+/- {1000 * crossing_uncertainty:.1f} ms)" +
+                                  (", already over the line when tracking started" if before_track_start else ""))
+                            if PHOTO_FINISH:
+                                photo_finish.arm(curr_frame_time, meta_crossing_status, PHOTO_FINISH_BEFORE_TIME, PHOTO_FINISH_AFTER_TIME)
                         else:
                             meta_crossing_status = 0
                             print(f"--> Crossing not confirmed({edge_pixels} edge pixels)")
@@ -610,11 +1077,13 @@ def capture_frames():
         # DETECTION
         #
 
-        if curr_mode == SystemMode.DETECTING or (DETECT_WHILE_TRACKING and curr_mode == SystemMode.TRACKING):
+        if curr_mode == SystemMode.DETECTING or ((DETECT_WHILE_TRACKING or MULTI_OBJECT_TRACKING) and curr_mode == SystemMode.TRACKING):
 
 #            diff = cv2.absdiff(background.getBackgroundImage(), curr_subframe_gray)
 #            last_background_thresh = cv2.GaussianBlur(diff, (5, 5), 0)
-            last_background_thresh = background.apply(curr_subframe_gray, learningRate=0)
+            stage_start = time.perf_counter()
+            last_background_thresh = geometry.roi(background.apply(curr_model_frame, learningRate=frozen_learning_rate(background)))
+            stage_start = stage_metrics.lap("background", stage_start)
 
             # Clean the background
             if DETECT_SHADOWS:  # Removes shadows (if detectShadows=True)
@@ -633,11 +1102,23 @@ def capture_frames():
                     motion_history.pop(0)
                 # Combine all motion masks
                 last_background_thresh = np.bitwise_or.reduce(motion_history)
+            stage_start = stage_metrics.lap("morphology", stage_start)
 
             # Find contours only when we're not waiting for the motion history to build up
             contours = []
+            detections = []     # Multi-object tracking: (lane, bbox) of every contour big enough
             if not (MOTION_HISTORY_LENGTH > 1 and len(motion_history) < MOTION_HISTORY_LENGTH):
-                contours, _ = cv2.findContours(last_background_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                if MULTI_OBJECT_TRACKING:
+                    # Lane by lane, so cars side by side stay apart
+                    for lane, (lane_y1, lane_y2) in enumerate(geometry.lane_rows):
+                        if lane_y2 > lane_y1:
+                            lane_contours, _ = cv2.findContours(last_background_thresh[lane_y1:lane_y2], cv2.RETR_EXTERNAL,
+                                                                cv2.CHAIN_APPROX_SIMPLE, offset=(0, lane_y1))
+                            contours.extend(lane_contours)
+                            detections.extend((lane, bbox) for bbox in map(cv2.boundingRect, lane_contours)
+                                              if bbox_area(bbox) > min_accepted_area)
+                else:
+                    contours, _ = cv2.findContours(last_background_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
             largest_contour = None
             max_area = 0
@@ -652,18 +1133,91 @@ def capture_frames():
                     largest_contour = c
                     max_area = area
 
+            stage_metrics.lap("contours", stage_start)
+
             # If we didn't find contours, we use this frame to build the background
             if len(contours) == 0:
-                background.apply(curr_subframe_gray, learningRate=0.01)
+                background.apply(curr_model_frame, learningRate=0.01)
+
+            # Every car on its own track: contours associated with the tracks, and one crossing state machine per track
+            if MULTI_OBJECT_TRACKING:
+                stage_start = time.perf_counter()
+                ended = multi_tracker.update(detections, curr_frame_time, curr_subframe_width, curr_subframe_height,
+                                             max_distance=TRACK_MAX_DISTANCE * curr_subframe_width,
+                                             can_start=lambda bbox: bbox[0] + bbox[2] > min_scaled_x and bbox[0] < max_scaled_x)
+                for track, reason in ended:
+                    print(f">>> Track {track.id} (lane {track.lane}) ended: {reason}")
+                    if reason == "timeout" and not multi_tracker.tracks:
+                        trigger_cooldown = True     # Something stopped on the track: make it part of the background
+                edges = None    # Computed once per frame, only when some track reaches the meta line
+                for track in multi_tracker.tracks:
+                    if track.last_seen_time != curr_frame_time:
+                        continue    # Not measured in this frame
+                    track.positions.add(curr_frame_time, *ground_position(geometry, track.bbox))
+                    if track.prev_bbox is None:
+                        continue    # Just started
+                    track.speed_kmh = 3.6 * track.positions.speed()
+                    x, y, w, h = track.bbox
+                    if track.direction != 0 and track.crossing_status == 0 and x < scaled_meta_line_x <= x + w:
+                        if edges is None:
+                            diff = cv2.absdiff(geometry.roi(background.getBackgroundImage()), curr_subframe_gray)
+                            diff = cv2.GaussianBlur(diff, (5, 5), 0)
+                            edges = cv2.Canny(diff, 80, 180)
+                        edge_pixels = cv2.countNonZero(edges[y:y + h, max(x, scaled_meta_line_x - 1):min(x + w, scaled_meta_line_x + 1)])
+                        if edge_pixels > 2:
+                            track.crossing_status = track.direction
+                            last_crossing_time = curr_frame_time
+                            crossing_time, crossing_uncertainty, before_track_start = estimate_crossing_time(
+                                edges, track.bbox, track.prev_bbox, scaled_meta_line_x, track.direction,
+                                prev_frame_time, curr_frame_time, track.start_time)
+                            track.crossing_time = crossing_time
+                            crossing_sequence += 1
+                            frame_crossings.append({
+                                "sequence": crossing_sequence,
+                                "frame_sequence": frame_sequence,
+                                "frame_time": curr_frame_time,
+                                "crossing_time": crossing_time,
+                                "uncertainty": crossing_uncertainty,
+                                "before_track_start": before_track_start,
+                                "direction": track.direction,
+                                "lane": track.lane,
+                                "bbox": full_frame_bbox(geometry, track.bbox),
+                                "speed_kmh": abs(track.speed_kmh),
+                                "edge_pixels": edge_pixels,
+                            })
+                            stage_metrics.count("crossings")
+                            print(f"--> CROSSING CONFIRMED FOR TRACK {track.id} (lane {track.lane}) WITH {edge_pixels} EDGE PIXELS, "
+                                  f"{1000 * (curr_frame_time - crossing_time):.1f} ms before the frame (+/- {1000 * crossing_uncertainty:.1f} ms)" +
+                                  (", already over the line when tracking started" if before_track_start else ""))
+                            if PHOTO_FINISH:
+                                photo_finish.arm(curr_frame_time, track.direction, PHOTO_FINISH_BEFORE_TIME, PHOTO_FINISH_AFTER_TIME)   # Cars crossing in the same frame share one
+                if curr_mode != SystemMode.COOL_DOWN and not trigger_cooldown:
+                    curr_mode = SystemMode.TRACKING if multi_tracker.tracks else SystemMode.DETECTING
+                stage_metrics.lap("tracks", stage_start)
+
+            # Nothing going on for a while: back to watching the meta strip only
+            if META_STRIP_MODE and curr_mode == SystemMode.DETECTING:
+                if max_area > 0 or strip_active:
+                    last_activity_time = curr_frame_time
+                elif meta_strip.ready and curr_frame_time - last_activity_time > META_STRIP_IDLE_TIME:
+                    curr_mode = SystemMode.IDLE
+                    print(">>> DETECTING -> IDLE mode, nothing around")
 
             # Note that the last bbox will either be empty or will be overridable when combining tracking and detection is enabled
-            if max_area > 0 and max_area >= bbox_area(last_bbox_in_subframe_coordinates):
+            if not MULTI_OBJECT_TRACKING and max_area > 0 and max_area >= bbox_area(last_bbox_in_subframe_coordinates):
                 try:
                     last_bbox_in_subframe_coordinates = cv2.boundingRect(largest_contour)
-                    tracker = init_tracker(curr_subframe_gray, last_bbox_in_subframe_coordinates)
+                    stage_start = time.perf_counter()
+                    tracker = init_tracker(curr_subframe_gray, last_bbox_in_subframe_coordinates,
+                                           lambda: geometry.roi(background.getBackgroundImage()))
+                    stage_metrics.lap("tracker_init", stage_start)
                     tracker_start_time = curr_frame_time
-                    tracker_start_bbox = last_bbox_in_subframe_coordinates
+                    tracker_speed.reset()
+                    tracker_speed.add(curr_frame_time, *ground_position(geometry, last_bbox_in_subframe_coordinates))
                     tracker_last_success_time = curr_frame_time
+                    x, _, w, _ = last_bbox_in_subframe_coordinates
+                    if not x < scaled_meta_line_x <= x + w:
+                        meta_crossing_status = 0    # Clear of the line: a new car, or a lost one moving away (not one caught mid-crossing again)
                     curr_mode = SystemMode.TRACKING
                     print(">>> DETECTION -> TRACKING mode with the largest contour found")
                 except Exception as e:
@@ -698,6 +1252,12 @@ def capture_frames():
         # Print and reset after interval
         if elapsed_monitoring >= MONITORING_INTERVAL:
             fps_global_string = fps_string
+            frame_pool_status = (f"acquisition: {frame_source.status()}; {frame_pool.status()}" +
+                                 (f"; burst ring: {frame_burst.status()}" if frame_burst is not None else ""))
+            publish_status("fps_global_string", fps_global_string)
+            publish_status("frame_pool_status", frame_pool_status)
+            publish_status("queue_stats", local_queue_stats("post_processing", "burst"))
+            publish_metrics()
             print(fps_global_string)
             fps_temp_counter = 0
             fps_temp_slowest_frame = 0
@@ -709,27 +1269,102 @@ def capture_frames():
         # IMAGE POST-PROCESSING (WHEN NEEDED)
         #
 
-        if (last_crossing_time == curr_frame_time or fps_temp_counter % STREAM_EVERY_X_FRAMES == 0):
-            post_processing_queue.put_nowait((background.apply(curr_subframe_gray, learningRate=0),
-                                              background.getBackgroundImage().copy(), 
-                                              prev_frame.copy(),
-                                              curr_frame.copy(),
-                                              curr_frame_time,
-                                              curr_subframe_gray.copy(),
-                                              min_scaled_x,
-                                              max_scaled_x,
-                                              min_scaled_y,
-                                              fps_string,
-                                              status_color,
-                                              abs(tracked_speed_kmh),
-                                              meta_crossing_status if last_crossing_time == curr_frame_time else 0,
-                                              last_crossing_time,
-                                              STREAM_EVERY_X_FRAMES > 1 and fps_temp_counter % STREAM_EVERY_X_FRAMES == 0))
+        is_crossing_frame = len(frame_crossings) > 0
+        # One burst for every car that crossed in this frame. The burst is named before it exists, so events can point to it
+        if BURST_CAPTURE and is_crossing_frame:
+            if frame_burst.arm(curr_frame_time, frame_crossings[0]["direction"], BURST_FRAMES_BEFORE, BURST_FRAMES_AFTER):
+                for crossing_info in frame_crossings:
+                    crossing_info["burst"] = crossing_name(curr_frame_time)
+            else:
+                print("--> Burst busy with the previous crossing, skipped")
+
+        # Timed on every frame, handed off or not: what it costs against the frame budget
+        stage_start = time.perf_counter()
+        if (is_crossing_frame or is_streaming_frame(fps_temp_counter)):
+            # Crossing frames wait for a free slot (never lose a lap); streaming frames are dropped when post-processing is late
+            # Boxes to draw, with their speeds
+            if MULTI_OBJECT_TRACKING:
+                overlays = [(track.bbox, abs(track.speed_kmh)) for track in multi_tracker.tracks]
+            else:
+                overlays = [(last_bbox_in_subframe_coordinates, abs(tracked_speed_kmh))] if last_bbox_in_subframe_coordinates else []
+            slot = frame_pool.acquire(block=is_crossing_frame)
+            if slot is not None:
+                # Everything is written in place into the slot: no allocations, no copies of copies
+                stack, background_view, subframe_view, thresh_view, _ = stack_views(
+                    slot.view("stack", (4 * curr_subframe_height + 3, curr_subframe_width)), curr_subframe_height)
+                # The stack (another background pass, mostly) only for crossings, and for the extra stream if it's watched
+                if is_crossing_frame or (STREAM_DEBUG_STACK and stream_qualities["extra"]):
+                    model_scratch = slot.view("scratch", curr_model_frame.shape)     # The model area, band cropped from there
+                    np.copyto(thresh_view, geometry.roi(background.apply(curr_model_frame, fgmask=model_scratch,
+                                                                                learningRate=frozen_learning_rate(background))))
+                    np.copyto(background_view, geometry.roi(background.getBackgroundImage(backgroundImage=model_scratch)))
+                    np.copyto(subframe_view, curr_subframe_gray)
+                if prev_frame is None:
+                    prev_frame = curr_frame
+                # The previous frame is only for the crossing images: streaming frames don't copy it
+                if MULTIPROCESS_MODE:
+                    frames = (prev_frame if is_crossing_frame else None, curr_frame)   # The shared-memory ring copies them into its own slots
+                else:
+                    if is_crossing_frame:
+                        np.copyto(slot["prev_frame"], prev_frame)
+                    np.copyto(slot["curr_frame"], curr_frame)
+                    frames = (slot["prev_frame"] if is_crossing_frame else None, slot["curr_frame"])
 
+                try:
+                    post_processing_queue.put((*frames,
+                                               stack,
+                                               curr_subframe_height,
+                                               curr_frame_time,
+                                               geometry,
+                                               fps_string,
+                                               status_color,
+                                               overlays,
+                                               frame_crossings[0]["direction"] if is_crossing_frame else 0,
+                                               last_crossing_time,
+                                               STREAM_EVERY_X_FRAMES > 1 and is_streaming_frame(fps_temp_counter),
+                                               frame_crossings,
+                                               None if MULTIPROCESS_MODE else slot),
+                                              block=is_crossing_frame)
+                    if MULTIPROCESS_MODE:
+                        slot.release()  # Already copied into the shared-memory ring
+                except queue.Full:
+                    slot.release()
+        stage_metrics.lap("handoff", stage_start)
+
+        # Photo finish complete: hand it over to be encoded and published along with its crossing
+        if PHOTO_FINISH:
+            finished_photo = photo_finish.collect(curr_frame_time)
+            if finished_photo is not None:
+                try:
+                    photo_finish_queue.put_nowait(finished_photo)   # Drops the oldest one when full
+                except queue.Full:
+                    print("--> Photo finish queue full, photo finish dropped")
+
+        # Burst complete: its frames stay frozen in the ring (no copy) until they're encoded
+        if BURST_CAPTURE:
+            finished_burst = frame_burst.collect()
+            if finished_burst is not None:
+                burst_queue.put_nowait((frame_burst, *finished_burst))   # Drops (and unfreezes) the oldest one when full
+
+
+        # A settled background, to start warm after a restart (a few ms, once in a while)
+        if curr_mode in (SystemMode.DETECTING, SystemMode.IDLE) and curr_frame_time - last_snapshot_time >= BACKGROUND_SNAPSHOT_INTERVAL:
+            stage_start = time.perf_counter()
+            save_background_snapshot(background, background_model_key, curr_frame_time)
+            last_snapshot_time = curr_frame_time
+            stage_metrics.lap("background_snapshot", stage_start)
 
         # ...and loop!
+        stage_metrics.lap("processing", processing_start)     # The whole frame but its acquisition
+        if frame_sequence == 0:
+            report_startup()
         prev_frame_time = curr_frame_time
-        time.sleep(0.001)   # Avoid suffocating the CPU
+        time.sleep(0)       # Let the other threads in: the camera already paces the loop, and a 1 ms nap took ~1.5 ms off every frame
+
+    # Stopping: the background as it is now, for the next start
+    if background_learned:
+        save_background_snapshot(background, background_model_key, prev_frame_time)
+    capture_stopped.set()
 
 
 
@@ -737,9 +1372,17 @@ def capture_frames():
 # FRAME POST PROCESSING THREAD
 #
 def framePostProcessingWorker():
+    last_queue_stats_time = time.time()
     while True:
+        slot = None
+        if MULTIPROCESS_MODE and time.time() - last_queue_stats_time >= MONITORING_INTERVAL:
+            publish_status("queue_stats", local_queue_stats("meta_crossing", "pending_events"))
+            publish_metrics()
+            last_queue_stats_time = time.time()
         try:
-            last_background_thresh, last_background_image, prev_frame, curr_frame, curr_frame_time, curr_subframe_gray, min_scaled_x, max_scaled_x, min_scaled_y, fps_string, status_color, tracked_speed_kmh, meta_crossing, last_crossing_time, stream = post_processing_queue.get(block=True)
+            prev_frame, curr_frame, stack, subframe_height, curr_frame_time, geometry, fps_string, status_color, overlays, meta_crossing, last_crossing_time, stream, crossings, slot = post_processing_queue.get(block=True)
+            stage_start = time.perf_counter()
+            stacked_images, last_background_image, curr_subframe_gray, last_background_thresh, edges = stack_views(stack, subframe_height)
 
             # FRAME BEAUTIFICATION
             # Display FPS on the frame
@@ -753,56 +1396,56 @@ def framePostProcessingWorker():
             # Flash on detection (but not on the same frame)
             if (not meta_crossing and last_crossing_time and abs(last_crossing_time - curr_frame_time) < CROSSING_FLASH_TIME):
                 alpha = 1.0 - (abs(last_crossing_time - curr_frame_time) / CROSSING_FLASH_TIME)
-                overlay = np.full_like(curr_frame, 255)  # White overlay
-                cv2.addWeighted(overlay, alpha, curr_frame, 1 - alpha, 0, curr_frame)
-
-            # Lines for the prev and main frame
-            cv2.line(prev_frame, (META_LINE_X_PX, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (META_LINE_X_PX, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 255, 0), 1)
-            cv2.line(prev_frame, (0, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (FRAME_WIDTH, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (0, 0, 255), 2)
-            cv2.line(prev_frame, (0, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (FRAME_WIDTH, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 2)
-            cv2.line(prev_frame, (int(min_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MIN_Y_FACTOR)), (int(min_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 1)
-            cv2.line(prev_frame, (int(max_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MIN_Y_FACTOR)), (int(max_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 1)
-            cv2.line(curr_frame, (META_LINE_X_PX, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (META_LINE_X_PX, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 255, 0), 1)
-            cv2.line(curr_frame, (0, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (FRAME_WIDTH, int(FRAME_HEIGHT*MIN_Y_FACTOR)), (0, 0, 255), 2)
-            cv2.line(curr_frame, (0, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (FRAME_WIDTH, int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 2)
-            cv2.line(curr_frame, (int(min_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MIN_Y_FACTOR)), (int(min_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 1)
-            cv2.line(curr_frame, (int(max_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MIN_Y_FACTOR)), (int(max_scaled_x/FRAME_SCALING), int(FRAME_HEIGHT*MAX_Y_FACTOR)), (0, 0, 255), 1)
-
-            # Bounding box for the main frame
-            if last_bbox_in_subframe_coordinates:
-                x_full_frame = int(last_bbox_in_subframe_coordinates[0]/FRAME_SCALING)
-                y_full_frame = int((last_bbox_in_subframe_coordinates[1]+min_scaled_y)/FRAME_SCALING)
-                w_full_frame = int(last_bbox_in_subframe_coordinates[2]/FRAME_SCALING)
-                h_full_frame = int(last_bbox_in_subframe_coordinates[3]/FRAME_SCALING)
+                cv2.convertScaleAbs(curr_frame, curr_frame, alpha=1 - alpha, beta=255 * alpha)  # White overlay, in place
+
+            # Lines for the prev and main frame, as configured when the frame was processed
+            line_x = geometry.config.meta_line_x
+            min_y = int(FRAME_HEIGHT * geometry.config.min_y_factor)
+            max_y = int(FRAME_HEIGHT * geometry.config.max_y_factor)
+            scaling = geometry.scaling
+            for frame in (curr_frame,) if prev_frame is None else (prev_frame, curr_frame):
+                cv2.line(frame, (line_x, min_y), (line_x, max_y), (0, 255, 0), 1)
+                cv2.line(frame, (0, min_y), (FRAME_WIDTH, min_y), (0, 0, 255), 2)
+                cv2.line(frame, (0, max_y), (FRAME_WIDTH, max_y), (0, 0, 255), 2)
+                cv2.line(frame, (int(geometry.min_scaled_x/scaling), min_y), (int(geometry.min_scaled_x/scaling), max_y), (0, 0, 255), 1)
+                cv2.line(frame, (int(geometry.max_scaled_x/scaling), min_y), (int(geometry.max_scaled_x/scaling), max_y), (0, 0, 255), 1)
+                for lane_min_y, lane_max_y in geometry.config.lanes or ():
+                    cv2.line(frame, (0, int(FRAME_HEIGHT * lane_min_y)), (FRAME_WIDTH, int(FRAME_HEIGHT * lane_min_y)), (255, 0, 0), 1)
+                    cv2.line(frame, (0, int(FRAME_HEIGHT * lane_max_y)), (FRAME_WIDTH, int(FRAME_HEIGHT * lane_max_y)), (255, 0, 0), 1)
+
+            # Bounding boxes for the main frame (one per tracked car)
+            for bbox, tracked_speed_kmh in overlays:
+                x_full_frame = int(bbox[0]/scaling)
+                y_full_frame = int((bbox[1]+geometry.min_scaled_y)/scaling)
+                w_full_frame = int(bbox[2]/scaling)
+                h_full_frame = int(bbox[3]/scaling)
                 cv2.rectangle(curr_frame, (x_full_frame, y_full_frame), (x_full_frame + w_full_frame, y_full_frame + h_full_frame), status_color, 1)
                 cv2.putText(curr_frame, f"{tracked_speed_kmh:.1f} Km/h", (x_full_frame, y_full_frame - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, status_color, 1)
 
 
-            # Build the edges image
-            diff = cv2.absdiff(last_background_image, curr_subframe_gray)
-            diff = cv2.GaussianBlur(diff, (5, 5), 0)
-            edges = cv2.Canny(diff, 80, 180)
-
+            # The stack is only filled for crossings, and for the extra stream when it's wanted (see the capture loop)
+            debug_stack = meta_crossing > 0 or (STREAM_DEBUG_STACK and bool(stream_qualities["extra"]))
+            if debug_stack:
+                # Build the edges image, right into its place in the stack
+                scratch = slot.view("scratch", last_background_image.shape) if slot else None
+                diff = cv2.absdiff(last_background_image, curr_subframe_gray, dst=scratch)
+                diff = cv2.GaussianBlur(diff, (5, 5), 0, dst=diff)
+                cv2.Canny(diff, 80, 180, edges=edges)
 
-            # Right column stack with 1px line in between images and a 1px line meta line
-            onepxline = np.full((1, last_background_image.shape[1]), 255, dtype=np.uint8)  # 1-pixel tall, full-width, grayscale
-            stacked_images = np.vstack([
-                last_background_image,
-                onepxline,
-                curr_subframe_gray,
-                onepxline,
-                last_background_thresh,
-                onepxline,
-                edges
-            ])
-            scaled_meta_line_x = int(META_LINE_X_PX * FRAME_SCALING)
-            cv2.line(stacked_images, (scaled_meta_line_x, 0), (scaled_meta_line_x, stacked_images.shape[0]), (255, 255, 255), 1)
+                # Right column stack (already laid out with 1px lines in between images) and a 1px line meta line
+                cv2.line(stacked_images, (geometry.scaled_meta_line_x, 0), (geometry.scaled_meta_line_x, stacked_images.shape[0]), (255, 255, 255), 1)
 
 
             # META CROSSING QUEUEING
             if meta_crossing > 0:
-                meta_crossing_queue.put_nowait((meta_crossing, curr_frame_time, prev_frame.copy(), curr_frame.copy(), stacked_images.copy()))
+                if slot is not None:
+                    slot.retain()   # processMetaCrossing will release it once the images are encoded
+                    meta_crossing_queue.put((meta_crossing, curr_frame_time, slot.borrow("prev_frame"), slot.borrow("curr_frame"),
+                                                    slot.borrow("stack", stacked_images.shape), slot, crossings, geometry.config.meta_line_x))
+                else:
+                    meta_crossing_queue.put((meta_crossing, curr_frame_time, prev_frame.copy(), curr_frame.copy(), stacked_images.copy(), None, crossings,
+                                             geometry.config.meta_line_x))
 
 
             # STREAMING QUEUEING
@@ -811,14 +1454,22 @@ def framePostProcessingWorker():
     #            frame_queue.put_nowait(frame.copy())
     #        except queue.Full:
     #            pass  # just skip, or log dropped frames
-            if stream and not streaming_frame_queue_main.full():
-                streaming_frame_queue_main.put_nowait(curr_frame.copy())
-            if stream and not streaming_frame_queue_extra.full():
-                streaming_frame_queue_extra.put_nowait(stacked_images.copy())
+            # Frames are encoded here, once, rather than in the web server (which may be in another process)
+            if stream:
+                publish_stream_frame("main", curr_frame, STREAM_SCALING)
+                if debug_stack:
+                    publish_stream_frame("extra", stacked_images)
+            stage_metrics.lap("post_processing", stage_start)
 
         except Exception as e:
             print(f"Error: {e}")
 
+        finally:
+            if slot is not None:
+                slot.release()
+            elif MULTIPROCESS_MODE:
+                post_processing_queue.task_done()   # Its shared-memory slot can be written again
+
         time.sleep(0.01)   # Avoid suffocating the CPU
 
 
@@ -826,180 +1477,550 @@ def framePostProcessingWorker():
 #
 # META PROCESSING THREAD
 #
+crossing_encoder_pool = None
+
+def start_crossing_encoder_pool():
+    global crossing_encoder_pool
+    if CROSSING_ENCODE_WORKERS <= 0:
+        return
+    if mp.current_process().daemon:
+        # Multi-process mode: already away from the capture loop, and daemonic processes can't fork. OpenCV
+        # encodes without the GIL, so threads encode in parallel just as well
+        crossing_encoder_pool = ThreadPoolExecutor(CROSSING_ENCODE_WORKERS)
+    else:
+        # Forked before this process starts its threads, and warmed up so every worker is forked right now
+        crossing_encoder_pool = ProcessPoolExecutor(CROSSING_ENCODE_WORKERS, mp_context=mp.get_context("fork"))
+        crossing_encoder_pool.submit(warm_up).result()
+
+def crossing_name(crossing_time):
+    return time.strftime("%Y%m%d_%H%M%S", time.localtime(crossing_time)) + f"_{int(crossing_time * 1000) % 1000:03d}"
+
+def prune_directories(directory, keep):
+    # Oldest ones out (names sort by time)
+    names = sorted(os.listdir(directory))
+    for old in names[:max(0, len(names) - keep)]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+def save_full_size_images(name, images):
+    """
+    Lazy: full-size images encoded into files (served by /crossing_images) by the pool, without waiting for them.
+    Returns the futures, for whoever needs to know when they're done (the slot holding the frames).
+    """
+    path = os.path.join(CROSSING_FULL_SIZE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    prune_directories(CROSSING_FULL_SIZE_DIR, CROSSING_FULL_SIZE_KEEP)
+    args = [(os.path.join(path, image_name(image_base_name, CROSSING_IMAGE_FORMAT)), image, CROSSING_IMAGE_FORMAT, CROSSING_IMAGE_QUALITY)
+            for image_base_name, image in images.items()]
+    if crossing_encoder_pool is None:
+        for task_args in args:
+            save_image(*task_args)
+        return []
+    return [crossing_encoder_pool.submit(save_image, *task_args) for task_args in args]
+
+def encode_crossing_images(images):
+    """
+    images: {name: image}. Returns [(file name, bytes)]: the thumbnail, then the full-size images (none when lazy).
+    Every image is a task of its own in the pool, so they're encoded at the same time.
+    """
+    tasks = []
+    if CROSSING_THUMBNAIL_WIDTH:
+        tasks.append(("b-thumb", images["b-frame"], CROSSING_THUMBNAIL_WIDTH))
+    if CROSSING_FULL_SIZE != "lazy":
+        tasks += [(image_base_name, image, None) for image_base_name, image in images.items()]
+
+    args = [(image, CROSSING_IMAGE_FORMAT, CROSSING_IMAGE_QUALITY, max_width) for _, image, max_width in tasks]
+    if crossing_encoder_pool is None:
+        results = [encode_image(*task_args) for task_args in args]
+    else:
+        results = [future.result() for future in [crossing_encoder_pool.submit(encode_image, *task_args) for task_args in args]]
+    return [(image_name(image_base_name, CROSSING_IMAGE_FORMAT), data) for (image_base_name, _, _), data in zip(tasks, results)]
+
 def processMetaCrossing():
     while True:
+        slot = None
         try:
-            meta_crossing_status, meta_crossing_time, meta_crossing_prev, meta_crossing_frame, meta_crossing_stack = meta_crossing_queue.get(block=True)
+            meta_crossing_status, meta_crossing_time, meta_crossing_prev, meta_crossing_frame, meta_crossing_stack, slot, crossings, line_x = meta_crossing_queue.get(block=True)
 
             readable_time = time.strftime("%Y%m%d_%H%M%S", time.localtime(meta_crossing_time))
             print(f"META THREAD: Meta crossing at: {readable_time}")
             # cv2.imwrite(f"jpg/crossing_{readable_time}.jpg", meta_crossing_frame)
 
-            _, jpg_byte_prev = cv2.imencode('.jpg', meta_crossing_prev)
-            jpg_byte_prev = jpg_byte_prev.tobytes()
-            _, jpg_byte_current = cv2.imencode('.jpg', meta_crossing_frame)
-            jpg_byte_current = jpg_byte_current.tobytes()
-            _, jpg_bytes_stack = cv2.imencode('.jpg', meta_crossing_stack)
-            jpg_bytes_stack = jpg_bytes_stack.tobytes()
-
-            pending_events_queue.put_nowait((meta_crossing_status, meta_crossing_time, jpg_byte_prev, jpg_byte_current, jpg_bytes_stack)) 
+            stage_start = time.perf_counter()
+            # Only where the action is: the cars that crossed, and the meta line (views, the pool gets just those pixels)
+            x1, y1, x2, y2 = (crop_region(meta_crossing_frame.shape, [crossing_info["bbox"] for crossing_info in crossings], line_x, CROSSING_CROP_MARGIN)
+                              if CROSSING_CROP_MARGIN is not None else (0, 0, meta_crossing_frame.shape[1], meta_crossing_frame.shape[0]))
+            name = crossing_name(meta_crossing_time)
+            crops = {
+                "a-frame": meta_crossing_prev[y1:y2, x1:x2],
+                "b-frame": meta_crossing_frame[y1:y2, x1:x2],
+                "b-stack": meta_crossing_stack,
+            }
+            images = encode_crossing_images(crops)
+            stage_start = stage_metrics.lap("crossing_encode", stage_start)
+
+            # To disk right away: from here on, neither a server outage nor a restart loses this lap.
+            # One event per car that crossed in this frame, all with the same images
+            for crossing_info in crossings:
+                # The whole crossing, as data (see event_schema); the burst is under /bursts/ once encoded
+                fields = crossing_event(crossing_info, readable_time)
+                if CROSSING_FULL_SIZE == "lazy":
+                    fields["full_size"] = name                      # Under /crossing_images/, encoded after spooling
+                event_id = event_spool.append(fields, images, crossing_time=meta_crossing_time)
+                pending_events_queue.put(event_id)
+            stage_metrics.lap("spool_append", stage_start)
+
+            # Lazy: the events are on their way with their thumbnails, now the rest
+            if CROSSING_FULL_SIZE == "lazy":
+                for future in save_full_size_images(name, crops):
+                    future.result()     # The frames are read from the slot until the pool has them
 
         except Exception as e:
             print(f"Error: {e}")
 
+        finally:
+            if slot is not None:
+                slot.release()
+
         time.sleep(0.1)   # Mostly unneeded, but just in case
 
 
 
+#
+# CROSSING BURSTS THREAD
+#
+def build_frame_burst(frame_shape):
+    window = BURST_FRAMES_BEFORE + BURST_FRAMES_AFTER + 1
+    capacity = min(2 * window, BURST_MAX_MB * 1024 * 1024 // FrameBurst.frame_bytes(frame_shape, BURST_SCALING))
+    if capacity < window:
+        raise ValueError(f"BURST_MAX_MB fits {capacity} frames, a burst needs {window}: lower BURST_SCALING or the burst frames")
+    frame_burst = FrameBurst(frame_shape, capacity, BURST_SCALING)
+    print(f">>> Burst ring: {frame_burst.status()}")
+    return frame_burst
+
+def save_burst(frame_burst, crossing_time, crossing_status, slots, times):
+    # Frames are read straight from the ring slots, which stay frozen until this is done
+    path = os.path.join(BURST_DIR, crossing_name(crossing_time))
+    os.makedirs(path, exist_ok=True)
+    frames = [{"time": float(t), "offset_ms": round(1000 * (t - crossing_time), 2)} for t in times]
+    if BURST_FORMAT == "mp4":
+        writer = cv2.VideoWriter(os.path.join(path, "clip.mp4"), cv2.VideoWriter_fourcc(*"mp4v"), FRAME_FPS, frame_burst.size)
+        for slot in slots:
+            writer.write(frame_burst.frames[slot])
+        writer.release()
+    else:
+        for n, (slot, frame) in enumerate(zip(slots, frames)):
+            frame["file"] = f"{n:03d}.jpg"
+            cv2.imwrite(os.path.join(path, frame["file"]), frame_burst.frames[slot])
+    with open(os.path.join(path, "burst.json"), "w") as f:
+        json.dump({"crossing_time": crossing_time, "crossing_status": crossing_status, "size": frame_burst.size,
+                   "crossing_frame": int(np.argmin(np.abs(times - crossing_time))), "frames": frames}, f, indent=1)
+    prune_directories(BURST_DIR, BURST_KEEP)
+
+def encodeBursts():
+    # Runs next to the capture loop, which owns the ring
+    while True:
+        item = burst_queue.get(block=True)
+        stage_start = time.perf_counter()
+        try:
+            save_burst(*item)
+            print(f"BURST THREAD: {len(item[3])} frames saved for the crossing at {crossing_name(item[1])}")
+        except Exception as e:
+            print(f"Error saving burst: {e}")
+        finally:
+            release_burst_slots(item)
+        stage_metrics.lap("burst_encode", stage_start)
+
+
+
 #
 # PUBLISHING EVENTS THREADS
 #
-def publishEvents():
+photo_finishes = {}     # Crossing time -> encoded photo finish, waiting for their events
+photo_finishes_condition = threading.Condition()
+publish_wakeups = 0     # New events in the spool not picked up by any publisher thread yet
+publish_condition = threading.Condition()
+requests = None         # The HTTP client, imported once the publisher starts: not paid by every import of this module
+publisher_sessions = threading.local()
+uploaded_images = {}    # Hashes of the images the server already has (EVENTS_PAYLOAD "json" and "binary"), oldest first
+uploaded_images_lock = threading.Lock()
+
+def collectPhotoFinishes():
+    while True:
+        photo_time, _, photo_image, _ = photo_finish_queue.get(block=True)
+        _, photo_bytes = cv2.imencode('.jpg', photo_image)
+        with photo_finishes_condition:
+            photo_finishes[photo_time] = photo_bytes.tobytes()
+            for stale_time in [t for t in photo_finishes if t < photo_time - 60]:
+                del photo_finishes[stale_time]
+            photo_finishes_condition.notify_all()
+
+def wait_for_photo_finish(crossing_time, wait):
+    # The photo finish is complete PHOTO_FINISH_AFTER_TIME after the crossing, so it may still be on its way
+    with photo_finishes_condition:
+        if not photo_finishes_condition.wait_for(lambda: crossing_time in photo_finishes,
+                                                 timeout=PHOTO_FINISH_AFTER_TIME + 1.0 if wait else 0):
+            if wait:
+                print("EVENTS THREAD: No photo finish for this crossing")
+            return None
+        return photo_finishes.get(crossing_time)     # Not popped: several cars may share a crossing frame (stale ones go away on their own)
+
+def publisher_session():
+    # One session per publisher thread: its connection is kept alive from one event to the next
+    session = getattr(publisher_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        publisher_sessions.session = session
+    return session
+
+def retry_delay(attempts):
+    # Exponential backoff with jitter
+    delay = min(EVENT_RETRY_MAX_DELAY, EVENT_RETRY_BASE_DELAY * 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def join_photo_finish(event, wait):
+    # The photo finish only exists in memory, for a little while after the crossing: join it on the first attempt
+    if PHOTO_FINISH and event.attempts == 0 and time.time() - event.created < 10:
+        photo_finish_bytes = wait_for_photo_finish(event.crossing_time, wait)
+        if photo_finish_bytes:
+            event_spool.attach(event.event_id, 'photo-finish.jpg', photo_finish_bytes)
+            event.images.append(('photo-finish.jpg', photo_finish_bytes))
+
+def post_form(events):
+    # Fields and images in one multipart request
+    if EVENTS_BATCH_PATH:
+        # Fields of every event as a JSON list, and images named after their events
+        response = publisher_session().post(
+            EVENTS_SERVER_URL + EVENTS_BATCH_PATH.format(lap_id=EVENTS_LAP_ID),
+            data={"events": json.dumps([{**form_fields(event.fields), "event_id": event.event_id} for event in events])},
+            files=[(event.event_id, (name, data, mime_type(name))) for event in events for name, data in event.images],
+            timeout=EVENTS_POST_TIMEOUT
+        )
+    else:
+        (event,) = events
+        response = publisher_session().post(
+            f"{EVENTS_SERVER_URL}/lap/{EVENTS_LAP_ID}",
+            data={**form_fields(event.fields), "event_id": event.event_id},
+            headers={"Idempotency-Key": event.event_id},    # Delivery is at-least-once: the server may see an event twice
+            files=[('image', (name, data, mime_type(name))) for name, data in event.images],
+            timeout=EVENTS_POST_TIMEOUT
+        )
+    response.raise_for_status()
+
+def post_event_data(events):
+    # The events alone, JSON or binary: what the server needs to know a lap happened, in a few hundred bytes
+    described = [with_images(event.fields, event.event_id, event.images) for event in events]
+    if EVENTS_PAYLOAD == "binary":
+        records = [to_binary(event) for event in described]
+        body = pack_batch(records) if EVENTS_BATCH_PATH else records[0]
+        headers = {"Content-Type": BINARY_CONTENT_TYPE}
+    else:
+        body = to_json(described if EVENTS_BATCH_PATH else described[0])
+        headers = {"Content-Type": "application/json"}
+    if not EVENTS_BATCH_PATH:
+        headers["Idempotency-Key"] = events[0].event_id
+    response = publisher_session().post(
+        EVENTS_SERVER_URL + (EVENTS_BATCH_PATH or EVENTS_PATH).format(lap_id=EVENTS_LAP_ID),
+        data=body, headers=headers, timeout=EVENTS_POST_TIMEOUT)
+    response.raise_for_status()
+
+def upload_images(events):
+    # Every image of the events the server doesn't have yet, by content hash (cars crossing in the same frame share theirs)
+    for event in events:
+        for name, data in event.images:
+            key = image_id(data)
+            with uploaded_images_lock:
+                if key in uploaded_images:
+                    continue
+            response = publisher_session().put(
+                EVENTS_SERVER_URL + EVENTS_IMAGE_PATH.format(lap_id=EVENTS_LAP_ID, image_id=key),
+                data=data,
+                headers={"Content-Type": mime_type(name), "X-Event-Id": event.event_id, "X-Image-Name": name},
+                timeout=EVENTS_POST_TIMEOUT)
+            response.raise_for_status()
+            with uploaded_images_lock:
+                uploaded_images[key] = True
+                while len(uploaded_images) > UPLOADED_IMAGES_MEMORY:
+                    del uploaded_images[next(iter(uploaded_images))]
+
+def publish_events(events):
+    # Events spooled before the event schema only go out as forms
+    payload = EVENTS_PAYLOAD if all("version" in event.fields for event in events) else "form"
+    for event in events:
+        print(f"EVENTS THREAD: Processing crossing at: {event.fields['time']} (attempt {event.attempts + 1}{', images only' if event.posted else ''})")
+        if payload == "form":
+            join_photo_finish(event, PHOTO_FINISH_WAIT)
+
+    posted = []     # Events the server took in this attempt, whatever happens to their images
+    stage_start = time.perf_counter()
+    try:
+        if payload == "form":
+            post_form(events)
+        else:
+            # The lap first, then its images: the photo finish, still on its way, is a follow-up upload that can wait.
+            # Once the server took the lap, a failed image upload only retries the images
+            unposted = [event for event in events if not event.posted]
+            if unposted:
+                post_event_data(unposted)
+                posted = unposted
+            for event in events:
+                join_photo_finish(event, True)
+            upload_images(events)
+        stage_metrics.lap("publish", stage_start)
+        stage_metrics.count("events_posted", len(events))
+        for event in events:
+            event_spool.ack(event.event_id)
+            stage_metrics.observe("crossing_to_server", time.time() - event.crossing_time)
+        latency = max(time.time() - event.crossing_time for event in events)
+        print(f"✅ {len(events)} event(s) {'posted' if payload == 'form' else 'and their images posted'} successfully, {1000 * latency:.0f} ms after the crossing")
+    except requests.RequestException as e:
+        print("❌ Error posting event:", e)
+
+        # Optional: print response info if it exists
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            print("🛠 Status code:", e.response.status_code)
+            print("📝 Body:", e.response.text)
+
+        # Back to the spool: later events don't wait for these
+        stage_metrics.count("events_failed", len(events))
+        for event in posted:
+            event_spool.mark_posted(event.event_id)
+        for event in events:
+            event_spool.retry_later(event.event_id, retry_delay(event.attempts))
+
+def publishWorker():
+    global publish_wakeups
+    lease = 2 * EVENTS_POST_TIMEOUT + PHOTO_FINISH_AFTER_TIME + 1.0    # An event stuck longer than this is posted again
     while True:
+        publish_metrics()
         try:
-            meta_crossing_status, meta_crossing_time, meta_crossing_prev_bytes, meta_crossing_frame_bytes, meta_crossing_stack_bytes = pending_events_queue.get(block=True)
-            readable_time = time.strftime("%Y%m%d_%H%M%S", time.localtime(meta_crossing_time))
-            print(f"EVENTS THREAD: Processing crossing at: {readable_time}")
+            events = event_spool.claim_due(EVENTS_BATCH_SIZE if EVENTS_BATCH_PATH else 1, lease=lease, in_order=EVENTS_IN_ORDER)
+            if events:
+                publish_events(events)
+                continue
         except Exception as e:
             print(f"Error: {e}")
 
-        files = [
-            ('image', ('a-frame.jpg', meta_crossing_prev_bytes, 'image/jpeg')),
-            ('image', ('b-frame.jpg', meta_crossing_frame_bytes, 'image/jpeg')),
-            ('image', ('b-stack.jpg', meta_crossing_stack_bytes, 'image/jpeg')),
-        ]
+        # Nothing due: wait for new events (retries are checked every now and then)
+        with publish_condition:
+            if publish_condition.wait_for(lambda: publish_wakeups > 0, timeout=EVENT_SPOOL_POLL_INTERVAL):
+                publish_wakeups -= 1
 
-        # Retry until success
-        while True:
-            try:
-                response = requests.post(
-                    "http://192.168.50.166:8080/lap/42",
-                    data={
-                        "time": readable_time,
-                        "crossing_status": meta_crossing_status
-                    },
-                    files=files,
-                    timeout=5  # good to have a timeout to avoid hanging forever
-                )
-                response.raise_for_status()
-                print("✅ Event posted successfully")
-                break
-            except requests.RequestException as e:
-                print("❌ Error posting event:", e)
-
-                # Optional: print response info if it exists
-                if isinstance(e, requests.HTTPError) and e.response is not None:
-                    print("🛠 Status code:", e.response.status_code)
-                    print("📝 Body:", e.response.text)
-
-                # Wait before retrying
-                time.sleep(10)
-
-        time.sleep(0.1)  # Mostly unneeded, but just in case
+def publishEvents():
+    global publish_wakeups, requests
+    import requests
+    threading.Thread(target=collectPhotoFinishes, daemon=True).start()
+    if PHOTO_FINISH and EVENTS_PAYLOAD == "form" and not PHOTO_FINISH_WAIT:
+        print("EVENTS THREAD: PHOTO_FINISH_WAIT is off, form events only carry a photo finish when it's ready as they go out")
+    for _ in range(1 if EVENTS_IN_ORDER else PUBLISHER_CONCURRENCY):
+        threading.Thread(target=publishWorker, daemon=True).start()
 
+    while True:
+        pending_events_queue.get(block=True)    # Just a wake-up call, events are in the spool
+        with publish_condition:
+            publish_wakeups += 1
+            publish_condition.notify()
+
+
+
+def encode_stream_frame(frame, quality=None):
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality or STREAM_QUALITY]
+    _, buffer = cv2.imencode('.jpg', frame, encode_param)
+    return buffer.tobytes()
+
+def publish_stream_frame(name, frame, scaling=1.0):
+    qualities = stream_qualities[name]
+    if not qualities:
+        return      # Nobody watching: don't even encode
+    stage_start = time.perf_counter()
+    if scaling < 1.0:
+        frame = cv2.resize(frame, (int(frame.shape[1] * scaling), int(frame.shape[0] * scaling)), interpolation=cv2.INTER_AREA)
+    # No level above STREAM_QUALITY (the governor may lower it), and levels capped to the same quality are encoded once
+    encoded = {}
+    for quality in sorted(qualities):
+        capped = min(quality, STREAM_QUALITY)
+        if capped not in encoded:
+            encoded[capped] = encode_stream_frame(frame, capped)
+    jpegs = {quality: encoded[min(quality, STREAM_QUALITY)] for quality in qualities}
+    stage_metrics.lap(f"stream_encode_{name}", stage_start)
+    if streaming_frame_queue is None:
+        stream_hubs[name].publish(jpegs)
+        return
+    try:
+        streaming_frame_queue.put_nowait((name, jpegs))
+    except queue.Full:
+        pass
 
+def forwardStreamFrames():
+    # Multi-process mode: the hubs (and their viewers) live in the web server process
+    while True:
+        name, jpegs = streaming_frame_queue.get(block=True)
+        stream_hubs[name].publish(jpegs)
 
-# === Flask Routes ===
-def generate_stream_main():
+
+
+#
+# SYSTEM SAMPLER THREAD
+#
+# CPU, temperature, memory and throttling, sampled here (procfs and sysfs, vcgencmd only now and then) and never in
+# a request: the status page, the history and the quality governor all read the last samples
+system_sampler = SystemSampler(SYSTEM_HISTORY_SIZE, VCGENCMD_EVERY_X_SAMPLES)
+
+def sampleSystem():
     try:
-        while True:
-            try:
-                output_frame_copy = streaming_frame_queue_main.get(timeout=5)
-            except queue.Empty:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)    # Linux: this thread only, below capture
+    except (AttributeError, OSError):
+        pass
+    while True:
+        system_sampler.sample()
+        time.sleep(MONITORING_INTERVAL)
+
+
+
+#
+# QUALITY GOVERNOR THREAD
+#
+quality_governor = None
+
+def build_quality_governor():
+    # The camera's lores stream is configured once, at the processing resolution: no FRAME_SCALING changes with it
+    steps = [step for step in GOVERNOR_STEPS if not (DUAL_STREAM_MODE and "FRAME_SCALING" in step)]
+    baseline = {name: globals()[name] for step in steps for name in step}
+    for step in steps:
+        if step.get("FRAME_SCALING", FRAME_SCALING) > FRAME_SCALING:
+            raise ValueError("The quality governor can't raise FRAME_SCALING (buffers are sized for the configured one)")
+    return QualityGovernor(baseline, steps, GOVERNOR_HIGH_LOAD, GOVERNOR_LOW_LOAD, GOVERNOR_HOT_TEMP, GOVERNOR_COOL_TEMP,
+                           settle_time=GOVERNOR_SETTLE_TIME)
+
+def governQuality():
+    # Runs in the web server process: settings are changed here and broadcast, like the ones from the web page
+    last_processing = None      # (count, sum) of the capture loop "processing" stage at the previous evaluation
+    while True:
+        time.sleep(MONITORING_INTERVAL)
+        load = None
+        for snapshot in current_metrics_snapshots().values():
+            histogram = snapshot["stages"].get("processing")
+            if histogram is None:
                 continue
+            if last_processing is not None and histogram["count"] > last_processing[0]:
+                frame_time = (histogram["sum"] - last_processing[1]) / (histogram["count"] - last_processing[0])
+                load = frame_time * FRAME_FPS   # Fraction of the frame budget
+            last_processing = (histogram["count"], histogram["sum"])
+        sample = system_sampler.latest()
+        temperature = sample.cpu_temp if sample is not None else None
+        flags = sample.throttled if sample is not None else None
+        changes = quality_governor.evaluate(time.time(), load, temperature,
+                                            throttled=flags is not None and bool(flags & THROTTLED_NOW_FLAGS))
+        if changes:
+            decision = quality_governor.decisions[-1]
+            print(f">>> Quality governor: {decision['direction']} to level {decision['level']} ({decision['reason']}): " +
+                  ", ".join(f"{name}={value}" for name, value in changes.items()))
+            for name, value in changes.items():
+                globals()[name] = value
+                broadcast_control(name, value)
 
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), STREAM_QUALITY]
-            _, buffer = cv2.imencode('.jpg', output_frame_copy, encode_param)
-            frame = buffer.tobytes()
 
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    except GeneratorExit:
-        print("Client disconnected from video stream")
-    except Exception as e:
-        print(f"Streaming error: {e}")
 
-def generate_stream_extra():
+# === Flask Routes ===
+def generate_stream(name, quality, max_fps):
+    subscriber = stream_hubs[name].subscribe(quality=quality, max_fps=max_fps or STREAM_MAX_VIEWER_FPS)
     try:
         while True:
-            try:
-                output_frame_copy = streaming_frame_queue_extra.get(timeout=5)
-            except queue.Empty:
+            frame = subscriber.get(timeout=5)
+            if frame is None:
                 continue
 
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), STREAM_QUALITY]
-            _, buffer = cv2.imencode('.jpg', output_frame_copy, encode_param)
-            frame = buffer.tobytes()
-
             yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
     except GeneratorExit:
         print("Client disconnected from video stream")
     except Exception as e:
         print(f"Streaming error: {e}")
+    finally:
+        subscriber.close()
 
 @app.route('/get_status')
 def get_status():
     global last_status_time, last_status_result
     current_time = time.time()
 
+    # System figures come from the sampler thread: no file read nor process in here, however many pages ask
     if current_time - last_status_time >= MONITORING_INTERVAL:
-        cpu_usage = psutil.cpu_percent(interval=None)
-        per_cpu = psutil.cpu_percent(interval=None, percpu=True)
-        cpu_usage_text = f"{cpu_usage:.1f}% ({', '.join(f'{u:.1f}' for u in per_cpu)})"
-
-        cpu_temp = get_cpu_temp()
-        cpu_temp_text = f"{cpu_temp:.1f} C" if cpu_temp else "N/A"
-
-        cpu_freqs_text = get_cpu_freq()
-
-        mem = psutil.virtual_memory()
-        mem_usage_text = f"{mem.percent:.1f}% ({mem.used // (1024*1024)} MB / {mem.total // (1024*1024)} MB)"
-
-        throttling_status_text = get_throttling_status()
-
         last_status_result = {
-            'cpu_usage': cpu_usage_text,
-            'cpu_temp': cpu_temp_text,
-            'cpu_freq': cpu_freqs_text,
-            'mem_usage': mem_usage_text,
-            'throttling_status': throttling_status_text,
-            'fps_summary': fps_global_string
+            **format_system_status(system_sampler.latest()),
+            'fps_summary': fps_global_string,
+            'frame_pool': frame_pool_status,
+            'event_spool': event_spool.status() if event_spool is not None else "N/A",
+            'queues': "; ".join(f"{name}: {format_queue_stats(stats)}" for name, stats in current_queue_stats().items()),
+            'stages': "; ".join(format_stage_summary(current_metrics_snapshots())),
+            'viewers': ", ".join(f"{name}: {hub.status()}" for name, hub in stream_hubs.items()),
+            'governor': quality_governor.status() if quality_governor is not None else "Off",
+            'startup': startup_status
         }
 
         last_status_time = current_time
 
     return last_status_result
 
+@app.route('/get_status_history')
+def get_status_history():
+    # The sampler's ring as columns (time, cpu_percent, cpu_temp...), ie. for plotting. ?seconds=300 for the last 5 min
+    return system_sampler.history(request.args.get('seconds', type=float))
+
+@app.route('/metrics')
+def metrics():
+    gauges = [("stream_viewers", {"stream": name}, hub.viewers()) for name, hub in stream_hubs.items()]
+    if event_spool is not None:
+        gauges.append(("spooled_events", {}, event_spool.pending()))
+    sample = system_sampler.latest()
+    if sample is not None:
+        for name, value in (("cpu_usage_percent", sample.cpu_percent), ("cpu_temperature_celsius", sample.cpu_temp),
+                            ("arm_clock_mhz", sample.arm_clock_mhz), ("memory_used_percent", sample.mem_percent),
+                            ("throttled_flags", sample.throttled)):
+            if value is not None:
+                gauges.append((name, {}, value))
+    return Response(render_prometheus(current_metrics_snapshots(), current_queue_stats(), gauges),
+                    mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template_string(HTML_PAGE,
         trackers=AVAILABLE_TRACKERS.keys(),
         current_tracker=TRACKER_TYPE,
-        line_x=META_LINE_X_PX,
-        min_y=int(MIN_Y_FACTOR*100),
-        max_y=int(MAX_Y_FACTOR*100),
+        line_x=detection_config.meta_line_x,
+        min_y=int(detection_config.min_y_factor*100),
+        max_y=int(detection_config.max_y_factor*100),
         width=int(FRAME_WIDTH),
         scaled_width=int(FRAME_WIDTH*FRAME_SCALING),
-        cpu_usage="Calculating...",
-        cpu_temp="N/A",
-        cpu_freq="0",
-        mem_usage="0",
-        throttling_status="Checking...",
+        **format_system_status(system_sampler.latest()),
         fps_summary=fps_global_string)
 
+@app.route('/bursts/<path:name>')
+def bursts(name):
+    # Frames of a crossing (ie. /bursts/20250501_171326_525/burst.json), as named in the event's burst field
+    return send_from_directory(BURST_DIR, name)
+
+@app.route('/crossing_images/<name>/<file_name>')
+def crossing_images(name, file_name):
+    # Lazy full-size images (see CROSSING_FULL_SIZE), ie. /crossing_images/20250501_171326_525/b-frame.jpg
+    return send_from_directory(os.path.join(CROSSING_FULL_SIZE_DIR, os.path.basename(name)), file_name)
+
 @app.route('/video_feed_main')
 def video_feed_main():
-    return Response(generate_stream_main(),
+    return Response(generate_stream("main", request.args.get('quality', type=int), request.args.get('fps', type=float)),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/video_feed_extra')
 def video_feed_extra():
-    return Response(generate_stream_extra(),
+    return Response(generate_stream("extra", request.args.get('quality', type=int), request.args.get('fps', type=float)),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/trigger_cooldown')
 def trigger_cooldown():
     global trigger_cooldown
     trigger_cooldown = True
+    broadcast_control("trigger_cooldown", True)
     return "Cool down triggered", 200
 
 @app.route('/set_tracker')
@@ -1008,6 +2029,7 @@ def set_tracker():
     tracker_type = request.args.get('type')
     if tracker_type in AVAILABLE_TRACKERS:
         new_tracker_type = tracker_type
+        broadcast_control("new_tracker_type", tracker_type)
         return f"Tracker set to {tracker_type}", 200
     return "Invalid tracker type", 400
 
@@ -1015,56 +2037,263 @@ def set_tracker():
 def recalibrate():
     global recalibrate_flag
     recalibrate_flag = True
+    broadcast_control("recalibrate_flag", True)
     return "Recalibrated", 200
 
+# Band and line changes take effect on the next frame, with the background model as it is (no cool down)
 @app.route('/set_line')
 def set_line():
-    global META_LINE_X_PX
     try:
-        META_LINE_X_PX = int(request.args.get('x'))
-        return f"Line X set to {META_LINE_X_PX}", 200
+        config = update_detection_config(meta_line_x=int(request.args.get('x')))
+        return f"Line X set to {config.meta_line_x}", 200
+    except ValueError as e:
+        return str(e), 400
     except:
         return "Invalid value", 400
 
 @app.route('/set_min_y')
 def set_min_y():
-    global MIN_Y_FACTOR
-    global MAX_Y_FACTOR
-    global trigger_cooldown
     try:
-        y = float(request.args.get('y'))/100.0
-        if y >= MAX_Y_FACTOR:
-            return "Min Y must be less than Max Y", 400
-        MIN_Y_FACTOR = y
-        trigger_cooldown = True
-        return f"Min Y set to {MIN_Y_FACTOR}", 200
+        config = update_detection_config(min_y_factor=float(request.args.get('y'))/100.0)
+        return f"Min Y set to {config.min_y_factor}", 200
+    except ValueError as e:
+        return str(e), 400
     except:
         return "Invalid value", 400
 
 @app.route('/set_max_y')
 def set_max_y():
-    global MIN_Y_FACTOR
-    global MAX_Y_FACTOR
-    global trigger_cooldown
     try:
-        y = float(request.args.get('y'))/100.0
-        if y <= MIN_Y_FACTOR:
-            return "Max Y must be less than Min Y", 400
-        MAX_Y_FACTOR = y
-        trigger_cooldown = True
-        return f"Max Y set to {MAX_Y_FACTOR}", 200
+        config = update_detection_config(max_y_factor=float(request.args.get('y'))/100.0)
+        return f"Max Y set to {config.max_y_factor}", 200
+    except ValueError as e:
+        return str(e), 400
     except:
         return "Invalid value", 400
 
 @app.route('/reset_autofocus')
 def reset_autofocus_route():
-    reset_autofocus()
+    if MULTIPROCESS_MODE:
+        broadcast_control("reset_autofocus")
+    else:
+        reset_autofocus()
     return "Autofocus reset", 200
 
 # === Start Threads ===
-if __name__ == '__main__':
+def start_quality_governor():
+    global quality_governor
+    if QUALITY_GOVERNOR:
+        quality_governor = build_quality_governor()
+        threading.Thread(target=governQuality, daemon=True).start()
+
+def start_system_sampler():
+    threading.Thread(target=sampleSystem, daemon=True).start()
+
+def start_burst_encoder():
+    if BURST_CAPTURE:
+        threading.Thread(target=encodeBursts, daemon=True).start()
+
+def start_threaded_pipeline():
+    setup_event_spool()
+    start_crossing_encoder_pool()   # First: forked before any thread
+    if frame_source is None:
+        setup_frame_source()        # Unless one was set already (ie. a benchmark)
+    start_system_sampler()
+    start_quality_governor()
+    start_burst_encoder()
     threading.Thread(target=capture_frames, daemon=True).start()
+    atexit.register(stop_capture)
     threading.Thread(target=framePostProcessingWorker, daemon=True).start()
     threading.Thread(target=processMetaCrossing, daemon=True).start()
     threading.Thread(target=publishEvents, daemon=True).start()
-    app.run(host='0.0.0.0', port=5000, threaded=True)
+
+
+
+#
+# MULTI-PROCESS MODE
+#
+# Capture+detection, post-processing (one or more processes) and publishing run in their own processes, while
+# this one only serves the web page. Frames go to post-processing through a shared-memory ring; streaming
+# JPEGs, events, config changes and status are small enough to travel through regular multiprocessing queues.
+#
+def applyControlUpdates(control_queue):
+    while True:
+        name, value = control_queue.get(block=True)
+        if name == "reset_autofocus":
+            if frame_source is not None:
+                reset_autofocus()
+        else:
+            globals()[name] = value
+
+def applyStatusUpdates():
+    while True:
+        name, value = status_queue.get(block=True)
+        if isinstance(value, dict) and isinstance(globals().get(name), dict):
+            value = {**globals()[name], **value}    # Partial update, ie. the queues of one of the processes
+        globals()[name] = value
+
+def runChildProcess(target, control_queue):
+    threading.Thread(target=applyControlUpdates, args=(control_queue,), daemon=True).start()
+    target()
+
+def stop_capture(*args):
+    # On the way out: the capture loop saves the background snapshot before stopping (see capture_frames)
+    capture_stop.set()
+    if not MULTIPROCESS_MODE:   # At exit, waiting for the capture thread. In its own process, this is the capture loop
+        capture_stopped.wait(timeout=1.0)
+
+def captureProcess():
+    # Stopped by the main process (terminate) or Ctrl-C: the loop ends on its own, saving what it has to first
+    signal.signal(signal.SIGTERM, stop_capture)
+    signal.signal(signal.SIGINT, stop_capture)
+    setup_frame_source()
+    start_burst_encoder()       # Bursts are encoded out of the ring, in this process
+    capture_frames()
+
+def forwardQueue(source, destination):
+    while True:
+        destination.put(source.get(block=True), block=True)
+
+def postProcessingProcess():
+    global pending_events_queue
+    # Events spill locally, so a stalled publisher makes this process hold them rather than drop them
+    publisher_queue = pending_events_queue
+    pending_events_queue = build_pending_events_queue()
+    start_crossing_encoder_pool()   # Before the threads of this process
+    threading.Thread(target=forwardQueue, args=(pending_events_queue, publisher_queue), daemon=True).start()
+    threading.Thread(target=processMetaCrossing, daemon=True).start()   # Crossing images are encoded right here, with its own pool
+    framePostProcessingWorker()
+
+def build_shared_frame_queue(ctx):
+    # Capture to post-processing, through the shared-memory ring
+    scaled_width = int(FRAME_WIDTH * FRAME_SCALING)
+    scaled_height = int(FRAME_HEIGHT * FRAME_SCALING)
+    return SharedFrameQueue({
+            0: ((FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8),      # Previous frame
+            1: ((FRAME_HEIGHT, FRAME_WIDTH, 3), np.uint8),      # Current frame
+            2: ((4 * scaled_height + 3, scaled_width), np.uint8),   # Stack of internal images (see stack_views)
+        },
+        slots=SHARED_RING_SLOTS,
+        context=ctx)
+
+def start_multiprocess_pipeline():
+    global post_processing_queue, pending_events_queue, photo_finish_queue, status_queue
+    global streaming_frame_queue
+
+    setup_event_spool()             # Before forking: every process shares it
+    ctx = mp.get_context("fork")    # Children inherit the module state (config, Flask app...) as it is now
+    post_processing_queue = build_shared_frame_queue(ctx)
+    pending_events_queue = ctx.Queue(maxsize=PENDING_EVENTS_QUEUE_SIZE)
+    photo_finish_queue = ctx.Queue(maxsize=10)
+    streaming_frame_queue = ctx.Queue(maxsize=4)
+    status_queue = ctx.Queue(maxsize=100)
+
+    targets = [("capture", captureProcess)]
+    targets += [(f"post-processing-{i}", postProcessingProcess) for i in range(POST_PROCESSING_PROCESSES)]
+    targets += [("publisher", publishEvents)]
+    processes = []
+    for name, target in targets:
+        control_queue = ctx.Queue(maxsize=100)
+        control_queues.append(control_queue)
+        processes.append(ctx.Process(target=runChildProcess, args=(target, control_queue), name=name, daemon=True))
+    for p in processes:
+        p.start()
+    print(f">>> Multi-process mode: {', '.join(f'{p.name} ({p.pid})' for p in processes)}")
+
+    atexit.register(post_processing_queue.close, unlink=True)
+    threading.Thread(target=applyStatusUpdates, daemon=True).start()
+    threading.Thread(target=forwardStreamFrames, daemon=True).start()
+    start_system_sampler()
+    start_quality_governor()
+
+
+
+#
+# ENTRY POINT
+#
+# Importing this module builds nothing but small objects (no camera, no threads, no server), so tools and
+# benchmarks can use it as a library. main() picks the settings (the defaults above, then a config file, then
+# --set), and only then opens the camera, starts the pipeline and serves the web page.
+#
+#   python rpi_lap_cam_detector.py --config track.json --set FRAME_FPS=50 --set META_LINE_X_PX=720
+#   python rpi_lap_cam_detector.py --source synthetic --port 5001
+#
+# Config file: a JSON object of settings by name, ie. {"FRAME_FPS": 50, "LANES": [[0.3, 0.54], [0.54, 0.78]]}.
+#
+import_time = time.perf_counter() - import_start
+
+def parse_setting(text):
+    # NAME=VALUE, the value as a Python literal (0.01, None, ((0.3, 0.5),)...) or else a plain string (KNN)
+    name, _, value = text.partition("=")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+def configure(settings):
+    """Applies settings ({NAME: value}) over the defaults, and rebuilds what was built out of them."""
+    global detection_config, ground_calibration, CROSSING_FULL_SIZE_DIR, STREAM_QUALITY_LEVELS
+    global post_processing_queue, meta_crossing_queue, pending_events_queue, stream_hubs, system_sampler
+    for name, value in settings.items():
+        if not name.isupper() or name not in globals():
+            raise ValueError(f"{name} is not a detector setting")
+        globals()[name] = tuple(map(tuple, value)) if name == "LANES" and value else value   # JSON has no tuples
+    if TRACKER_TYPE not in AVAILABLE_TRACKERS:
+        raise ValueError(f"Tracker {TRACKER_TYPE} not available (available: {', '.join(AVAILABLE_TRACKERS)})")
+
+    if "EVENT_SPOOL_DIR" in settings and "CROSSING_FULL_SIZE_DIR" not in settings:
+        CROSSING_FULL_SIZE_DIR = os.path.join(EVENT_SPOOL_DIR, "full-size")
+    if "STREAM_QUALITY" in settings and "STREAM_QUALITY_LEVELS" not in settings:
+        STREAM_QUALITY_LEVELS = (15, 25, STREAM_QUALITY)
+    detection_config = DetectionConfig(META_LINE_X_PX, MIN_Y_FACTOR, MAX_Y_FACTOR, WIDTH_OFFSET, MIN_COUNTOUR_AREA, LANES)
+    ground_calibration = GroundCalibration.from_file(CALIBRATION_FILE) if os.path.exists(CALIBRATION_FILE) else GroundCalibration()
+    post_processing_queue = PipelineQueue("post_processing", POST_PROCESSING_QUEUE_SIZE, DROP_OLDEST,
+                                          droppable=is_streaming_item, on_drop=release_item_slot)
+    meta_crossing_queue = PipelineQueue("meta_crossing", META_CROSSING_QUEUE_SIZE, BLOCK)
+    pending_events_queue = build_pending_events_queue()
+    stream_hubs = {name: StreamHub(name, STREAM_QUALITY_LEVELS, on_change=on_stream_viewers_change) for name in ("main", "extra")}
+    system_sampler = SystemSampler(SYSTEM_HISTORY_SIZE, VCGENCMD_EVERY_X_SAMPLES)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lap detector: finish line camera, web page and events publisher")
+    parser.add_argument("--config", help="JSON file of settings by name, ie. {\"FRAME_FPS\": 50}")
+    parser.add_argument("--set", action="append", default=[], type=parse_setting, metavar="NAME=VALUE",
+                        help="Override any setting, after the config file, ie. --set META_LINE_X_PX=720 (repeatable)")
+    parser.add_argument("--source", help="Frame source: picamera2, synthetic[:fast], or a video / image sequence (FRAME_SOURCE)")
+    parser.add_argument("--multiprocess", action="store_true", default=None, help="Run capture, post-processing and publishing in their own processes (MULTIPROCESS_MODE)")
+    parser.add_argument("--host", default="0.0.0.0", help="Web server address")
+    parser.add_argument("--port", type=int, default=5000, help="Web server port")
+    parser.add_argument("--sensor-modes", action="store_true", help="List the camera sensor modes and exit (slow: the camera is configured in every mode)")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.config:
+        with open(args.config) as f:
+            settings.update(json.load(f))
+    settings.update(args.set)
+    if args.source:
+        settings["FRAME_SOURCE"] = args.source
+    if args.multiprocess:
+        settings["MULTIPROCESS_MODE"] = True
+    try:
+        configure(settings)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.sensor_modes:
+        setup_frame_source(start=False)
+        for mode in frame_source.sensor_modes:
+            print(mode)
+        return 0
+
+    print(f">>> Imports took {1000 * import_time:.0f} ms")
+    if MULTIPROCESS_MODE:
+        start_multiprocess_pipeline()
+    else:
+        start_threaded_pipeline()
+    app.run(host=args.host, port=args.port, threaded=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+#
+# Frame rings in shared memory, so frames can travel between processes without pickling megabytes
+# of pixels. Only a small metadata tuple (slot, sequence number, shapes, scalars) goes through a
+# regular multiprocessing queue.
+#
+# Each slot has a sequence number and a busy flag in a shared header. The sequence number is set to -1
+# while the producer writes the slot and to the frame sequence number once the slot is complete, so a
+# consumer can tell whether a slot was overwritten under its feet (and drop that frame). The busy flag
+# is raised by the producer when it claims the slot and lowered by the consumer once it's done with it
+# (task_done), so a slot is never written while anybody may still be reading (or drawing on) it,
+# however many consumers there are and however slow one of them is.
+#
+
+ALIGNMENT = 64
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedFrameRing:
+    def __init__(self, fields, slots):
+        """
+        fields: {name: (max_shape, dtype)} describing the arrays held by every slot.
+        Arrays smaller than max_shape can be stored too (their actual shape travels with the metadata).
+        """
+        self.slots = slots
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self._offsets = {}
+        offset = _aligned(slots * 16)   # Header: one int64 sequence number and one int64 busy flag per slot
+        self.slot_size = 0
+        for name, (shape, dtype) in self.fields.items():
+            self._offsets[name] = self.slot_size
+            self.slot_size += _aligned(int(np.prod(shape)) * dtype.itemsize)
+        self._base = offset
+        self.shm = shared_memory.SharedMemory(create=True, size=offset + slots * self.slot_size)
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.sequences[:] = -1
+        self.busy = np.ndarray((slots,), dtype=np.int64, buffer=self.shm.buf, offset=slots * 8)
+        self.busy[:] = 0
+
+    def view(self, slot, name, shape):
+        max_shape, dtype = self.fields[name]
+        start = self._base + slot * self.slot_size + self._offsets[name]
+        count = int(np.prod(shape))
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf[start:start + count * dtype.itemsize])
+
+    def write(self, slot, name, array):
+        max_shape, dtype = self.fields[name]
+        if array.size > int(np.prod(max_shape)):
+            raise ValueError(f"Array {name} {array.shape} doesn't fit in the ring slot {max_shape}")
+        np.copyto(self.view(slot, name, array.shape), array, casting='unsafe')
+
+    def close(self, unlink=False):
+        self.sequences = None
+        self.busy = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedFrameQueue:
+    """
+    Drop-in replacement for the queue.Queue of tuples used between pipeline stages, for the multi-process mode.
+    Tuple items whose position is listed in array_fields are stored in a SharedFrameRing; the rest of the tuple
+    is pickled as usual (it's small). Consumers get the same tuple back, with numpy views into shared memory.
+
+    The views stay valid until the consumer calls task_done() (or gets its next item): only then can the
+    producer write their slot again. The producer takes the next slot that isn't busy, so a stalled consumer
+    costs the ring one slot, never the frame it holds.
+    """
+
+    def __init__(self, array_fields, slots, context=mp):
+        """array_fields: {tuple position: (max_shape, dtype)}. context: the multiprocessing context of the processes."""
+        self.array_positions = sorted(array_fields)
+        self.ring = SharedFrameRing({str(pos): spec for pos, spec in array_fields.items()}, slots)
+        self.metadata = context.Queue(maxsize=slots)    # Never full: there are never more items than busy slots
+        self._lock = context.Lock()     # Busy flags change under it (and its barriers order them with the pixels)
+        self._next_sequence = 0         # Only meaningful in the (single) producer process
+        self._next_slot = 0             # Same
+        self._held_slot = None          # Slot of the item being processed, in a consumer process
+        self.dropped_stale = context.Value('L', 0)
+
+        # Producer side counters (only meaningful in the producer process too)
+        self.dropped = 0                # Non-blocking puts that found the ring full
+        self.blocked = 0                # Blocking puts that had to wait for room
+        self.high_water = 0
+
+    def full(self):
+        return not (self.ring.busy == 0).any()
+
+    def put(self, item, block=True, timeout=None):
+        slot = self._claim_slot()
+        if slot is None:
+            if not block:
+                self.dropped += 1
+                raise queue.Full
+            self.blocked += 1
+            slot = self._wait_for_slot(timeout)
+
+        sequence = self._next_sequence
+        self.ring.sequences[slot] = -1
+        shapes = {}
+        scalars = list(item)
+        for pos in self.array_positions:
+            array = item[pos]
+            scalars[pos] = None
+            if array is None:
+                continue
+            self.ring.write(slot, str(pos), array)
+            shapes[pos] = array.shape
+        self.ring.sequences[slot] = sequence
+        self._next_sequence += 1
+        self.metadata.put((slot, sequence, shapes, scalars), block=block, timeout=timeout)
+        self.high_water = max(self.high_water, self.qsize())
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _claim_slot(self):
+        # The next slot that isn't busy, round robin from the last one written
+        with self._lock:
+            for offset in range(self.ring.slots):
+                slot = (self._next_slot + offset) % self.ring.slots
+                if not self.ring.busy[slot]:
+                    self.ring.busy[slot] = 1
+                    self._next_slot = (slot + 1) % self.ring.slots
+                    return slot
+        return None
+
+    def _wait_for_slot(self, timeout):
+        # Busy flags live in shared memory, with nothing to wait on: poll (this only happens when consumers are late)
+        waited = 0.0
+        while True:
+            slot = self._claim_slot()
+            if slot is not None:
+                return slot
+            if timeout is not None and waited >= timeout:
+                raise queue.Full
+            time.sleep(0.002)
+            waited += 0.002
+
+    def qsize(self):
+        try:
+            return self.metadata.qsize()
+        except NotImplementedError:     # macOS
+            return 0
+
+    def stats(self):
+        return {
+            "depth": self.qsize(),
+            "maxsize": self.ring.slots,
+            "policy": "drop_newest",        # Streaming frames are dropped when the ring is full, crossing frames block
+            "high_water": self.high_water,
+            "put": self._next_sequence,
+            "dropped": self.dropped + self.dropped_stale.value,
+            "spilled": 0,
+            "blocked": self.blocked,
+        }
+
+    def get(self, block=True, timeout=None):
+        self.task_done()    # Whatever this consumer got before is done with by now
+        while True:
+            slot, sequence, shapes, scalars = self.metadata.get(block=block, timeout=timeout)
+            if self.ring.sequences[slot] != sequence:
+                with self.dropped_stale.get_lock():
+                    self.dropped_stale.value += 1
+                continue        # Overwritten meanwhile (should not happen with the busy flags, but just in case)
+            self._held_slot = slot
+            item = scalars
+            for pos, shape in shapes.items():
+                item[pos] = self.ring.view(slot, str(pos), shape)
+            return tuple(item)
+
+    def task_done(self):
+        """The consumer is done with the arrays of its last item: their slot can be written again."""
+        if self._held_slot is None:
+            return
+        with self._lock:
+            self.ring.busy[self._held_slot] = 0
+        self._held_slot = None
+
+    def close(self, unlink=False):
+        self.ring.close(unlink)
@@ -0,0 +1,140 @@
+import bisect
+import time
+
+import numpy as np
+
+
+#
+# Per-stage latency histograms and counters, cheap enough to run on every frame.
+#
+# Observing a duration is a bisect over fixed buckets plus a write into a preallocated ring of recent samples
+# (around a microsecond), with no locks: every stage is timed from a single thread, and a rare lost sample
+# from a race is fine for metrics. Percentiles are only computed when somebody asks for them (/metrics,
+# /get_status), over the recent samples. Bucket counts are cumulative, Prometheus style.
+#
+
+# Bucket upper bounds, in seconds: 50 us to ~13 s, four buckets per doubling
+BUCKETS = tuple(round(0.00005 * 2 ** (i / 4), 7) for i in range(73))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageHistogram:
+    def __init__(self, window):
+        self.window = window
+        self.buckets = [0] * (len(BUCKETS) + 1)     # The last one is +Inf
+        self.recent = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.recent[self.count % self.window] = seconds
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self):
+        samples = self.recent[:min(self.count, self.window)]
+        recent = {}
+        if len(samples):
+            recent = dict(zip((f"p{int(q * 100)}" for q in QUANTILES), np.quantile(samples, QUANTILES).tolist()))
+            recent["max"] = float(samples.max())
+        return {"buckets": list(self.buckets), "count": self.count, "sum": self.sum, "max": self.max, "recent": recent}
+
+
+class StageMetrics:
+    def __init__(self, window=512):
+        """window: recent samples per stage the percentiles are computed over."""
+        self.window = window
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = StageHistogram(self.window)
+        histogram.observe(seconds)
+
+    def lap(self, stage, start):
+        """Observes the time since start (a time.perf_counter() value) and returns now, to time the next stage."""
+        now = time.perf_counter()
+        self.observe(stage, now - start)
+        return now
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def snapshot(self):
+        return {
+            "stages": {stage: histogram.snapshot() for stage, histogram in list(self.stages.items())},
+            "counters": dict(self.counters),
+        }
+
+
+def format_stage_summary(snapshots):
+    """One line per stage: recent p50/p95/p99/max, in ms. snapshots: {process: StageMetrics.snapshot()}."""
+    lines = []
+    for process, snapshot in snapshots.items():
+        for stage, histogram in snapshot["stages"].items():
+            recent = histogram["recent"]
+            if recent:
+                lines.append(f"{stage}{'' if process == 'main' else f' ({process})'}: " +
+                             "/".join(f"{1000 * recent[key]:.2f}" for key in ("p50", "p95", "p99", "max")) + " ms")
+    return lines
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def render_prometheus(snapshots, queue_stats=None, gauges=None):
+    """
+    Prometheus text exposition format.
+    snapshots: {process: StageMetrics.snapshot()}. queue_stats: {queue: pipeline_queue stats}.
+    gauges: [(name, {label: value}, value)], anything else worth a gauge.
+    """
+    lines = [
+        "# HELP lapdetector_stage_seconds Time spent per pipeline stage.",
+        "# TYPE lapdetector_stage_seconds histogram",
+    ]
+    for process, snapshot in snapshots.items():
+        for stage, histogram in snapshot["stages"].items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                lines.append(f"lapdetector_stage_seconds_bucket{_labels(process=process, stage=stage, le=bound)} {cumulative}")
+            lines.append(f"lapdetector_stage_seconds_sum{_labels(process=process, stage=stage)} {histogram['sum']:.6f}")
+            lines.append(f"lapdetector_stage_seconds_count{_labels(process=process, stage=stage)} {histogram['count']}")
+
+    lines += [
+        "# HELP lapdetector_stage_recent_seconds Percentiles of the recent samples per pipeline stage.",
+        "# TYPE lapdetector_stage_recent_seconds gauge",
+    ]
+    for process, snapshot in snapshots.items():
+        for stage, histogram in snapshot["stages"].items():
+            for quantile, value in histogram["recent"].items():
+                lines.append(f"lapdetector_stage_recent_seconds{_labels(process=process, stage=stage, quantile=quantile)} {value:.6f}")
+
+    counters = {}
+    for process, snapshot in snapshots.items():
+        for counter, value in snapshot["counters"].items():
+            counters.setdefault(counter, []).append(f"lapdetector_{counter}_total{_labels(process=process)} {value}")
+    for counter, values in counters.items():
+        lines += [f"# TYPE lapdetector_{counter}_total counter"] + values
+
+    if queue_stats:
+        lines += ["# TYPE lapdetector_queue gauge"]
+        for queue_name, stats in queue_stats.items():
+            for key in ("depth", "maxsize", "high_water", "put", "dropped", "spilled", "blocked"):
+                lines.append(f"lapdetector_queue{_labels(queue=queue_name, stat=key)} {stats.get(key, 0)}")
+
+    typed = set()
+    for name, labels, value in gauges or []:
+        if name not in typed:
+            lines.append(f"# TYPE lapdetector_{name} gauge")
+            typed.add(name)
+        lines.append(f"lapdetector_{name}{_labels(**labels) if labels else ''} {value}")
+
+    return "\n".join(lines) + "\n"
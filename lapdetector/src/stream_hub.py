@@ -0,0 +1,120 @@
+import threading
+import time
+
+
+#
+# Broadcast hub for the MJPEG streams.
+#
+# Frames are encoded once (per quality level actually being watched) upstream and published here; every
+# viewer subscribes and gets its own latest-frame slot. Publishing never waits for viewers: a slow viewer
+# just has its unsent frame replaced by the newest one (and the drop is counted), so it can't hold back the
+# pipeline nor the other viewers. Viewers can ask for a lower quality level and cap their frame rate.
+#
+
+class StreamSubscriber:
+    def __init__(self, hub, quality, max_fps):
+        self.hub = hub
+        self.quality = quality
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self._condition = threading.Condition()
+        self._frame = None
+        self._last_offer_time = 0.0
+        self.closed = False
+
+        # Counters
+        self.delivered = 0
+        self.dropped = 0            # Frames replaced before the viewer got them (slow viewer)
+        self.skipped = 0            # Frames skipped because of the viewer frame rate cap
+
+    def offer(self, jpegs, now):
+        frame = jpegs.get(self.quality)
+        if frame is None:
+            return                  # Encoded before this viewer's quality level was requested
+        if now - self._last_offer_time < self.min_interval:
+            self.skipped += 1
+            return
+        self._last_offer_time = now
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Returns the latest frame not sent yet, or None after timeout."""
+        with self._condition:
+            if self._frame is None and not self._condition.wait_for(lambda: self._frame is not None or self.closed, timeout=timeout):
+                return None
+            frame, self._frame = self._frame, None
+        if frame is not None:
+            self.delivered += 1
+        return frame
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self.hub.unsubscribe(self)
+
+
+class StreamHub:
+    def __init__(self, name, quality_levels, on_change=None):
+        """
+        quality_levels: JPEG qualities viewers can pick from; the highest one is the default.
+        on_change: called with the set of quality levels being watched whenever it changes, so the
+        encoder can skip the levels (all of them, when there are no viewers) nobody is watching.
+        """
+        self.name = name
+        self.quality_levels = sorted(quality_levels)
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.published = 0
+
+    def quality_level(self, quality):
+        # Highest level not above the requested quality (quality caps can only go down)
+        if quality is None:
+            return self.quality_levels[-1]
+        levels = [q for q in self.quality_levels if q <= quality]
+        return levels[-1] if levels else self.quality_levels[0]
+
+    def subscribe(self, quality=None, max_fps=None):
+        subscriber = StreamSubscriber(self, self.quality_level(quality), max_fps)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        self._notify_change()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.remove(subscriber)
+        self._notify_change()
+
+    def publish(self, jpegs):
+        """jpegs: {quality level: JPEG bytes}, the same frame encoded at every level being watched."""
+        now = time.time()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(jpegs, now)
+        self.published += 1
+
+    def qualities(self):
+        with self._lock:
+            return {s.quality for s in self._subscribers}
+
+    def viewers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def status(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        dropped = sum(s.dropped for s in subscribers)
+        return f"{len(subscribers)} viewers, {self.published} frames published, {dropped} dropped by slow viewers"
+
+    def _notify_change(self):
+        if self.on_change is not None:
+            self.on_change(self.name, self.qualities())
@@ -0,0 +1,194 @@
+import glob
+import os
+import subprocess
+import time
+from collections import deque, namedtuple
+
+
+#
+# System status (CPU usage, temperature and clocks, memory, firmware throttling) sampled in the background, at a
+# fixed rate, into a ring of the last samples.
+#
+# The status page used to gather it in the request itself: psutil, plus two vcgencmd processes (fork, exec and a
+# mailbox round trip to the firmware, tens of ms on a Pi) every few seconds, on the same CPU the capture loop runs
+# on. Now every number but the firmware ones comes straight from procfs and sysfs (a few small file reads, no
+# process), the firmware is only asked every few samples (or never, when the kernel exposes its throttling flags
+# in sysfs), and the pages and the quality governor read the last sample: what the status costs no longer depends
+# on how many dashboards are open.
+#
+# The ring doubles as a short time series, so a dashboard can plot the last minutes (ie. temperature climbing
+# before a throttle) without anything else keeping them.
+#
+
+SystemSample = namedtuple("SystemSample", [
+    "time",             # Epoch seconds
+    "cpu_percent",      # Whole CPU usage since the previous sample...
+    "cpu_percents",     # ...and per CPU
+    "cpu_temp",         # C, None if unknown
+    "cpu_freq_mhz",     # Per CPU, as set by the kernel (cpufreq)
+    "cpu_max_freq_mhz",
+    "arm_clock_mhz",    # Actual ARM clock, as measured by the firmware (lower than cpufreq's when it caps it)
+    "mem_percent",
+    "mem_used_mb",
+    "mem_total_mb",
+    "throttled",        # Firmware throttling flags (see THROTTLED_FLAGS), None if unknown
+])
+
+THROTTLED_FLAGS = {
+    0x1: "Under-voltage",
+    0x2: "Freq capped",
+    0x4: "Throttled",
+    0x8: "Temp soft limit",
+    0x10000: "Under-voltage occurred",
+    0x20000: "Freq cap occurred",
+    0x40000: "Throttle occurred",
+    0x80000: "Temp limit occurred"
+}
+THROTTLED_NOW_FLAGS = 0xF     # Under-voltage, frequency capped, throttled or soft temperature limit, right now
+
+# Recent kernels on the Pi expose the firmware throttling flags here: no vcgencmd needed at all
+THROTTLED_SYSFS = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_cpu_times():
+    """(busy, total) jiffies of the whole CPU, then of every CPU, from /proc/stat."""
+    times = []
+    for line in (read_file("/proc/stat") or "").splitlines():
+        if not line.startswith("cpu"):
+            break
+        # user nice system idle iowait irq softirq steal (guest time is already in user)
+        values = [int(value) for value in line.split()[1:9]]
+        total = sum(values)
+        times.append((total - values[3] - values[4], total))
+    return times
+
+
+def read_memory():
+    """(used, total) bytes, from /proc/meminfo. Used as in free's "used": everything but what's available."""
+    fields = {}
+    for line in (read_file("/proc/meminfo") or "").splitlines():
+        name, _, value = line.partition(":")
+        if name in ("MemTotal", "MemAvailable"):
+            fields[name] = int(value.split()[0]) * 1024
+    if len(fields) < 2:
+        return None, None
+    return fields["MemTotal"] - fields["MemAvailable"], fields["MemTotal"]
+
+
+def find_cpu_thermal_zone():
+    # The SoC one (cpu-thermal on the Pi), or else the first one
+    zones = sorted(glob.glob("/sys/class/thermal/thermal_zone*"))
+    for zone in zones:
+        if "cpu" in (read_file(os.path.join(zone, "type")) or ""):
+            return os.path.join(zone, "temp")
+    return os.path.join(zones[0], "temp") if zones else None
+
+
+def vcgencmd(*args):
+    """Value after the '=' of a vcgencmd answer, or None when there's no vcgencmd (not a Pi)."""
+    try:
+        out = subprocess.check_output(["vcgencmd", *args], stderr=subprocess.DEVNULL, timeout=2).decode()
+        return out.strip().split("=")[1]
+    except Exception:
+        return None
+
+
+class SystemSampler:
+    def __init__(self, history=720, firmware_every=12):
+        self.samples = deque(maxlen=history)    # Ring of the last {history} samples
+        self.firmware_every = firmware_every    # Samples between two vcgencmd calls
+        self.sample_count = 0
+        self.cpu_times = read_cpu_times()       # Usage is the busy share of the jiffies elapsed since the previous sample
+        self.thermal_path = find_cpu_thermal_zone()
+        self.freq_paths = sorted(glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq"),
+                                 key=lambda path: int(path.split("/")[5][3:]))
+        max_freq = read_file("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq")
+        self.cpu_max_freq_mhz = int(max_freq) / 1000 if max_freq else None
+        self.throttled_sysfs = os.path.exists(THROTTLED_SYSFS)
+        self.arm_clock_mhz = None
+        self.throttled = None
+
+    def sample(self, now=None):
+        """Takes a sample (a few file reads; a vcgencmd call every firmware_every samples) and returns it."""
+        cpu_times = read_cpu_times()
+        usages = []
+        for (busy, total), (previous_busy, previous_total) in zip(cpu_times, self.cpu_times):
+            elapsed = total - previous_total
+            usages.append(100.0 * (busy - previous_busy) / elapsed if elapsed > 0 else 0.0)
+        self.cpu_times = cpu_times
+
+        temp = read_file(self.thermal_path) if self.thermal_path else None
+        freqs = [read_file(path) for path in self.freq_paths]
+        used, total = read_memory()
+
+        if self.throttled_sysfs:
+            flags = read_file(THROTTLED_SYSFS)
+            self.throttled = int(flags, 16) if flags else None
+        if self.sample_count % self.firmware_every == 0:
+            clock = vcgencmd("measure_clock", "arm")
+            self.arm_clock_mhz = int(clock) / 1000000 if clock else None
+            if not self.throttled_sysfs:
+                flags = vcgencmd("get_throttled")
+                self.throttled = int(flags, 16) if flags else None
+        self.sample_count += 1
+
+        sample = SystemSample(
+            time=time.time() if now is None else now,
+            cpu_percent=usages[0] if usages else None,
+            cpu_percents=usages[1:],
+            cpu_temp=int(temp) / 1000 if temp else None,
+            cpu_freq_mhz=[int(freq) / 1000 for freq in freqs if freq],
+            cpu_max_freq_mhz=self.cpu_max_freq_mhz,
+            arm_clock_mhz=self.arm_clock_mhz,
+            mem_percent=100.0 * used / total if total else None,
+            mem_used_mb=used // (1024 * 1024) if total else None,
+            mem_total_mb=total // (1024 * 1024) if total else None,
+            throttled=self.throttled)
+        self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def history(self, seconds=None):
+        """The samples of the last {seconds} (all of the ring by default), oldest first, as columns: {field: [values]}."""
+        samples = list(self.samples)
+        if seconds is not None and samples:
+            since = samples[-1].time - seconds
+            samples = [sample for sample in samples if sample.time >= since]
+        return {field: [getattr(sample, field) for sample in samples] for field in SystemSample._fields}
+
+
+def format_throttled(flags):
+    if flags is None:
+        return "N/A"
+    messages = [message for bit, message in THROTTLED_FLAGS.items() if flags & bit]
+    return "OK" if not messages else "; ".join(messages)
+
+
+def format_system_status(sample):
+    """Texts of the status panel fields, from a sample (None before the first one)."""
+    if sample is None:
+        return {"cpu_usage": "Calculating...", "cpu_temp": "N/A", "cpu_freq": "N/A", "mem_usage": "N/A",
+                "throttling_status": "Checking..."}
+    cpu_usage = "N/A" if sample.cpu_percent is None else (
+        f"{sample.cpu_percent:.1f}% ({', '.join(f'{usage:.1f}' for usage in sample.cpu_percents)})")
+    # The firmware's measure when there's one (it's the real clock), the kernel's otherwise
+    freq = sample.arm_clock_mhz or (max(sample.cpu_freq_mhz) if sample.cpu_freq_mhz else None)
+    max_freq = "?" if sample.cpu_max_freq_mhz is None else f"{sample.cpu_max_freq_mhz:.0f}"
+    return {
+        "cpu_usage": cpu_usage,
+        "cpu_temp": f"{sample.cpu_temp:.1f} C" if sample.cpu_temp is not None else "N/A",
+        "cpu_freq": "N/A" if freq is None else f"{freq:.0f} / {max_freq} MHz",
+        "mem_usage": "N/A" if sample.mem_percent is None else (
+            f"{sample.mem_percent:.1f}% ({sample.mem_used_mb} MB / {sample.mem_total_mb} MB)"),
+        "throttling_status": format_throttled(sample.throttled),
+    }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules live in src/ and import each other by name, as when run from there
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
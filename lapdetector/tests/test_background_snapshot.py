@@ -0,0 +1,52 @@
+import numpy as np
+
+from background_snapshot import load_snapshot, matches, save_snapshot, scene_similarity
+
+KEY = (720, 1280, 0.5, 100, 620)
+
+
+def scene(seed=1, shape=(120, 160)):
+    rng = np.random.default_rng(seed)
+    image = np.zeros(shape, np.uint8)
+    for _ in range(12):
+        y, x = rng.integers(0, shape[0] - 20), rng.integers(0, shape[1] - 20)
+        image[y:y + 20, x:x + 20] = rng.integers(60, 255)
+    return image
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "background.npz")
+    save_snapshot(path, scene(), KEY, "MOG2", frame_time=12.5)
+    background, meta = load_snapshot(path)
+    assert (background == scene()).all() and meta["time"] == 12.5
+    assert not (tmp_path / "background.npz.tmp").exists()
+
+
+def test_missing_or_broken_snapshot(tmp_path):
+    assert load_snapshot(str(tmp_path / "none.npz")) is None
+    (tmp_path / "broken.npz").write_bytes(b"not a snapshot")
+    assert load_snapshot(str(tmp_path / "broken.npz")) is None
+
+
+def test_matches_only_the_same_model(tmp_path):
+    path = str(tmp_path / "background.npz")
+    save_snapshot(path, scene(), KEY, "MOG2")
+    background, meta = load_snapshot(path)
+    assert matches(meta, background, KEY, "MOG2")
+    assert not matches(meta, background, KEY, "KNN")
+    assert not matches(meta, background, (720, 1280, 0.25, 100, 620), "MOG2")
+    assert not matches(meta, background[:, :100], KEY, "MOG2")
+
+
+def test_same_scene_whatever_the_exposure():
+    background = scene()
+    brighter = np.clip(background.astype(np.int16) * 2 // 3 + 40, 0, 255).astype(np.uint8)
+    correlation, shift = scene_similarity(background, background)
+    assert correlation > 0.99 and shift == 0
+    correlation, shift = scene_similarity(background, brighter)
+    assert correlation > 0.99 and shift > 5
+
+
+def test_a_different_scene():
+    correlation, _ = scene_similarity(scene(1), scene(2))
+    assert correlation < 0.5
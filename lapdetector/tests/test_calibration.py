@@ -0,0 +1,65 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from calibration import GroundCalibration, SpeedEstimator
+
+
+def test_speed_from_a_least_squares_fit():
+    speed = SpeedEstimator(window=12)
+    for n in range(30):     # 2 m/s along X, with a jittering Y, over more positions than the window
+        speed.add(100.0 + n / 60, 2.0 * n / 60, 0.001 * (-1) ** n)
+    assert speed.speed() == pytest.approx(2.0, abs=1e-3)
+
+
+def test_speed_is_signed_as_the_x_axis():
+    speed = SpeedEstimator()
+    for n in range(5):
+        speed.add(n / 60, -1.5 * n / 60, 0.0)
+    assert speed.speed() == pytest.approx(-1.5)
+
+
+def test_speed_needs_two_positions_on_the_track():
+    speed = SpeedEstimator()
+    speed.add(0.0, 1.0, 1.0)
+    speed.add(0.1, math.nan, 1.0)   # Off the track: ignored
+    assert speed.speed() == 0.0
+    speed.add(0.1, 1.2, 1.0)
+    assert speed.speed() == pytest.approx(2.0)
+    speed.reset()
+    assert speed.speed() == 0.0
+
+
+def test_homography_lookup_table_at_any_resolution():
+    # 100 px per meter, at 1280x720
+    calibration = GroundCalibration(homography=np.diag([0.01, 0.01, 1.0]), image_size=(1280, 720))
+    world_x, world_y = calibration.lookup_table(640, 360)
+    assert world_x.shape == (360, 640)
+    assert world_x[0, 0] == pytest.approx(0.01) and world_y[359, 639] == pytest.approx(7.19)
+    assert calibration.lookup_table(640, 360)[0] is world_x     # Cached until the size changes
+    assert calibration.lookup_table(320, 180)[0] is not world_x
+    assert calibration.world_point(10000, -5, 320, 180) == pytest.approx((12.78, 0.02))     # Clamped to the image
+
+
+def test_camera_model_lookup_table():
+    world_x, world_y = GroundCalibration().lookup_table(64, 36)
+    assert np.isfinite(world_x).all()   # 30 degrees of tilt with a 41 degree field of view: no horizon in sight
+    assert world_x[18, 0] < 0 < world_x[18, 63]
+    assert (np.diff(world_y[:, 32]) < 0).all()  # Further away towards the top of the image
+    world_x, _ = GroundCalibration(camera={"tilt_deg": 80}).lookup_table(64, 36)
+    assert np.isnan(world_x[0]).all()   # Above the horizon
+
+
+def test_homography_fitted_from_points(tmp_path):
+    path = tmp_path / "calibration.json"
+    path.write_text(json.dumps({"image_size": [1280, 720], "image_points": [[0, 0], [1280, 0], [1280, 720], [0, 720]],
+                                "world_points": [[0, 0], [2.56, 0], [2.56, 1.44], [0, 1.44]]}))
+    calibration = GroundCalibration.from_file(str(path))
+    assert calibration.world_point(640, 360, 1280, 720) == pytest.approx((1.281, 0.721), abs=1e-3)
+
+
+def test_homography_needs_its_image_size():
+    with pytest.raises(ValueError):
+        GroundCalibration(homography=np.eye(3))
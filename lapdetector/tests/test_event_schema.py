@@ -0,0 +1,75 @@
+import json
+import uuid
+
+import pytest
+
+from event_schema import crossing_event, form_fields, from_binary, pack_batch, to_binary, to_json, unpack_batch, with_images
+
+
+def sample_event(**changes):
+    crossing = {"sequence": 7, "frame_sequence": 1234, "crossing_time": 1700000000.123456, "frame_time": 1700000000.130001,
+                "uncertainty": 0.0021, "direction": 2, "lane": 1, "bbox": (412, 220, 300, 130), "speed_kmh": 12.345,
+                "edge_pixels": 48, "burst": "20261018_101010_123"}
+    event = crossing_event({**crossing, **changes}, time_text="2026/10/18 10:10:10")
+    return with_images(event, uuid.uuid4().hex, [("b-thumb.jpg", b"thumb"), ("photo-finish.jpg", b"photo")])
+
+
+def test_binary_round_trip():
+    event = sample_event()
+    assert from_binary(to_binary(event)) == event
+
+
+def test_binary_round_trip_without_optional_fields():
+    event = sample_event(uncertainty=None, lane=None, bbox=None, speed_kmh=None, burst=None, before_track_start=True)
+    back = from_binary(to_binary(event))
+    assert back == {**event, "lane": None, "bbox": None}
+    assert back["before_track_start"] and back["uncertainty_ms"] is None and "burst" not in back
+
+
+def test_json_round_trip_and_size():
+    event = sample_event()
+    assert json.loads(to_json(event)) == event
+    assert len(to_binary(event)) < len(to_json(event)) / 2
+
+
+def test_batches():
+    records = [to_binary(sample_event(sequence=n)) for n in range(3)]
+    assert unpack_batch(pack_batch(records)) == records
+    with pytest.raises(ValueError):
+        unpack_batch(pack_batch(records)[:-1])
+
+
+def test_every_truncation_is_a_value_error():
+    record = to_binary(sample_event())
+    for length in range(len(record)):
+        with pytest.raises(ValueError):
+            from_binary(record[:length])
+
+
+def test_malformed_records_are_value_errors():
+    record = to_binary(sample_event())
+    with pytest.raises(ValueError):
+        from_binary(b"XX" + record[2:])                 # Not an event
+    with pytest.raises(ValueError):
+        from_binary(record[:2] + b"\x09" + record[3:])  # Unknown version
+    with pytest.raises(ValueError):
+        from_binary(record + b"\x00")                   # Trailing bytes
+    broken = bytearray(record)
+    broken[-1] = 0xFF                                   # Last byte of the time string: not UTF-8 anymore
+    with pytest.raises(ValueError):
+        from_binary(bytes(broken))
+
+
+def test_long_strings_are_truncated_on_a_character_boundary():
+    event = sample_event(burst="é" * 200)   # 400 bytes of UTF-8
+    back = from_binary(to_binary(event))
+    assert back["burst"] == "é" * 127
+
+
+def test_form_fields_are_what_the_original_server_takes():
+    fields = form_fields(sample_event())
+    assert fields["time"] == "2026/10/18 10:10:10" and fields["crossing_status"] == 2
+    assert fields["crossing_time"] == "1700000000.123456" and fields["bbox"] == "412,220,300,130"
+    assert "before_track_start" not in fields
+    legacy = {"time": "2025/01/01 00:00:00", "crossing_status": 1}
+    assert form_fields(legacy) is legacy
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+
+from event_spool import EventSpool
+
+
+def spool_with(tmp_path, count, max_bytes=1024 * 1024):
+    spool = EventSpool(str(tmp_path), max_bytes)
+    ids = [spool.append({"lap": n}, [("image.jpg", bytes([n]) * 100)], crossing_time=float(n)) for n in range(count)]
+    return spool, ids
+
+
+def test_claim_due_oldest_first_with_images(tmp_path):
+    spool, ids = spool_with(tmp_path, 3)
+    events = spool.claim_due(limit=2)
+    assert [event.event_id for event in events] == ids[:2]
+    assert events[0].fields == {"lap": 0} and events[0].images == [("image.jpg", bytes([0]) * 100)]
+    assert events[1].crossing_time == 1.0 and events[1].attempts == 0
+
+
+def test_claimed_events_are_leased(tmp_path):
+    spool, ids = spool_with(tmp_path, 2)
+    now = 1000.0
+    assert [event.event_id for event in spool.claim_due(lease=10, now=now)] == ids[:1]
+    assert [event.event_id for event in spool.claim_due(lease=10, now=now)] == ids[1:]     # The first one is leased
+    assert spool.claim_due(lease=10, now=now) == []
+    # Nobody acknowledged them by the end of the lease (ie. the publisher died): due again
+    assert [event.event_id for event in spool.claim_due(limit=5, now=now + 11)] == ids
+
+
+def test_ack_forgets_the_event_and_its_images(tmp_path):
+    spool, ids = spool_with(tmp_path, 2)
+    spool.ack(ids[0])
+    assert spool.pending() == 1
+    assert os.listdir(spool.blob_directory) == [f"{ids[1]}-image.jpg"]
+    assert [event.event_id for event in spool.claim_due(limit=5)] == ids[1:]
+
+
+def test_retry_later_counts_the_attempt_and_waits(tmp_path):
+    spool, ids = spool_with(tmp_path, 1)
+    spool.claim_due()
+    spool.retry_later(ids[0], delay=60)
+    assert spool.claim_due() == []
+    (event,) = spool.claim_due(now=time.time() + 61)
+    assert event.event_id == ids[0] and event.attempts == 1
+
+
+def test_in_order_claims_stop_at_the_first_event_not_due(tmp_path):
+    spool, ids = spool_with(tmp_path, 3)
+    now = 1000.0
+    assert [event.event_id for event in spool.claim_due(lease=10, now=now, in_order=True)] == ids[:1]
+    assert spool.claim_due(limit=5, lease=10, now=now, in_order=True) == []    # The head is in flight
+    spool.ack(ids[0])
+    assert [event.event_id for event in spool.claim_due(limit=5, lease=10, now=now, in_order=True)] == ids[1:]
+
+
+def test_posted_events_only_retry_their_images(tmp_path):
+    spool, ids = spool_with(tmp_path, 2)
+    assert not any(event.posted for event in spool.claim_due(limit=2))
+    spool.mark_posted(ids[0])
+    spool.retry_later(ids[0], 0)
+    spool.retry_later(ids[1], 0)
+    first, second = spool.claim_due(limit=2, now=time.time() + 61)
+    assert first.posted and first.images == [("image.jpg", bytes([0]) * 100)] and first.attempts == 1
+    assert not second.posted
+
+
+def test_spools_of_older_versions_are_upgraded(tmp_path):
+    db = sqlite3.connect(str(tmp_path / "events.db"))
+    db.execute("""
+        CREATE TABLE events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, event_id TEXT UNIQUE NOT NULL, created REAL NOT NULL,
+            crossing_time REAL, fields TEXT NOT NULL, images TEXT NOT NULL, size INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0
+        )""")
+    db.execute("INSERT INTO events (event_id, created, fields, images, size) VALUES ('old', 0, '{}', '[]', 0)")
+    db.commit()
+    db.close()
+    (event,) = EventSpool(str(tmp_path), 1024 * 1024).claim_due()
+    assert event.event_id == "old" and not event.posted
+
+
+def test_attach_adds_a_late_image(tmp_path):
+    spool, ids = spool_with(tmp_path, 1)
+    spool.attach(ids[0], "photo-finish.jpg", b"pf")
+    (event,) = spool.claim_due()
+    assert event.images == [("image.jpg", bytes([0]) * 100), ("photo-finish.jpg", b"pf")]
+    spool.ack(ids[0])
+    spool.attach(ids[0], "late.jpg", b"x")  # Published meanwhile: nothing left behind
+    assert os.listdir(spool.blob_directory) == []
+
+
+def test_compact_drops_the_images_of_the_oldest_events(tmp_path):
+    spool, ids = spool_with(tmp_path, 5, max_bytes=250)
+    assert spool.size_bytes() <= 250
+    assert spool.compacted_events == 3
+    events = spool.claim_due(limit=5)
+    assert [event.event_id for event in events] == ids     # Lap times are always kept
+    assert [len(event.images) for event in events] == [0, 0, 0, 1, 1]
+
+
+def test_survives_a_restart(tmp_path):
+    spool, ids = spool_with(tmp_path, 2)
+    spool.claim_due()
+    open(os.path.join(spool.blob_directory, "orphan.jpg"), "wb").close()     # Written right before a crash
+    reopened = EventSpool(str(tmp_path), 1024 * 1024)
+    assert reopened.pending() == 2
+    assert "orphan.jpg" not in os.listdir(reopened.blob_directory)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from frame_burst import FrameBurst
+
+SHAPE = (8, 12, 3)
+
+
+def feed(burst, start, count):
+    for n in range(start, start + count):
+        burst.append(np.full(SHAPE, n, np.uint8), n / 60)
+
+
+def test_burst_of_the_frames_around_the_crossing():
+    burst = FrameBurst(SHAPE, 10)
+    feed(burst, 0, 6)
+    assert burst.arm(5 / 60, 1, frames_before=2, frames_after=2)
+    feed(burst, 6, 1)
+    assert burst.collect() is None  # The frames after it aren't all in yet
+    feed(burst, 7, 1)
+    crossing_time, status, slots, times = burst.collect()
+    assert (crossing_time, status) == (5 / 60, 1) and not burst.armed
+    assert [int(burst.frames[slot][0, 0, 0]) for slot in slots] == [3, 4, 5, 6, 7]
+    assert np.allclose(times, np.arange(3, 8) / 60)
+
+
+def test_one_burst_at_a_time():
+    burst = FrameBurst(SHAPE, 10)
+    feed(burst, 0, 3)
+    assert burst.arm(2 / 60, 1, 1, 1)
+    assert not burst.arm(2 / 60, 2, 1, 1)
+
+
+def test_frozen_slots_are_never_written():
+    burst = FrameBurst(SHAPE, 6)
+    feed(burst, 0, 3)
+    burst.arm(2 / 60, 1, 2, 0)
+    _, _, slots, _ = burst.collect()
+    feed(burst, 3, 10)      # The ring goes round the three frozen slots
+    assert [int(burst.frames[slot][0, 0, 0]) for slot in slots] == [0, 1, 2]
+    assert burst.skipped == 0
+    burst.release(slots)
+    assert not burst.frozen.any()
+
+
+def test_every_slot_frozen_skips_frames():
+    burst = FrameBurst(SHAPE, 3)
+    feed(burst, 0, 3)
+    burst.arm(2 / 60, 1, 2, 0)
+    burst.collect()
+    feed(burst, 3, 2)
+    assert burst.skipped == 2 and burst.count == 5
+
+
+def test_downscaled_into_the_ring():
+    burst = FrameBurst((720, 1280, 3), 2, scaling=0.25)
+    assert burst.frames.shape == (2, 180, 320, 3)
+    assert FrameBurst.frame_bytes((720, 1280, 3), 0.25) == 180 * 320 * 3
+    burst.append(np.full((720, 1280, 3), 9, np.uint8), 0.0)
+    assert (burst.frames[0] == 9).all()
@@ -0,0 +1,58 @@
+import threading
+
+import numpy as np
+import pytest
+
+from frame_pool import FramePool
+
+FIELDS = {"frame": ((4, 6, 3), np.uint8)}
+
+
+def test_slot_goes_back_when_its_last_holder_releases_it():
+    pool = FramePool(FIELDS, 1)
+    slot = pool.acquire()
+    slot.retain()       # Handed over to a second holder
+    slot.release()
+    assert pool.in_use() == 1 and pool.acquire() is None
+    slot.release()
+    assert pool.in_use() == 0
+    assert pool.acquire() is slot
+
+
+def test_generation_spots_a_recycled_slot():
+    pool = FramePool(FIELDS, 1)
+    slot = pool.acquire()
+    generation = slot.generation
+    slot.release()
+    assert pool.acquire().generation == generation + 1
+
+
+def test_refcount_misuse_raises():
+    pool = FramePool(FIELDS, 1)
+    slot = pool.acquire()
+    slot.release()
+    with pytest.raises(RuntimeError):
+        slot.release()
+    with pytest.raises(RuntimeError):
+        slot.retain()
+
+
+def test_exhausted_pool_drops_or_waits():
+    pool = FramePool(FIELDS, 2)
+    slots = [pool.acquire(), pool.acquire()]
+    assert pool.acquire() is None
+    threading.Timer(0.05, slots[0].release).start()
+    assert pool.acquire(block=True, timeout=2) is slots[0]
+    assert pool.exhausted == 2 and pool.high_water == 2 and pool.acquired == 3
+
+
+def test_views_and_borrows_share_the_slot_buffers():
+    pool = FramePool(FIELDS, 1)
+    slot = pool.acquire()
+    small = slot.view("frame", (2, 3, 3))
+    small[:] = 7
+    assert (slot["frame"].reshape(-1)[:18] == 7).all()
+    borrowed = slot.borrow("frame")
+    assert not borrowed.flags.writeable and np.shares_memory(borrowed, slot["frame"])
+    with pytest.raises(ValueError):
+        slot.view("frame", (5, 6, 3))
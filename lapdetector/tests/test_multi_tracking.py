@@ -0,0 +1,43 @@
+import numpy as np
+
+from multi_tracking import associate, bbox_arrays, iou_matrix
+
+
+def test_iou_matrix():
+    a = bbox_arrays([(0, 0, 10, 10)])
+    b = bbox_arrays([(0, 0, 10, 10), (5, 0, 10, 10), (20, 20, 5, 5)])
+    assert np.allclose(iou_matrix(a, b), [[1.0, 50 / 150, 0.0]])
+
+
+def test_associate_best_iou_first():
+    tracks = bbox_arrays([(0, 0, 10, 10), (100, 0, 10, 10)])
+    detections = bbox_arrays([(102, 0, 10, 10), (1, 0, 10, 10)])
+    matches, unmatched = associate(tracks, [0, 0], detections, [0, 0], min_iou=0.1, max_distance=40)
+    assert sorted(matches) == [(0, 1), (1, 0)] and unmatched == []
+
+
+def test_associate_falls_back_to_centroid_distance():
+    # A small fast car: no overlap with where it was, but close enough
+    tracks = bbox_arrays([(0, 0, 10, 10)])
+    detections = bbox_arrays([(15, 0, 10, 10), (200, 0, 10, 10)])
+    matches, unmatched = associate(tracks, [0], detections, [0, 0], min_iou=0.1, max_distance=40)
+    assert matches == [(0, 0)] and unmatched == [1]
+
+
+def test_associate_only_within_the_same_lane():
+    tracks = bbox_arrays([(0, 0, 10, 10)])
+    detections = bbox_arrays([(0, 0, 10, 10)])
+    matches, unmatched = associate(tracks, [0], detections, [1], min_iou=0.1, max_distance=40)
+    assert matches == [] and unmatched == [0]
+
+
+def test_associate_one_detection_per_track():
+    tracks = bbox_arrays([(0, 0, 10, 10)])
+    detections = bbox_arrays([(0, 0, 10, 10), (2, 0, 10, 10)])
+    matches, unmatched = associate(tracks, [0], detections, [0, 0], min_iou=0.1, max_distance=40)
+    assert matches == [(0, 0)] and unmatched == [1]
+
+
+def test_associate_without_tracks_or_detections():
+    assert associate(bbox_arrays([]), [], bbox_arrays([(0, 0, 1, 1)]), [0], 0.1, 40) == ([], [0])
+    assert associate(bbox_arrays([(0, 0, 1, 1)]), [0], bbox_arrays([]), [], 0.1, 40) == ([], [])
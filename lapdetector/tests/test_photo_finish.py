@@ -0,0 +1,65 @@
+import numpy as np
+
+from photo_finish import PhotoFinish
+
+FPS = 100
+HEIGHT, WIDTH = 20, 40
+
+
+def frame(n):
+    return np.full((HEIGHT, WIDTH, 3), n % 256, np.uint8)
+
+
+def feed(photo_finish, start, stop, line_x=20):
+    for n in range(start, stop):
+        photo_finish.append(frame(n), line_x, 0, HEIGHT, n / FPS)
+
+
+def test_photo_finish_around_the_crossing():
+    photo_finish = PhotoFinish(HEIGHT, 1, 40)
+    feed(photo_finish, 0, 30)
+    assert photo_finish.arm(29 / FPS, 1, 0.1, 0.05)
+    feed(photo_finish, 30, 34)
+    assert photo_finish.collect(33 / FPS) is None      # Not all the frames after it yet
+    feed(photo_finish, 34, 35)
+    crossing_time, status, image, times = photo_finish.collect(34 / FPS)
+    assert (crossing_time, status) == (29 / FPS, 1) and not photo_finish.armed
+    assert image.shape == (HEIGHT, 15, 3)
+    assert np.allclose(times, np.arange(19, 34) / FPS)
+    assert (image[:6, 10] == (0, 0, 255)).all() and (image[:6, 9] == 28).all()     # The crossing column is ticked
+
+
+def test_close_crossings_each_get_their_photo_finish():
+    photo_finish = PhotoFinish(HEIGHT, 1, 40)
+    feed(photo_finish, 0, 30)
+    assert photo_finish.arm(29 / FPS, 1, 0.1, 0.05)
+    feed(photo_finish, 30, 32)
+    assert photo_finish.arm(31 / FPS, 2, 0.1, 0.05)    # A car right behind: queued, not dropped
+    collected = []
+    for n in range(32, 40):
+        feed(photo_finish, n, n + 1)
+        finished = photo_finish.collect(n / FPS)
+        if finished is not None:
+            collected.append(finished)
+    assert [(crossing_time, status) for crossing_time, status, _, _ in collected] == [(29 / FPS, 1), (31 / FPS, 2)]
+    assert all(image.shape[1] >= 14 for _, _, image, _ in collected)
+    assert not photo_finish.armed
+
+
+def test_cars_in_the_same_frame_share_it():
+    photo_finish = PhotoFinish(HEIGHT, 1, 40)
+    feed(photo_finish, 0, 10)
+    assert photo_finish.arm(9 / FPS, 1, 0.05, 0.02)
+    assert not photo_finish.arm(9 / FPS, 2, 0.05, 0.02)
+    assert len(photo_finish.pending) == 1
+
+
+def test_moving_the_line_cuts_every_pending_crossing_short():
+    photo_finish = PhotoFinish(HEIGHT, 1, 40)
+    feed(photo_finish, 0, 20)
+    photo_finish.arm(18 / FPS, 1, 0.1, 0.05)
+    photo_finish.arm(19 / FPS, 2, 0.1, 0.05)
+    assert photo_finish.append(frame(20), 30, 0, HEIGHT, 20 / FPS)
+    assert not photo_finish.armed
+    assert [photo_finish.collect(20 / FPS)[1], photo_finish.collect(20 / FPS)[1]] == [1, 2]
+    assert photo_finish.collect(20 / FPS) is None
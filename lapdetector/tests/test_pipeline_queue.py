@@ -0,0 +1,86 @@
+import queue
+import threading
+
+import pytest
+
+from pipeline_queue import BLOCK, DROP_NEWEST, DROP_OLDEST, SPILL, PipelineQueue
+
+
+def drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+    return items
+
+
+def test_drop_oldest_evicts_the_oldest_droppable_item():
+    dropped = []
+    q = PipelineQueue("frames", 3, DROP_OLDEST, droppable=lambda item: item != "crossing", on_drop=dropped.append)
+    for item in ("crossing", 1, 2, 3, 4):
+        q.put(item)
+    assert drain(q) == ["crossing", 3, 4]
+    assert dropped == [1, 2]
+    assert q.stats()["dropped"] == 2
+
+
+def test_drop_oldest_with_nothing_droppable_drops_the_new_item_or_blocks():
+    q = PipelineQueue("frames", 2, DROP_OLDEST, droppable=lambda item: item != "crossing")
+    q.put("crossing")
+    q.put("crossing")
+    q.put(1)    # Droppable itself: dropped rather than waiting
+    assert q.stats()["dropped"] == 1
+    with pytest.raises(queue.Full):
+        q.put("crossing", timeout=0.01)     # A crossing waits for room instead
+    assert q.stats()["blocked"] == 1
+
+
+def test_drop_newest_keeps_what_was_there():
+    q = PipelineQueue("frames", 2, DROP_NEWEST)
+    for item in range(4):
+        q.put(item)
+    assert drain(q) == [0, 1]
+    assert q.stats()["dropped"] == 2
+
+
+def test_block_waits_for_room():
+    q = PipelineQueue("crossings", 1, BLOCK)
+    q.put(0)
+    with pytest.raises(queue.Full):
+        q.put_nowait(1)
+    threading.Timer(0.05, q.get).start()
+    q.put(1, timeout=2)     # Room once the consumer got the first one
+    assert drain(q) == [1]
+    assert q.stats()["blocked"] == 2 and q.stats()["dropped"] == 0
+
+
+def test_spill_delivers_the_overflow_in_order():
+    q = PipelineQueue("events", 2, SPILL, spill_limit=10)
+    for item in range(6):
+        q.put(item)
+    stats = q.stats()
+    assert stats["depth"] == 6 and stats["spilled"] == 4 and stats["dropped"] == 0
+    assert drain(q) == list(range(6))
+
+
+def test_spill_beyond_its_limit_drops_the_oldest():
+    dropped = []
+    q = PipelineQueue("events", 2, SPILL, spill_limit=2, on_drop=dropped.append)
+    for item in range(7):
+        q.put(item)
+    assert drain(q) == [3, 4, 5, 6]
+    assert dropped == [0, 1, 2]
+    assert q.stats()["dropped"] == 3
+
+
+def test_spill_needs_a_limit():
+    with pytest.raises(ValueError):
+        PipelineQueue("events", 2, SPILL)
+
+
+def test_high_water_mark():
+    q = PipelineQueue("frames", 4, DROP_OLDEST)
+    for item in range(3):
+        q.put(item)
+    q.get()
+    q.put(3)
+    assert q.stats()["high_water"] == 3 and q.qsize() == 3
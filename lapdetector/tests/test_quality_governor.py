@@ -0,0 +1,68 @@
+from quality_governor import QualityGovernor
+
+STEPS = ({"STREAM_EVERY_X_FRAMES": 6}, {"STREAM_QUALITY": 40}, {"FRAME_SCALING": 0.3})
+BASELINE = {"STREAM_EVERY_X_FRAMES": 3, "STREAM_QUALITY": 70, "FRAME_SCALING": 0.4}
+
+
+def governor(**options):
+    return QualityGovernor(BASELINE, STEPS, **{"degrade_after": 2, "recover_after": 4, "settle_time": 10.0, **options})
+
+
+def test_steps_down_after_pressure_in_a_row():
+    g = governor()
+    assert g.evaluate(0, load=0.95) is None
+    assert g.evaluate(1, load=0.95) == {"STREAM_EVERY_X_FRAMES": 6}
+    assert g.level == 1 and g.decisions[-1]["reason"] == "load 95%"
+
+
+def test_one_relaxed_evaluation_resets_the_pressure_count():
+    g = governor()
+    g.evaluate(0, load=0.95)
+    g.evaluate(1, load=0.5)
+    assert g.evaluate(2, load=0.95) is None and g.level == 0
+
+
+def test_holds_in_the_gap_between_thresholds():
+    g = governor()
+    for now in range(20):
+        assert g.evaluate(now, load=0.7) is None   # Neither pressure nor relaxed
+    assert g.level == 0
+
+
+def test_waits_for_the_settle_time_after_a_change():
+    g = governor()
+    g.evaluate(0, load=0.95)
+    g.evaluate(1, load=0.95)
+    assert g.evaluate(2, load=0.95) is None and g.evaluate(10.9, load=0.95) is None
+    assert g.evaluate(11, load=0.95) == {"STREAM_QUALITY": 40}
+    assert g.settings() == {"STREAM_EVERY_X_FRAMES": 6, "STREAM_QUALITY": 40, "FRAME_SCALING": 0.4}
+
+
+def test_recovers_slower_than_it_degrades():
+    g = governor()
+    g.evaluate(0, load=0.95)
+    g.evaluate(1, load=0.95)
+    changes = [g.evaluate(now, load=0.3) for now in range(20, 24)]
+    assert changes == [None, None, None, {"STREAM_EVERY_X_FRAMES": 3}]
+    assert g.level == 0
+    assert g.evaluate(30, load=0.3) is None     # Nowhere further up
+
+
+def test_heat_and_throttling_are_pressure_and_no_data_is_not_relaxed():
+    g = governor()
+    g.evaluate(0, load=0.3, temperature=80.0)
+    assert g.evaluate(1, load=0.3, throttled=True) == {"STREAM_EVERY_X_FRAMES": 6}
+    for now in range(20, 30):
+        g.evaluate(now, load=None)
+    assert g.level == 1
+    for now in range(30, 34):
+        g.evaluate(now, load=0.3, temperature=70.0)    # Not hot anymore, but not cool enough either
+    assert g.level == 1
+
+
+def test_never_below_the_last_step():
+    g = governor(settle_time=0.0)
+    for now in range(20):
+        g.evaluate(now, load=0.99)
+    assert g.level == len(STEPS)
+    assert "level 3/3" in g.status() and "FRAME_SCALING=0.3" in g.status()
@@ -0,0 +1,25 @@
+import pytest
+
+import rpi_lap_cam_detector as detector
+
+
+def test_values_as_python_literals_or_strings():
+    assert detector.parse_setting("META_LINE_X_PX=720") == ("META_LINE_X_PX", 720)
+    assert detector.parse_setting("LANES=((0.3, 0.5),)") == ("LANES", ((0.3, 0.5),))
+    assert detector.parse_setting("CALIBRATION_FILE=None") == ("CALIBRATION_FILE", None)
+    assert detector.parse_setting("BACKGROUND_SUBTRACTOR=KNN") == ("BACKGROUND_SUBTRACTOR", "KNN")
+    assert detector.parse_setting("EVENTS_SERVER_URL=http://host:5000/a=b") == ("EVENTS_SERVER_URL", "http://host:5000/a=b")
+
+
+@pytest.mark.parametrize("name", ["NO_SUCH_SETTING", "meta_line_x_px", "configure", "os"])
+def test_unknown_names_are_rejected(name):
+    with pytest.raises(ValueError, match="not a detector setting"):
+        detector.configure({name: 1})
+    assert not hasattr(detector, "NO_SUCH_SETTING")
+    assert callable(detector.configure)
+
+
+def test_unknown_tracker_is_rejected(monkeypatch):
+    monkeypatch.setattr(detector, "TRACKER_TYPE", detector.TRACKER_TYPE)
+    with pytest.raises(ValueError, match="not available"):
+        detector.configure({"TRACKER_TYPE": "BOOSTING"})
@@ -0,0 +1,84 @@
+import multiprocessing as mp
+import queue
+
+import numpy as np
+
+from shm_ring import SharedFrameQueue
+
+
+SHAPE = (48, 64, 3)
+ctx = mp.get_context("fork")
+
+
+def make_queue(slots):
+    return SharedFrameQueue({0: (SHAPE, np.uint8)}, slots=slots, context=ctx)
+
+
+def stalled_consumer(frames, holding, drained, results):
+    # Gets one frame, then sits on it (drawing on it, like the post-processing workers do) while others run
+    frame, value = frames.get(timeout=5)
+    holding.set()
+    frame[0, 0] = value
+    drained.wait(timeout=10)
+    results.put((value, bool((frame == value).all())))
+    frames.task_done()
+
+
+def draining_consumer(frames, count, results):
+    for _ in range(count):
+        frame, value = frames.get(timeout=5)
+        intact = bool((frame == value).all())
+        frame[:] = 0    # Scribbles all over the slot, like overlays would
+        results.put((value, intact))
+    frames.task_done()
+
+
+def test_put_get_round_trip():
+    frames = make_queue(slots=3)
+    for value in range(10):
+        frames.put((np.full(SHAPE, value, np.uint8), value))
+        frame, got = frames.get(timeout=1)
+        assert got == value and (frame == value).all()
+    frames.close(unlink=True)
+
+
+def test_non_blocking_put_drops_when_every_slot_is_busy():
+    frames = make_queue(slots=2)
+    frames.put((np.zeros(SHAPE, np.uint8), 0))
+    frames.put((np.zeros(SHAPE, np.uint8), 1))
+    try:
+        frames.put_nowait((np.zeros(SHAPE, np.uint8), 2))
+        assert False, "The ring had no free slot"
+    except queue.Full:
+        pass
+    assert frames.full() and frames.stats()["dropped"] == 1
+    frames.close(unlink=True)
+
+
+def test_stalled_consumer_slot_is_never_overwritten():
+    # Two consumers and a small ring: one of them holds its slot while the other drains many frames. The
+    # producer must go round the held slot rather than write over the frame being processed.
+    frames = make_queue(slots=4)
+    holding, drained = ctx.Event(), ctx.Event()
+    stalled_results, draining_results = ctx.Queue(), ctx.Queue()
+    count = 20
+
+    stalled = ctx.Process(target=stalled_consumer, args=(frames, holding, drained, stalled_results))
+    stalled.start()
+    frames.put((np.full(SHAPE, 1, np.uint8), 1), timeout=5)
+    assert holding.wait(timeout=5), "The stalled consumer never got its frame"   # Before the other one starts
+    draining = ctx.Process(target=draining_consumer, args=(frames, count, draining_results))
+    draining.start()
+    for value in range(2, count + 2):
+        frames.put((np.full(SHAPE, value, np.uint8), value), timeout=5)
+
+    drained_values = [draining_results.get(timeout=10) for _ in range(count)]
+    drained.set()
+    stalled_value = stalled_results.get(timeout=10)
+    stalled.join(timeout=5)
+    draining.join(timeout=5)
+    frames.close(unlink=True)
+
+    assert stalled_value == (1, True)
+    assert sorted(value for value, _ in drained_values) == list(range(2, count + 2))
+    assert all(intact for _, intact in drained_values)